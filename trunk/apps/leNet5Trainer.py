@@ -6,6 +6,7 @@ from six.moves import reduce
 from nn.net import TrainerNetwork as Net
 from nn.contiguousLayer import ContiguousLayer
 from nn.convolutionalLayer import ConvolutionalLayer
+from nn.separableLayer import SeparableConvolutionalLayer
 from dataset.ingest.labeled import ingestImagery
 from dataset.shared import splitToShared
 from nn.trainUtils import trainSupervised
@@ -49,6 +50,15 @@ if __name__ == '__main__' :
                         help='Base name of the network output and temp files.')
     parser.add_argument('--syn', dest='synapse', type=str, default=None,
                         help='Load from a previously saved network.')
+    parser.add_argument('--prune', dest='prune', type=float, default=None,
+                        help='Final sparsity of magnitude pruning on the ' +
+                             'f3 fully-connected layer.')
+    parser.add_argument('--pruneEpochs', dest='pruneEpochs', type=int,
+                        default=20, help='Number of epochs to ramp up to ' +
+                        'the final sparsity.')
+    parser.add_argument('--separable', dest='separable', action='store_true',
+                        help='Use a depthwise separable convolution for ' +
+                             'the c2 layer.')
     parser.add_argument('data', help='Directory or pkl.gz file for the ' +
                                      'training and test sets')
     options = parser.parse_args()
@@ -98,7 +108,11 @@ if __name__ == '__main__' :
         # refactor the output to be (numImages*numKernels, 1, numRows, numCols)
         # this way we don't combine the channels kernels we created in 
         # the first layer and destroy our dimensionality
-        network.addLayer(ConvolutionalLayer(
+        # the separable layer performs far fewer multiplies when the layer
+        # has many input channels
+        c2Layer = SeparableConvolutionalLayer if options.separable else \
+                  ConvolutionalLayer
+        network.addLayer(c2Layer(
             layerID='c2', input=network.getNetworkOutput(), 
             inputSize=network.getNetworkOutputSize(), 
             kernelSize=(options.kernel,options.kernel,5,5),
@@ -120,11 +134,21 @@ if __name__ == '__main__' :
             learningRate=options.learnF, momentumRate=options.momentum,
             activation=None, randomNumGen=rng))
 
+    # the f3 layer holds most of the parameters
+    pruner = None
+    if options.prune is not None :
+        from nn.prune import MagnitudePruner
+        from dataset.writer import resumeEpoch
+        startEpoch = resumeEpoch(options.synapse)
+        pruner = MagnitudePruner(network, ['f3'], options.prune,
+                                 startEpoch, startEpoch + options.pruneEpochs,
+                                 log=log)
+
     trainSupervised(network, __file__, options.data, 
                     numEpochs=options.limit, stop=options.stop, 
                     synapse=options.synapse, base=options.base, 
                     dropout=options.dropout, learnC=options.learnC, 
                     learnF=options.learnF, momentum=options.momentum, 
                     kernel=options.kernel, neuron=options.neuron, 
-                    log=log)
+                    pruner=pruner, log=log)
     del network
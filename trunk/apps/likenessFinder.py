@@ -1,5 +1,6 @@
 import cv2
 import os
+import threading
 import numpy as np
 from six.moves import reduce
 from PIL import Image, ImageDraw, ImageFont
@@ -14,28 +15,78 @@ referenceVector = None
 network = None
 matchSelect = False
 likeness = None
+worker = None
+redraw = True
+
+class NetworkWorker (threading.Thread) :
+    '''The NetworkWorker loads or trains the network in the background, so
+       the window stays responsive while the image is chipped and the
+       network is created.
+
+       image : PIL image to chip and train on
+       log   : Logger to use
+    '''
+    def __init__ (self, image, log=None) :
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._image = image
+        self._log = log
+        self._lock = threading.Lock()
+        self._version = 0
+        self._status = 'Creating the network...'
+
+    def _publish (self, status) :
+        with self._lock :
+            self._status = status
+            self._version += 1
+
+    def getState (self) :
+        '''Return the state for display. The version changes whenever the
+           status changes.
+
+           return : (version, status)
+        '''
+        with self._lock :
+            return self._version, self._status
+
+    def run (self) :
+        global network
+        try :
+            network = createNetwork(self._image, self._log)
+        except Exception as ex :
+            self._publish('Failed to create the network [' + str(ex) + ']')
+            raise
+        self._publish('Double-click to select a region')
 
 def selectRegion (event, x, y, flags, param) :
     if event == cv2.EVENT_LBUTTONDBLCLK :
         # record the mouse click
         global refLocation, misLocation, referenceVector, matchSelect, likeness
+        global redraw
+
+        # the network is created in the background
+        if network is None :
+            return
+        redraw = True
         halfBox = options.chipSize / 2
 
         # chip and find the reference encoded vector
         if matchSelect == False :
             refLocation = [(x-halfBox, y-halfBox), (x+halfBox, y+halfBox)]
-            referenceVector = network.classifyAndSoftmax(
+            referenceVector = network.extractEmbeddings(
                 np.resize(np.array(thumbOrig.crop(
                     (refLocation[0][0], refLocation[0][1],
                      refLocation[1][0], refLocation[1][1]))),
-                    (1, 1, options.chipSize, options.chipSize)))[1][0]
+                    (1, 1, options.chipSize, options.chipSize)),
+                options.layer)[0]
         else :
             misLocation = [(x-halfBox, y-halfBox), (x+halfBox, y+halfBox)]
-            matchVector = network.classifyAndSoftmax(
+            matchVector = network.extractEmbeddings(
                 np.resize(np.array(thumbOrig.crop(
                     (misLocation[0][0], misLocation[0][1], 
                      misLocation[1][0], misLocation[1][1]))),
-                    (1, 1, options.chipSize, options.chipSize)))[1][0]
+                    (1, 1, options.chipSize, options.chipSize)),
+                options.layer)[0]
             if refLocation == None :
                 print "Please select a reference region!"
             else :
@@ -230,13 +281,10 @@ def createNetwork(image, log=None) :
                         '.png', '_preTrainedSAE_epoch' + \
                         str(options.numEpochs) + '.pkl.gz'))
 
-        # cast to the correct network type
-        network.__class__ = ClassifierNetwork
-
     return network
 
 if __name__ == '__main__' :
-    global options, thumbOrig, network, matchSelect
+    global options, thumbOrig, network, matchSelect, worker
 
     import argparse
     parser = argparse.ArgumentParser()
@@ -268,6 +316,8 @@ if __name__ == '__main__' :
                              'unsupervised pre-training.')
     parser.add_argument('--batch', dest='batchSize', type=int, default=1,
                         help='Batch size for training and test sets.')
+    parser.add_argument('--layer', dest='layer', type=int, default=-1,
+                        help='Index of the layer used as the embedding.')
     parser.add_argument('--base', dest='base', type=str, default='./leNet5',
                         help='Base name of the network output and temp files.')
     parser.add_argument('image', help='Input image to train.')
@@ -288,8 +338,10 @@ if __name__ == '__main__' :
                          imageFromDisk.size[1] / options.scale),
                         Image.ANTIALIAS)
 
-    # load a network from disk or train a new network
-    network = createNetwork(thumbOrig, log)
+    # load a network from disk or train a new network -- this runs in the
+    # background so the window stays responsive
+    worker = NetworkWorker(thumbOrig, log)
+    worker.start()
 
     '''
     # grab the image chips
@@ -304,31 +356,41 @@ if __name__ == '__main__' :
     cv2.imshow(windowName, np.array(thumbOrig))
     cv2.setMouseCallback(windowName, selectRegion)
 
-    # allow user input
+    # the RGB conversion of the display and the font are only needed once
+    thumbRGB = thumbOrig.convert('RGB')
+    font = None
+
+    # allow user input -- redraw only when the display changes
     count = 0
+    drawnVersion = None
     while True :
-        thumb = thumbOrig.convert('RGB')
-
-        draw = ImageDraw.Draw(thumb, mode='RGBA')
-        if refLocation is not None :
-            draw.rectangle([refLocation[0], refLocation[1]], 
-                           fill=(0,255,0,100))
-        if misLocation is not None :
-            draw.rectangle([misLocation[0], misLocation[1]], 
-                           fill=(0,255,255,100))
-        if likeness != None :
-            font = ImageFont.truetype("arial.ttf", 16)
-            draw.text([20, 20], "Likeness: " + str(likeness),
-                      font=font, fill=(150,0,200))
-
-        '''
-        for i in regions[count % len(regions)] :
-            draw.rectangle([(i[0], i[1]), (i[2], i[3])], outline=(0,150,0))
-            count += 1
-        '''
-        cv2.imshow(windowName, np.array(thumb))
-
-        ch = chr(cv2.waitKey(1) & 255)
+        version, status = worker.getState()
+        if redraw or version != drawnVersion :
+            thumb = thumbRGB.copy()
+
+            draw = ImageDraw.Draw(thumb, mode='RGBA')
+            if refLocation is not None :
+                draw.rectangle([refLocation[0], refLocation[1]], 
+                               fill=(0,255,0,100))
+            if misLocation is not None :
+                draw.rectangle([misLocation[0], misLocation[1]], 
+                               fill=(0,255,255,100))
+            if likeness != None :
+                if font is None :
+                    font = ImageFont.truetype("arial.ttf", 16)
+                draw.text([20, 20], "Likeness: " + str(likeness),
+                          font=font, fill=(150,0,200))
+            draw.text((5, 5), status, fill=(255,255,0,255))
+
+            '''
+            for i in regions[count % len(regions)] :
+                draw.rectangle([(i[0], i[1]), (i[2], i[3])], outline=(0,150,0))
+                count += 1
+            '''
+            cv2.imshow(windowName, np.array(thumb))
+            drawnVersion, redraw = version, False
+
+        ch = chr(cv2.waitKey(20) & 255)
         
         # 'q' drops out of the loop
         if ch== 'q' :
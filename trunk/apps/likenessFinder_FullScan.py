@@ -1,8 +1,9 @@
 import cv2
 import os
 import theano
+import threading
 import numpy as np
-from six.moves import reduce
+from six.moves import reduce, queue
 from PIL import Image, ImageDraw
 from nn.datasetUtils import normalize
 from nn.profiler import setupLogging
@@ -11,12 +12,13 @@ options = None
 windowName = 'Kirtland AF Base'
 thumbOrig = None
 refLocation = None
-referenceVector = None
 network = None
 likeness = None
 chips = None
 regions = None
-likenessVector = None
+embeddings = None
+worker = None
+redraw = True
 
 def convertImageToNP(image) :
 
@@ -25,40 +27,157 @@ def convertImageToNP(image) :
                                    dtype=theano.config.floatX))
     return np.resize(imageNP, (1, image.size[0], image.size[1]))
 
+def findLikeness(embeddings, referenceVector, k) :
+    '''Find the k chips most similar to the reference with a single
+       matrix-vector product. Only the top k are sorted.
+
+       embeddings      : numpy.ndarray(float32) (numChips, encodingSize)
+       referenceVector : encoding of the reference chip
+       k               : number of matches to return. This is clamped to
+                         the number of chips.
+       return          : (chip indices, scores) in descending similarity
+    '''
+    if k < 1 :
+        raise ValueError('k must be at least one')
+    scores = embeddings.dot(np.asarray(referenceVector, dtype='float32'))
+    k = min(k, len(scores))
+    if k == 0 :
+        return np.empty(0, dtype='int64'), scores
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top, scores[top]
+
+class LikenessWorker (threading.Thread) :
+    '''The LikenessWorker creates the network, encodes the chips and searches
+       them in the background, so the window stays responsive while a large
+       scene is processed.
+
+       The chips are encoded and searched in chunks. Each query is answered
+       progressively -- the top k of the chips searched so far is published
+       as every chunk finishes, and chips encoded after the query arrives are
+       searched as they finish. A new query supersedes any pending one.
+
+       image     : PIL image to chip and encode
+       chunkSize : number of chips encoded or searched per step
+       log       : Logger to use
+    '''
+    def __init__ (self, image, chunkSize=4096, log=None) :
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._image = image
+        self._chunkSize = chunkSize
+        self._log = log
+        self._queries = queue.Queue()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._status = 'Creating the network...'
+        self._likeness = None
+
+    def _publish (self, status, likeness=None) :
+        with self._lock :
+            self._status = status
+            if likeness is not None :
+                self._likeness = likeness
+            self._version += 1
+
+    def getState (self) :
+        '''Return the state for display. The version changes whenever the
+           status or results change.
+
+           return : (version, status, list of (score, region) matches)
+        '''
+        with self._lock :
+            return self._version, self._status, self._likeness
+
+    def submit (self, chipIndex) :
+        '''Queue a search for the chips most like the given chip.'''
+        self._queries.put(chipIndex)
+
+    def _encode (self, inputs, start) :
+        '''Encode the next chunk of chips into the embeddings.'''
+        global embeddings
+        encoded = network.extractEmbeddings(
+            inputs[start:start + self._chunkSize], options.layer)
+        if embeddings is None :
+            shape = (len(inputs), encoded.shape[1])
+            embeddings = np.empty(shape, dtype='float32') \
+                         if options.embeddings is None else \
+                         np.lib.format.open_memmap(options.embeddings, 'w+',
+                                                   'float32', shape)
+        embeddings[start:start + len(encoded)] = encoded
+        return start + len(encoded)
+
+    def run (self) :
+        global network
+        try :
+            network = createNetwork(self._image, self._log)
+        except Exception as ex :
+            self._publish('Failed to create the network [' + str(ex) + ']')
+            raise
+        inputs = chips.reshape(-1, chips.shape[-1])
+        numEncoded, query = 0, None
+        while True :
+            # wait for a query once all the work is complete, and only keep
+            # the latest of any queued queries
+            chipIndex = None
+            try :
+                idle = numEncoded == len(inputs) and \
+                       (query is None or query['searched'] == numEncoded)
+                chipIndex = self._queries.get(idle)
+                while True :
+                    chipIndex = self._queries.get_nowait()
+            except queue.Empty :
+                pass
+            if chipIndex is not None :
+                reference = embeddings[chipIndex] if chipIndex < numEncoded \
+                            else network.extractEmbeddings(
+                                inputs[chipIndex:chipIndex + 1],
+                                options.layer)[0]
+                query = {'reference' : np.array(reference), 'searched' : 0,
+                         'top' : np.empty(0, dtype='int64'),
+                         'scores' : np.empty(0, dtype='float32')}
+
+            # search the encoded chips before encoding more
+            if query is not None and query['searched'] < numEncoded :
+                start = query['searched']
+                end = min(start + self._chunkSize, numEncoded)
+                top, scores = findLikeness(embeddings[start:end],
+                                           query['reference'], options.topK)
+                top = np.concatenate((query['top'], top + start))
+                scores = np.concatenate((query['scores'], scores))
+                best = np.argsort(-scores)[:options.topK]
+                query.update(top=top[best], scores=scores[best],
+                             searched=end)
+                self._publish('Searched [' + str(end) + '/' +
+                              str(len(inputs)) + '] chips',
+                              [(score, regions[ii]) for ii, score in
+                               zip(query['top'], query['scores'])])
+            elif numEncoded < len(inputs) :
+                numEncoded = self._encode(inputs, numEncoded)
+                if numEncoded == len(inputs) and embeddings is not None and \
+                   options.embeddings is not None :
+                    embeddings.flush()
+                self._publish('Encoded [' + str(numEncoded) + '/' +
+                              str(len(inputs)) + '] chips')
+
 def selectRegion (event, x, y, flags, param) :
     if event == cv2.EVENT_LBUTTONDBLCLK :
         # record the mouse click
-        global refLocation, referenceVector, likenessVector, chips, regions
-        halfBox = options.chipSize / 2
-
-        # chip and find the reference encoded vector
-        refLocation = [(x-halfBox, y-halfBox), (x+halfBox, y+halfBox)]
-        referenceVector = network.classifyAndSoftmax(
-            np.resize(np.array(thumbOrig.crop(
-                (refLocation[0][0], refLocation[0][1], 
-                 refLocation[1][0], refLocation[1][1]))),
-                (1, options.chipSize*options.chipSize)))[1][0]
-
-        # run against the entire image
-        likenessVector = []
-        for ii in range(chips.shape[0]) :
-
-            '''
-            # show progress by highlighting areas we've ran
-            draw.rectangle([(regions[ii][0][0],regions[ii][0][1]),
-                            (regions[ii][0][2],regions[ii][0][3])], 
-                           fill=(0,255,255,100))
-            cv2.imshow(windowName, np.array(thumb))
-            '''
-
-            # run the chip
-            matchVector = network.classifyAndSoftmax(chips[ii])[1][0]
-            likenessVector.append((np.dot(referenceVector, matchVector),
-                                   regions[ii][0]))
-
-        # sort so we can display the top choices
-        likenessVector = sorted(likenessVector, key=lambda tup: tup[0],
-                                reverse=True)
+        global refLocation, redraw
+
+        # the chips are cut in the background
+        if regions is None :
+            return
+
+        # use the encoding of the chip nearest the click as the reference.
+        # The search runs in the background and streams its results.
+        halfBox = options.chipSize // 2
+        nearest = np.argmin((regions[:, 0] + halfBox - x) ** 2 +
+                            (regions[:, 1] + halfBox - y) ** 2)
+        region = regions[nearest]
+        refLocation = [(region[0], region[1]), (region[2], region[3])]
+        worker.submit(nearest)
+        redraw = True
 
 def subdivideImage(image, chipSize, stepFactor=1, 
                    batchSize=1, shuffle=False, log=None) :
@@ -103,8 +222,9 @@ def createNetwork(image, log=None) :
     global chips, regions
 
     # divide the image into chips
-    chips, regions = subdivideImage(image, options.chipSize, 5,
-                                    options.batchSize, False)
+    chips, chipRegions = subdivideImage(image, options.chipSize, 5,
+                                        options.batchSize, False)
+    regions = chipRegions.reshape(-1, chipRegions.shape[-1])
     print 'Chips Cut: ' + str(chips.shape)
 
     # load a previously created network
@@ -230,9 +350,6 @@ def createNetwork(image, log=None) :
                         '.png', '_preTrainedSAE_epoch' + \
                         str(options.numEpochs) + '.pkl.gz'))
 
-        # cast to the correct network type
-        network.__class__ = ClassifierNetwork
-
     return network
 
 
@@ -269,10 +386,22 @@ if __name__ == '__main__' :
                              'unsupervised pre-training.')
     parser.add_argument('--batch', dest='batchSize', type=int, default=1,
                         help='Batch size for training and test sets.')
+    parser.add_argument('--topK', dest='topK', type=int, default=100,
+                        help='Number of matches to find for each query.')
+    parser.add_argument('--layer', dest='layer', type=int, default=-1,
+                        help='Index of the layer used as the embedding.')
+    parser.add_argument('--chunk', dest='chunkSize', type=int, default=4096,
+                        help='Number of chips encoded or searched between ' +
+                             'updates of the display.')
+    parser.add_argument('--embeddings', dest='embeddings', type=str,
+                        default=None, help='Write the chip embeddings to ' +
+                        'this memory-mapped .npy file rather than memory.')
     parser.add_argument('--base', dest='base', type=str, default='./leNet5',
                         help='Base name of the network output and temp files.')
     parser.add_argument('image', help='Input image to train.')
     options = parser.parse_args()
+    if options.topK < 1 :
+        parser.error('--topK must be at least one')
 
     # setup the logger
     log = setupLogging('likenessFinder', options.level, options.logfile)
@@ -289,46 +418,59 @@ if __name__ == '__main__' :
                          imageFromDisk.size[1] / options.scale),
                         Image.ANTIALIAS)
 
-    # load a network from disk or train a new network
-    network = createNetwork(thumbOrig, log)
+    # load a network from disk or train a new network, then encode the
+    # chips -- this runs in the background so the window stays responsive
+    worker = LikenessWorker(thumbOrig, options.chunkSize, log)
+    worker.start()
 
     # setup mouse input
     cv2.imshow(windowName, np.array(thumbOrig))
     cv2.setMouseCallback(windowName, selectRegion)
 
-    # allow user input
+    # the RGB conversion of the display is only needed once
+    thumbRGB = thumbOrig.convert('RGB')
+
+    # allow user input -- redraw only when the display changes
     count = 0
     threshold = 1
+    drawnVersion = None
+    likenessVector = None
     while True :
-        thumb = thumbOrig.convert('RGB')
+        version, status, likenessVector = worker.getState()
+        if redraw or version != drawnVersion :
+            thumb = thumbRGB.copy()
+
+            draw = ImageDraw.Draw(thumb, mode='RGBA')
+            if refLocation is not None :
+                draw.rectangle([refLocation[0], refLocation[1]],
+                               fill=(0,255,0,100))
+            if likenessVector is not None :
+                for ii in range(min(threshold, len(likenessVector))) :
+                    region = likenessVector[ii][1]
+                    draw.rectangle([(region[0],region[1]),
+                                    (region[2],region[3])],
+                                   fill=(0,255,255,100))
+            draw.text((5, 5), status, fill=(255,255,0,255))
 
-        draw = ImageDraw.Draw(thumb, mode='RGBA')
-        if refLocation is not None :
-            draw.rectangle([refLocation[0], refLocation[1]],
-                           fill=(0,255,0,100))
-        if likenessVector is not None :
-            for ii in range(threshold) :
-                region = likenessVector[ii][1]
-                draw.rectangle([(region[0],region[1]), (region[2],region[3])], 
-                               fill=(0,255,255,100))
-
-        cv2.imshow(windowName, np.array(thumb))
+            cv2.imshow(windowName, np.array(thumb))
+            drawnVersion, redraw = version, False
 
-        ch = chr(cv2.waitKey(1) & 255)
+        ch = chr(cv2.waitKey(20) & 255)
         
         # 'q' drops out of the loop
         if ch== 'q' :
             # cleanup
             cv2.destroyWindow(windowName)
             break
-        elif ch == '+' :
-            threshold += 1
-            if threshold > len(likenessVector) :
-                threshold = len(likenessVector)-1
+        elif ch == '+' and likenessVector is not None :
+            # every match may be shown, so the cutoff stops at the last one
+            threshold = min(threshold + 1, len(likenessVector))
+            redraw = True
         elif ch == '-' :
             threshold -= 1
             if threshold < 0 :
                 threshold = 0
+            redraw = True
         elif ch == 'd' :
             matchSelect = True
         elif ch == 'f' :
@@ -0,0 +1,143 @@
+import argparse
+import os
+import numpy as np
+
+from dataset.chip import overlapGrid, regularGrid
+from dataset.embeddingStore import EmbeddingStore
+from nn.profiler import setupLogging
+
+'''This application chips every image of a directory, encodes the chips with
+   a pre-trained network and writes an EmbeddingStore for likeness search
+   across the whole corpus. Search the store with likenessSearch.py.
+'''
+
+def formatChips(network, chips) :
+    '''Stack the chips into the input format of the first layer.
+
+       network : Network used to encode the chips
+       chips   : list of (pixels, region) tuples from dataset.chip
+       return  : (numpy.ndarray inputs, numpy.ndarray(int32) regions)
+    '''
+    inputSize = tuple(network.getNetworkInputSize()[1:])
+    pixels = np.asarray([chip[0] for chip in chips])
+    if int(np.prod(pixels.shape[1:])) != int(np.prod(inputSize)) :
+        raise ValueError('The chips ' + str(pixels.shape[1:]) + ' do not ' +
+                         'match the network input ' + str(inputSize))
+    return pixels.reshape((len(chips),) + inputSize), \
+           np.asarray([chip[1] for chip in chips], dtype='int32')
+
+def indexCorpus(network, corpus, storeDir, chipSize, step=None, layer=-1,
+                batchSize=256, blockSize=65536, shardSize=1000000,
+                properties=None, overwrite=False, log=None) :
+    '''Chip and encode every image of the corpus into a new EmbeddingStore.
+       The chips of each image are encoded in blocks, so memory is bounded by
+       the largest image and the block size. Images which cannot be read are
+       logged and skipped.
+
+       network    : Network used to encode the chips
+       corpus     : directory of the imagery
+       storeDir   : directory of the EmbeddingStore to create
+       chipSize   : (rows, cols) of each chip
+       step       : (rows, cols) to advance between chips. None chips on a
+                    regular grid.
+       layer      : index of the layer used as the embedding
+       batchSize  : number of chips per network call
+       blockSize  : number of chips encoded before they are written
+       shardSize  : maximum number of embeddings per shard
+       properties : dictionary of additional properties to save, such as the
+                    synapse of the network
+       overwrite  : replace the shards of an unfinished store in storeDir
+       log        : Logger to use
+       return     : EmbeddingStore opened for reading
+    '''
+    from dataset.reader import readImage
+
+    store = None
+    properties = dict({} if properties is None else properties,
+                      corpus=os.path.abspath(corpus), layer=layer,
+                      chipSize=list(chipSize),
+                      step=None if step is None else list(step))
+    for img in sorted(os.listdir(corpus)) :
+        path = os.path.join(corpus, img)
+        if not os.path.isfile(path) :
+            continue
+        # a corrupt or unsupported image may raise nearly anything
+        try :
+            image = readImage(path, log)
+        except Exception as ex :
+            if log is not None :
+                log.warning('Skipping unreadable image [' + path + ']: ' +
+                            str(ex))
+            continue
+        chips = regularGrid(image, chipSize, log=log) if step is None else \
+                overlapGrid(image, chipSize, step, log)
+        if len(chips) == 0 :
+            continue
+
+        for start in range(0, len(chips), blockSize) :
+            inputs, regions = formatChips(network,
+                                          chips[start:start + blockSize])
+            embeddings = network.extractEmbeddings(inputs, layer, batchSize)
+            if store is None :
+                store = EmbeddingStore(storeDir, embeddings.shape[1],
+                                       shardSize, properties, overwrite)
+            if start == 0 :
+                imageID = store.addImage(path)
+            store.add(imageID, embeddings, regions)
+
+        if log is not None :
+            log.info('Indexed [' + str(len(chips)) + '] chips of [' +
+                     path + ']')
+
+    if store is None :
+        raise ValueError('No imagery could be chipped in [' + corpus + ']')
+    store.close()
+    return store
+
+
+if __name__ == '__main__' :
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', dest='logfile', type=str, default=None,
+                        help='Specify log output file.')
+    parser.add_argument('--level', dest='level', default='INFO', type=str,
+                        help='Log Level.')
+    parser.add_argument('--syn', dest='synapse', type=str, required=True,
+                        help='Network used to encode the chips.')
+    parser.add_argument('--layer', dest='layer', type=int, default=-1,
+                        help='Index of the layer used as the embedding.')
+    parser.add_argument('--chipSize', dest='chipSize', type=int, default=30,
+                        help='Size of chip the network should ingest.')
+    parser.add_argument('--step', dest='step', type=int, default=None,
+                        help='Pixels to advance between chips. By default ' +
+                             'the chips do not overlap.')
+    parser.add_argument('--batch', dest='batchSize', type=int, default=256,
+                        help='Number of chips per network call.')
+    parser.add_argument('--block', dest='blockSize', type=int, default=65536,
+                        help='Number of chips encoded before they are ' +
+                             'written to the store.')
+    parser.add_argument('--shard', dest='shardSize', type=int,
+                        default=1000000,
+                        help='Maximum number of embeddings per shard.')
+    parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                        help='Replace the shards left by an interrupted run.')
+    parser.add_argument('--out', dest='store', type=str, required=True,
+                        help='Directory of the embedding store to create.')
+    parser.add_argument('corpus', help='Directory of the imagery to index.')
+    options = parser.parse_args()
+
+    log = setupLogging('likenessIndexer: ' + options.corpus,
+                       options.level, options.logfile)
+
+    from nn.net import ClassifierNetwork
+    network = ClassifierNetwork(options.synapse, log)
+    store = indexCorpus(
+        network, options.corpus, options.store,
+        (options.chipSize, options.chipSize),
+        None if options.step is None else (options.step, options.step),
+        options.layer, options.batchSize, options.blockSize,
+        options.shardSize, {'synapse' : os.path.abspath(options.synapse)},
+        options.overwrite, log)
+    log.info('Indexed [' + str(len(store)) + '] chips of [' +
+             str(len(store.getImages())) + '] images in [' +
+             str(store.getNumShards()) + '] shards')
@@ -0,0 +1,76 @@
+import argparse
+import numpy as np
+
+from dataset.embeddingStore import EmbeddingStore
+from nn.profiler import setupLogging
+
+'''This application finds the chips of a corpus most like the query chips.
+   The corpus is first indexed with likenessIndexer.py, which saves the
+   network and layer used, so the queries are encoded the same way.
+'''
+
+def encodeQueries(network, queries, layer=-1, log=None) :
+    '''Read and encode the query chips.
+
+       network : Network used to index the corpus
+       queries : list of image files, each the size of a chip
+       layer   : index of the layer used as the embedding
+       log     : Logger to use
+       return  : numpy.ndarray(float32) (numQueries, dimension)
+    '''
+    from dataset.reader import readImage
+    inputSize = tuple(network.getNetworkInputSize()[1:])
+    chips = []
+    for query in queries :
+        chip = readImage(query, log)
+        if chip.size != int(np.prod(inputSize)) :
+            raise ValueError('The query [' + query + '] ' +
+                             str(chip.shape) + ' does not match the ' +
+                             'network input ' + str(inputSize))
+        chips.append(chip.reshape(inputSize))
+    return network.extractEmbeddings(np.asarray(chips), layer)
+
+
+if __name__ == '__main__' :
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', dest='logfile', type=str, default=None,
+                        help='Specify log output file.')
+    parser.add_argument('--level', dest='level', default='INFO', type=str,
+                        help='Log Level.')
+    parser.add_argument('--syn', dest='synapse', type=str, default=None,
+                        help='Network used to encode the queries. This ' +
+                             'defaults to the network used by the indexer.')
+    parser.add_argument('--topK', dest='topK', type=int, default=10,
+                        help='Number of matches to find for each query.')
+    parser.add_argument('--block', dest='blockSize', type=int, default=65536,
+                        help='Number of corpus chips scored per matrix ' +
+                             'multiply.')
+    parser.add_argument('--store', dest='store', type=str, required=True,
+                        help='Directory of the embedding store to search.')
+    parser.add_argument('queries', nargs='+',
+                        help='Image files of the query chips.')
+    options = parser.parse_args()
+
+    log = setupLogging('likenessSearch: ' + options.store,
+                       options.level, options.logfile)
+
+    from nn.net import ClassifierNetwork
+    store = EmbeddingStore(options.store)
+    properties = store.getProperties()
+    network = ClassifierNetwork(properties['synapse'] if
+                                options.synapse is None else
+                                options.synapse, log)
+
+    log.info('Searching [' + str(len(store)) + '] chips of [' +
+             str(len(store.getImages())) + '] images')
+    scores, ids = store.search(
+        encodeQueries(network, options.queries, properties['layer'], log),
+        options.topK, options.blockSize)
+
+    for query, queryScores, queryIDs in zip(options.queries, scores, ids) :
+        print('Query [' + query + ']')
+        for rank, (score, (image, region)) in enumerate(
+                zip(queryScores, store.getMetadata(queryIDs))) :
+            print('  ' + str(rank + 1) + ' [' + str(score) + '] ' + image +
+                  ' ' + str(region))
@@ -6,6 +6,7 @@ from six.moves import reduce
 from ae.net import StackedAENetwork
 from ae.contiguousAE import ContractiveAutoEncoder
 from ae.convolutionalAE import ConvolutionalAutoEncoder
+from ae.convolutionalAE import SeparableConvolutionalAutoEncoder
 from dataset.ingest.labeled import ingestImagery
 from nn.trainUtils import trainUnsupervised
 from dataset.shared import splitToShared
@@ -48,6 +49,9 @@ if __name__ == '__main__' :
                         help='Base name of the network output and temp files.')
     parser.add_argument('--syn', dest='synapse', type=str, default=None,
                         help='Load from a previously saved network.')
+    parser.add_argument('--separable', dest='separable', action='store_true',
+                        help='Use a depthwise separable convolution for ' +
+                             'the c2 layer.')
     parser.add_argument('data', help='Directory or pkl.gz file for the ' +
                                      'training and test sets')
     options = parser.parse_args()
@@ -91,7 +95,9 @@ if __name__ == '__main__' :
         # refactor the output to be (numImages*numKernels, 1, numRows, numCols)
         # this way we don't combine the channels kernels we created in 
         # the first layer and destroy our dimensionality
-        network.addLayer(ConvolutionalAutoEncoder(
+        c2Encoder = SeparableConvolutionalAutoEncoder if options.separable \
+                    else ConvolutionalAutoEncoder
+        network.addLayer(c2Encoder(
             layerID='c2',
             input=network.getNetworkOutput(), 
             inputSize=network.getNetworkOutputSize(), 
@@ -112,6 +112,12 @@ class ContractiveAutoEncoder(ContiguousLayer, AutoEncoder) :
     def getWeights(self) :
         '''Update to account for the decode thresholds.'''
         return [self._weights, self._thresholds, self._thresholdsBack]
+    def getCost (self) :
+        '''Estimate the cost of encoding and decoding a single input.'''
+        from nn.costModel import contiguousCost
+        return contiguousCost(self._inputSize[1], self._numNeurons,
+                              decoder=True,
+                              bytesPerValue=np.dtype(config.floatX).itemsize)
     def getUpdates(self) :
         '''This allows the Stacker to build the layerwise training.'''
         return ([self._cost, self._jacobianCost], self._updates)
@@ -3,6 +3,7 @@ from theano import config, shared, function
 import theano.tensor as t
 from ae.encoder import AutoEncoder
 from nn.convolutionalLayer import ConvolutionalLayer
+from nn.separableLayer import SeparableConvolutionalLayer
 from theano.tensor.nnet.conv import conv2d
 from nn.costUtils import crossEntropyLoss, meanSquaredLoss, leastSquares
 
@@ -144,6 +145,12 @@ class ConvolutionalAutoEncoder(ConvolutionalLayer, AutoEncoder) :
     def getWeights(self) :
         '''Update to account for the decode thresholds.'''
         return [self._weights, self._thresholds, self._thresholdsBack]
+    def getCost (self) :
+        '''Estimate the cost of encoding and decoding a single input.'''
+        from nn.costModel import convolutionalCost
+        return convolutionalCost(
+            self._inputSize, self._kernelSize, self._downsampleFactor,
+            decoder=True, bytesPerValue=np.dtype(config.floatX).itemsize)
     def getUpdates(self) :
         '''This allows the Stacker to build the layerwise training.'''
         return ([self._cost, self._jacobianCost], self._updates)
@@ -158,6 +165,134 @@ class ConvolutionalAutoEncoder(ConvolutionalLayer, AutoEncoder) :
         return self._trainLayer(image)
 
 
+class SeparableConvolutionalAutoEncoder(SeparableConvolutionalLayer,
+                                        AutoEncoder) :
+    '''This class describes a Contractive AutoEncoder (CAE) for a depthwise
+       separable convolutional layer. The decoder reverses each stage of the
+       encoder -- the pooled output is unpooled, the pointwise weights
+       redistribute each kernel back to the channels, and the depthwise
+       kernels spread each channel back over its kernel area.
+
+       The decoder shares the encoder weights, so the reconstruction is as
+       cheap as the encoding.
+
+       layerID             : unique name identifier for this layer
+       input               : the input buffer for this layer
+       inputSize           : (batch size, channels, rows, columns)
+       kernelSize          : (number of kernels, channels, rows, columns)
+       downsampleFactor    : (rowFactor, columnFactor)
+       learningRate        : learning rate for all neurons
+       contractionRate     : variance (dimensionality) reduction rate
+                             None uses '1 / numNeurons'
+       dropout             : rate of retention in a given neuron during
+                             training
+       initialWeights      : pointwise weights to initialize the network
+                             None generates random weights for the layer
+       initialDepthWeights : depthwise kernels to initialize the network
+                             None generates random weights for the layer
+       initialHidThresh    : thresholds to initialize the forward network
+                             None generates random thresholds for the layer
+       initialVisThresh    : thresholds to initialize the backward network
+                             None generates random thresholds for the layer
+       activation          : the sigmoid function to use for activation
+                             this must be a function with a derivative form
+       randomNumGen        : generator for the initial weight values
+    '''
+    def __init__ (self, layerID, input, inputSize, kernelSize,
+                  downsampleFactor, learningRate=0.001,
+                  dropout=None, contractionRate=None,
+                  initialWeights=None, initialDepthWeights=None,
+                  initialHidThresh=None, initialVisThresh=None,
+                  activation=t.nnet.sigmoid, randomNumGen=None) :
+        SeparableConvolutionalLayer.__init__(
+            self, layerID=layerID, input=input, inputSize=inputSize,
+            kernelSize=kernelSize, downsampleFactor=downsampleFactor,
+            learningRate=learningRate, dropout=dropout,
+            initialWeights=initialWeights,
+            initialThresholds=initialHidThresh,
+            initialDepthWeights=initialDepthWeights,
+            activation=activation, randomNumGen=randomNumGen)
+        AutoEncoder.__init__(self, 1. / np.prod(kernelSize[:]) if \
+                                   contractionRate is None else \
+                                   contractionRate)
+
+        # setup initial values for the hidden thresholds
+        if initialVisThresh is None :
+            initialVisThresh = np.zeros((self._inputSize[1],),
+                                        dtype=config.floatX)
+        self._thresholdsBack = shared(value=initialVisThresh, borrow=True)
+
+        kernelRows, kernelCols = self._kernelSize[2:]
+        def decode(hidden) :
+            # the transpose of the pointwise stage
+            channels = t.tensordot(hidden, self._weights,
+                                   axes=[[1], [0]]).dimshuffle(0, 3, 1, 2)
+
+            # the transpose of the depthwise stage -- each pixel is spread
+            # over the kernel area of its channel
+            rows, cols = channels.shape[2], channels.shape[3]
+            out = t.zeros((channels.shape[0], channels.shape[1],
+                           rows + kernelRows - 1, cols + kernelCols - 1),
+                          dtype=channels.dtype)
+            for u in range(kernelRows) :
+                for v in range(kernelCols) :
+                    out = t.inc_subtensor(
+                        out[:, :, u:u + rows, v:v + cols],
+                        channels * self._depthWeights[:, u, v].dimshuffle(
+                            'x', 0, 'x', 'x'))
+            return out
+
+        # setup the decoder --
+        # this take the output of the feedforward process as input and
+        # and runs the output back through the network in reverse.
+        unpooling = max_unpool_2d(self.output[1], self._downsampleFactor)
+        out = decode(unpooling) + \
+              self._thresholdsBack.dimshuffle('x', 0, 'x', 'x')
+        self._decodedInput = out if activation is None else activation(out)
+        self.reconstruction = function([self.input[1]], self._decodedInput)
+
+        # compute the jacobian cost of the output --
+        # This works as a sparsity constraint in case the hidden vector is
+        # larger than the input vector.
+        jacobianMat = decode(unpooling * (1 - unpooling))
+        self._jacobianCost = leastSquares(jacobianMat, self._inputSize[0],
+                                          self._contractionRate)
+
+        # create the negative log likelihood function --
+        # this is our cost function with respect to the original input
+        if activation == t.nnet.sigmoid :
+            self._cost = crossEntropyLoss(self.input[1], self._decodedInput, 1)
+        else :
+            self._cost = meanSquaredLoss(self.input[1], self._decodedInput)
+
+        gradients = t.grad(self._cost + self._jacobianCost, self.getWeights())
+        self._updates = [(weights, weights - learningRate * gradient)
+                         for weights, gradient in zip(self.getWeights(),
+                                                      gradients)]
+
+        self._trainLayer = function([self.input[1]],
+                                    [self._cost, self._jacobianCost],
+                                    updates=self._updates)
+
+    def getWeights(self) :
+        '''Update to account for the decode thresholds.'''
+        return [self._weights, self._thresholds, self._depthWeights,
+                self._thresholdsBack]
+    def getCost (self) :
+        '''Estimate the cost of encoding and decoding a single input.'''
+        from nn.costModel import separableCost
+        return separableCost(
+            self._inputSize, self._kernelSize, self._downsampleFactor,
+            decoder=True, bytesPerValue=np.dtype(config.floatX).itemsize)
+    def getUpdates(self) :
+        '''This allows the Stacker to build the layerwise training.'''
+        return ([self._cost, self._jacobianCost], self._updates)
+
+    # DEBUG: For Debugging purposes only
+    def train(self, image) :
+        return self._trainLayer(image)
+
+
 if __name__ == '__main__' :
     import argparse, logging, time
     from dataset.reader import ingestImagery, pickleDataset
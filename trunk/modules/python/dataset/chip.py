@@ -23,16 +23,15 @@ def regularGrid(image, chipSize, skipFactor=0, log=None) :
 
        image       : numpy.ndarray formatted (numChannels, rows, cols)
        chipSize    : Size of chips to be extracted (rows, cols)
-       stepFactor  : Number of pixels to advance to next chip start
-                     (rows, cols)
+       skipFactor  : Number of chips to skip between each extracted chip
        log         : Logger to use
     '''
     return overlapGrid(image, chipSize, log=log,
                        stepFactor=(chipSize[0] * (skipFactor+1),
-                                   chipSize[0] * (skipFactor+1)))
+                                   chipSize[1] * (skipFactor+1)))
 
 def overlapGrid(image, chipSize, stepFactor, log=None) :
-    '''This chips the region into non-overlapping sub-regions. All partial
+    '''This chips the region into possibly overlapping sub-regions. All partial
        border chips will be discarded from the returned array.
 
        image       : numpy.ndarray formatted (numChannels, rows, cols)
@@ -47,8 +46,8 @@ def overlapGrid(image, chipSize, stepFactor, log=None) :
     # grab an grid of chips
     chips = []
     chipRows, chipCols = chipSize[0], chipSize[1]
-    for row in range(0, image.shape[1] - chipSize, stepFactor[0]) :
-        for col in range(0, image.shape[2] - chipSize, stepFactor[1]) :
+    for row in range(0, image.shape[1] - chipRows + 1, stepFactor[0]) :
+        for col in range(0, image.shape[2] - chipCols + 1, stepFactor[1]) :
             chips.append((image[:, row : row + chipRows, col : col + chipCols],
                           [row, col, row + chipRows, col + chipCols]))
     return chips
@@ -0,0 +1,253 @@
+import json
+import os
+import re
+import numpy as np
+
+def _mergeTopK(bestScores, bestIDs, scores, ids, k) :
+    '''Keep the k highest scores of each query from the running best and a
+       new block of candidates.
+
+       bestScores : numpy.ndarray (numQueries, k) of the running best
+       bestIDs    : numpy.ndarray (numQueries, k) of their ids
+       scores     : numpy.ndarray (numQueries, blockSize) of the new block
+       ids        : numpy.ndarray (blockSize,) of the ids of the block
+       k          : number of neighbors
+       return     : (scores, ids) of the merged best -- unordered
+    '''
+    scores = np.concatenate((bestScores, scores), axis=1)
+    ids = np.concatenate((bestIDs, np.broadcast_to(
+        ids, (len(scores), len(ids)))), axis=1)
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    rows = np.arange(len(scores))[:, np.newaxis]
+    return scores[rows, top], ids[rows, top]
+
+class EmbeddingStore () :
+    '''The EmbeddingStore holds the embeddings of the chips of many images
+       for likeness search across a corpus.
+
+       The embeddings are written into .npy shards of at most shardSize rows,
+       which are memory-mapped when the store is opened, so the corpus never
+       needs to fit in memory. Each shard has a metadata array of the
+       (image id, startRow, startCol, endRow, endCol) of every chip, and the
+       image names and any user properties, such as the network used, are
+       kept in store.json.
+
+       A store is written by adding images and their embeddings in order,
+       then calling close(). Opening an existing directory reads the store.
+       A directory holding the shards of a store which was never closed,
+       such as an interrupted index run, is only replaced when overwrite is
+       set.
+
+       directory  : directory of the store
+       dimension  : length of the embedding vectors. This is required to
+                    create a new store.
+       shardSize  : maximum number of embeddings per shard
+       properties : dictionary saved with a new store -- see getProperties()
+       overwrite  : remove the shards of an unfinished store in the directory
+    '''
+    def __init__ (self, directory, dimension=None, shardSize=1000000,
+                  properties=None, overwrite=False) :
+        self._directory = directory
+        self._writable = not os.path.exists(self._getPath('store.json'))
+        if self._writable :
+            if dimension is None :
+                raise ValueError('The dimension is required to create a ' +
+                                 'new EmbeddingStore [' + directory + ']')
+            if not os.path.exists(directory) :
+                os.makedirs(directory)
+            shards = [f for f in os.listdir(directory)
+                      if re.match(r'(vectors|metadata)[0-9]+\.npy$', f)]
+            if len(shards) > 0 and not overwrite :
+                raise IOError('The directory [' + directory + '] holds the ' +
+                              'shards of an unfinished EmbeddingStore. Use ' +
+                              'overwrite to replace them.')
+            for shard in shards :
+                os.remove(self._getPath(shard))
+            self._dimension = dimension
+            self._shardSize = shardSize
+            self._properties = {} if properties is None else properties
+            self._images = []
+            self._shardSizes = []
+            self._vectors = []
+            self._metadata = []
+        else :
+            with open(self._getPath('store.json'), 'r') as f :
+                meta = json.load(f)
+            self._dimension = meta['dimension']
+            self._shardSize = meta['shardSize']
+            self._properties = meta['properties']
+            self._images = meta['images']
+            self._shardSizes = meta['shardSizes']
+            self._vectors = [np.load(self._getPath('vectors' + str(ii) +
+                                                   '.npy'), mmap_mode='r')
+                             for ii in range(len(self._shardSizes))]
+            self._metadata = [np.load(self._getPath('metadata' + str(ii) +
+                                                    '.npy'), mmap_mode='r')
+                              for ii in range(len(self._shardSizes))]
+
+    def __len__ (self) :
+        return sum(self._shardSizes)
+
+    def _getPath (self, filename) :
+        return os.path.join(self._directory, filename)
+
+    def getDimension (self) :
+        return self._dimension
+    def getNumShards (self) :
+        return len(self._shardSizes)
+    def getImages (self) :
+        '''The image names. The index is the image id.'''
+        return self._images
+    def getProperties (self) :
+        '''The dictionary of user properties saved with the store.'''
+        return self._properties
+    def getShard (self, shard) :
+        '''The embeddings and metadata of a shard.
+           return : (numpy.ndarray(float32) (shardSize, dimension),
+                     numpy.ndarray(int32) (shardSize, 5))
+        '''
+        size = self._shardSizes[shard]
+        return self._vectors[shard][:size], self._metadata[shard][:size]
+
+    def _newShard (self) :
+        '''Allocate the next memory-mapped shard for writing.'''
+        shard = str(len(self._shardSizes))
+        self._vectors.append(np.lib.format.open_memmap(
+            self._getPath('vectors' + shard + '.npy'), mode='w+',
+            dtype='float32', shape=(self._shardSize, self._dimension)))
+        self._metadata.append(np.lib.format.open_memmap(
+            self._getPath('metadata' + shard + '.npy'), mode='w+',
+            dtype='int32', shape=(self._shardSize, 5)))
+        self._shardSizes.append(0)
+
+    def addImage (self, image) :
+        '''Register an image with the store.
+           return : the image id
+        '''
+        if not self._writable :
+            raise IOError('The EmbeddingStore [' + self._directory +
+                          '] is read-only.')
+        self._images.append(image)
+        return len(self._images) - 1
+
+    def add (self, imageID, embeddings, regions) :
+        '''Append the embeddings of chips from a registered image.
+
+           imageID    : id returned by addImage()
+           embeddings : numpy.ndarray (numChips, dimension)
+           regions    : pixel regions of the chips (numChips, 4) as
+                        (startRow, startCol, endRow, endCol)
+        '''
+        if not self._writable :
+            raise IOError('The EmbeddingStore [' + self._directory +
+                          '] is read-only.')
+        if embeddings.ndim != 2 or embeddings.shape[1] != self._dimension :
+            raise ValueError('embeddings must be sized (numChips, ' +
+                             str(self._dimension) + ')')
+        if len(embeddings) != len(regions) :
+            raise ValueError('embeddings and regions must be the same length')
+
+        start = 0
+        while start < len(embeddings) :
+            if len(self._shardSizes) == 0 or \
+               self._shardSizes[-1] == self._shardSize :
+                self._newShard()
+            offset = self._shardSizes[-1]
+            count = min(len(embeddings) - start, self._shardSize - offset)
+            self._vectors[-1][offset:offset + count] = \
+                embeddings[start:start + count]
+            self._metadata[-1][offset:offset + count, 0] = imageID
+            self._metadata[-1][offset:offset + count, 1:] = \
+                regions[start:start + count]
+            self._shardSizes[-1] += count
+            start += count
+
+    def close (self) :
+        '''Finish writing the store. The unused rows of the last shard are
+           trimmed, and the store is reopened for reading.
+        '''
+        if not self._writable :
+            return
+        for vectors, metadata in zip(self._vectors, self._metadata) :
+            vectors.flush()
+            metadata.flush()
+        if len(self._shardSizes) > 0 and \
+           self._shardSizes[-1] < self._shardSize :
+            shard, size = str(len(self._shardSizes) - 1), self._shardSizes[-1]
+            vectors, metadata = np.array(self._vectors[-1][:size]), \
+                                np.array(self._metadata[-1][:size])
+            self._vectors[-1] = self._metadata[-1] = None
+            np.save(self._getPath('vectors' + shard + '.npy'), vectors)
+            np.save(self._getPath('metadata' + shard + '.npy'), metadata)
+        with open(self._getPath('store.json'), 'w') as f :
+            json.dump({'dimension' : self._dimension,
+                       'shardSize' : self._shardSize,
+                       'properties' : self._properties,
+                       'images' : self._images,
+                       'shardSizes' : self._shardSizes}, f)
+        self.__init__(self._directory)
+
+    def getVectors (self, ids) :
+        '''Read the embeddings of the given store ids.'''
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        offsets = np.cumsum([0] + self._shardSizes)
+        shards = np.searchsorted(offsets, ids, side='right') - 1
+        return np.array([self._vectors[s][i - offsets[s]]
+                         for s, i in zip(shards, ids)], dtype='float32')
+
+    def getMetadata (self, ids) :
+        '''Find the image and pixel region of the given store ids.
+
+           ids    : array of store ids, such as those returned by search()
+           return : list of (image name, [startRow, startCol, endRow, endCol])
+        '''
+        ids = np.asarray(ids, dtype='int64').reshape(-1)
+        offsets = np.cumsum([0] + self._shardSizes)
+        shards = np.searchsorted(offsets, ids, side='right') - 1
+        out = []
+        for s, i in zip(shards, ids) :
+            entry = self._metadata[s][i - offsets[s]]
+            out.append((self._images[entry[0]], [int(v) for v in entry[1:]]))
+        return out
+
+    def search (self, queries, k=10, blockSize=65536) :
+        '''Find the top k embeddings of the store by dot product.
+
+           The shards are scored in blocks of rows against every query with a
+           single matrix multiply, and only the running top k of each query
+           is kept between blocks. Memory is bounded by
+           (numQueries, blockSize + k) scores, regardless of the corpus size.
+
+           queries   : numpy.ndarray (numQueries, dimension) or a single
+                       vector
+           k         : number of neighbors
+           blockSize : number of store rows scored per matrix multiply
+           return    : (numpy.ndarray scores, numpy.ndarray store ids), both
+                       sized (numQueries, k) in descending score
+        '''
+        queries = np.asarray(queries, dtype='float32')
+        if queries.ndim == 1 :
+            queries = queries[np.newaxis]
+        if queries.shape[1] != self._dimension :
+            raise ValueError('queries must be sized (numQueries, ' +
+                             str(self._dimension) + ')')
+        k = min(k, len(self))
+        if k == 0 :
+            return np.empty((len(queries), 0), dtype='float32'), \
+                   np.empty((len(queries), 0), dtype='int64')
+        bestScores = np.full((len(queries), k), -np.inf, dtype='float32')
+        bestIDs = np.full((len(queries), k), -1, dtype='int64')
+
+        offset = 0
+        for shard in range(self.getNumShards()) :
+            vectors = self.getShard(shard)[0]
+            for start in range(0, len(vectors), blockSize) :
+                block = np.asarray(vectors[start:start + blockSize])
+                bestScores, bestIDs = _mergeTopK(
+                    bestScores, bestIDs, np.dot(queries, block.T),
+                    np.arange(offset + start, offset + start + len(block)), k)
+            offset += len(vectors)
+
+        order = np.argsort(-bestScores, axis=1)
+        rows = np.arange(len(queries))[:, np.newaxis]
+        return bestScores[rows, order], bestIDs[rows, order]
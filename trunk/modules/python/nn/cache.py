@@ -0,0 +1,186 @@
+import os
+import zlib
+import hashlib
+import zipfile
+import numpy as np
+
+def _updateArrayDigest(digest, array, chunkBytes=1<<24) :
+    '''Add the shape, type and contents of an array to the digest. The array
+       is hashed in chunks along the first axis so memory-mapped inputs are
+       never fully resident.
+    '''
+    array = np.asarray(array)
+    digest.update((str(array.shape) + str(array.dtype)).encode('utf-8'))
+    if array.ndim == 0 or array.shape[0] == 0 :
+        digest.update(np.ascontiguousarray(array).tobytes())
+        return
+    rowBytes = max(array.nbytes // array.shape[0], 1)
+    step = max(chunkBytes // rowBytes, 1)
+    for start in range(0, array.shape[0], step) :
+        digest.update(np.ascontiguousarray(array[start:start + step]).tobytes())
+
+def digestNetwork(network) :
+    '''Create a digest of the network topology and weights. Networks with
+       identical synapses produce identical digests regardless of where they
+       were loaded from.
+
+       network : Network to digest
+       return  : hexadecimal digest string
+    '''
+    digest = hashlib.sha1()
+    for layer in network._layers :
+        digest.update((layer.__class__.__name__ +
+                       str(layer.getInputSize()) +
+                       str(layer.getOutputSize())).encode('utf-8'))
+        for weight in layer.getWeights() :
+            _updateArrayDigest(digest, weight.get_value(borrow=True))
+    return digest.hexdigest()
+
+def digestImage(image) :
+    '''Create a digest of the image pixels, shape and type.
+
+       image  : numpy.ndarray to digest
+       return : hexadecimal digest string
+    '''
+    digest = hashlib.sha1()
+    _updateArrayDigest(digest, image)
+    return digest.hexdigest()
+
+class ResultCache () :
+    '''The ResultCache stores inference results on disk so repeated runs of
+       the same network over the same image are read back instead of
+       recomputed. Entries are keyed by the digest of the network weights,
+       the digest of the image and any parameters which affect the result.
+
+       Each entry is a compressed .npz file. Reading an entry refreshes its
+       modification time, and the least recently used entries are removed
+       whenever the cache grows beyond its size budget.
+
+       cacheDir : directory to store the results
+       maxBytes : size budget of the cache on disk
+       log      : Logger to use
+    '''
+    def __init__ (self, cacheDir, maxBytes=1<<30, log=None) :
+        self._cacheDir = cacheDir
+        self._maxBytes = maxBytes
+        self._log = log
+        if not os.path.isdir(cacheDir) :
+            os.makedirs(cacheDir)
+
+    def _getPath (self, key) :
+        return os.path.join(self._cacheDir, key + '.npz')
+
+    def getKey (self, network, image, **params) :
+        '''Create the cache key for a set of inputs. Parameter values which
+           are arrays, such as masks, are digested by their contents.
+
+           network : Network used to produce the result
+           image   : image the network was applied to
+           params  : additional parameters which affect the result
+           return  : hexadecimal key string
+        '''
+        digest = hashlib.sha1()
+        digest.update(digestNetwork(network).encode('utf-8'))
+        digest.update(digestImage(image).encode('utf-8'))
+        for name in sorted(params) :
+            digest.update(name.encode('utf-8'))
+            if isinstance(params[name], np.ndarray) :
+                _updateArrayDigest(digest, params[name])
+            else :
+                digest.update(repr(params[name]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get (self, key) :
+        '''Read an entry from the cache.
+
+           key    : key created by getKey()
+           return : tuple of numpy.ndarray in the order they were stored,
+                    or None if the entry is not cached. Truncated or corrupt
+                    entries are removed and also return None.
+        '''
+        path = self._getPath(key)
+        if not os.path.exists(path) :
+            return None
+        try :
+            with np.load(path) as entry :
+                result = tuple(entry['arr_' + str(ii)]
+                               for ii in range(len(entry.files)))
+        except (IOError, OSError, EOFError, ValueError, KeyError,
+                zipfile.BadZipfile, zlib.error) :
+            # the entry may have been evicted by another process, or is
+            # unreadable -- either way it must be recomputed
+            if self._log is not None :
+                self._log.warning('Removing unreadable cache entry [' +
+                                  key + ']')
+            try :
+                os.remove(path)
+            except OSError :
+                pass
+            return None
+
+        # mark the entry as recently used
+        os.utime(path, None)
+        if self._log is not None :
+            self._log.debug('Cache hit [' + key + ']')
+        return result
+
+    def put (self, key, *arrays) :
+        '''Write an entry into the cache and evict old entries if the cache
+           is over budget.
+
+           key    : key created by getKey()
+           arrays : numpy.ndarray results to store
+        '''
+        # write to a temporary file first so concurrent readers never see a
+        # partially written entry
+        path = self._getPath(key)
+        tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpPath, 'wb') as f :
+            np.savez_compressed(f, *arrays)
+        os.rename(tmpPath, path)
+        if self._log is not None :
+            self._log.debug('Cache store [' + key + ']')
+        self.evict()
+
+    def evict (self) :
+        '''Remove the least recently used entries until the cache is within
+           its size budget.
+        '''
+        entries = []
+        for name in os.listdir(self._cacheDir) :
+            if not name.endswith('.npz') :
+                continue
+            try :
+                stat = os.stat(os.path.join(self._cacheDir, name))
+            except OSError :
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries) :
+            if totalBytes <= self._maxBytes :
+                break
+            try :
+                os.remove(os.path.join(self._cacheDir, name))
+            except OSError :
+                pass
+            totalBytes -= size
+            if self._log is not None :
+                self._log.debug('Cache evict [' + name + ']')
+
+    def fetch (self, network, image, compute, **params) :
+        '''Return the cached result for these inputs, or compute and store it.
+
+           network : Network used to produce the result
+           image   : image the network is applied to
+           compute : function with no arguments returning a tuple of
+                     numpy.ndarray results
+           params  : additional parameters which affect the result
+           return  : tuple of numpy.ndarray
+        '''
+        key = self.getKey(network, image, **params)
+        result = self.get(key)
+        if result is None :
+            result = tuple(compute())
+            self.put(key, *result)
+        return result
@@ -0,0 +1,208 @@
+import numpy as np
+from timeit import default_timer as timer
+
+class CascadeClassifier () :
+    '''The CascadeClassifier screens every input with a cheap shallow
+       network, such as one trained by the distillery, and only sends the
+       inputs it is unsure of to the expensive deep network. An input is
+       accepted by the shallow network when the softmax confidence of its
+       classification is at least the threshold.
+
+       The cascade provides the inference interface of the ClassifierNetwork,
+       so it can be used by nn.classifierUtils.createClassMap() and the other
+       class map utilities. Use calibrateThreshold() to choose the threshold.
+
+       The deep network is called with only the deferred inputs. Loaded
+       networks accept any batch size, so no compute is spent on padding.
+
+       shallow   : Pre-trained ClassifierNetwork which screens every input
+       deep      : Pre-trained ClassifierNetwork for the deferred inputs
+       threshold : minimum softmax confidence the shallow network must have
+                   to accept its classification
+       log       : Logger to use
+    '''
+    def __init__ (self, shallow, deep, threshold=.9, log=None) :
+        if tuple(shallow.getNetworkInputSize()[1:]) != \
+           tuple(deep.getNetworkInputSize()[1:]) :
+            raise ValueError('The shallow and deep networks must have the ' +
+                             'same input size.')
+        if shallow.getNetworkOutputSize()[-1] != \
+           deep.getNetworkOutputSize()[-1] :
+            raise ValueError('The shallow and deep networks must have the ' +
+                             'same number of labels.')
+        self._shallow = shallow
+        self._deep = deep
+        self._threshold = threshold
+        self._log = log
+        self.resetStats()
+
+    def getThreshold (self) :
+        return self._threshold
+    def setThreshold (self, threshold) :
+        self._threshold = threshold
+
+    def getNetworkInput (self) :
+        return self._shallow.getNetworkInput()
+    def getNetworkInputSize (self) :
+        return self._shallow.getNetworkInputSize()
+    def getNetworkOutputSize (self) :
+        return self._deep.getNetworkOutputSize()
+    def getNetworkLabels (self) :
+        return self._deep.getNetworkLabels()
+
+    def resetStats (self) :
+        self._numScreened = 0
+        self._numDeferred = 0
+
+    def getStats (self) :
+        '''Return the number of inputs screened by the shallow network, the
+           number deferred to the deep network and the deferral rate.
+        '''
+        return {'screened' : self._numScreened,
+                'deferred' : self._numDeferred,
+                'deferralRate' : float(self._numDeferred) /
+                                 max(self._numScreened, 1)}
+
+    def infer (self, inputs) :
+        '''Classify the given inputs with the cascade.
+
+           inputs : numpy.ndarray formatted (batchSize, numChannels, rows,
+                    cols) or (numChannels, rows, cols)
+           return : (classification index, softmax vector)
+        '''
+        if inputs.ndim == 3 :
+            inputs = inputs[np.newaxis]
+        classIndex, softmax = self._shallow.infer(inputs)
+
+        # the buffers of the shallow network are reused by its next call
+        classIndex, softmax = np.array(classIndex), np.array(softmax)
+        confidence = softmax[np.arange(len(classIndex)), classIndex]
+        deferred = np.flatnonzero(confidence < self._threshold)
+        if len(deferred) > 0 :
+            classIndex[deferred], softmax[deferred] = \
+                self._deep.infer(inputs[deferred])
+
+        self._numScreened += len(classIndex)
+        self._numDeferred += len(deferred)
+        return classIndex, softmax
+
+    # the cascade has no separate profiling path
+    classifyAndSoftmax = infer
+
+    def classify (self, inputs) :
+        '''Classify the given inputs. The output is the index of the softmax
+           classification.
+        '''
+        return self.infer(inputs)[0]
+
+def _inferAll(network, data, batchSize) :
+    '''Classify the data in batches, returning the classification, the
+       confidence of each classification and the total time taken.
+    '''
+    classIndex = np.zeros(len(data), dtype='int64')
+    confidence = np.zeros(len(data))
+    elapsed = 0.
+    for start in range(0, len(data), batchSize) :
+        batch = np.asarray(data[start:start + batchSize])
+        begin = timer()
+        batchClass, softmax = network.infer(batch)
+        elapsed += timer() - begin
+        classIndex[start:start + len(batch)] = batchClass
+        confidence[start:start + len(batch)] = \
+            softmax[np.arange(len(batch)), batchClass]
+    return classIndex, confidence, elapsed
+
+def calibrateThreshold(shallow, deep, data, labels=None, maxAccuracyLoss=.01,
+                       batchSize=256) :
+    '''Choose the lowest threshold for the CascadeClassifier which loses no
+       more than the given accuracy against the deep network alone. A lower
+       threshold accepts more inputs with the shallow network, so the
+       cascade is cheaper.
+
+       Both networks classify the calibration set once. The inputs are then
+       ordered by the shallow confidence, so the accuracy of every possible
+       threshold is found with a single cumulative sum.
+
+       shallow         : Pre-trained ClassifierNetwork which screens inputs
+       deep            : Pre-trained ClassifierNetwork for deferred inputs
+       data            : numpy.ndarray of calibration inputs
+                         (numInputs, numChannels, rows, cols)
+       labels          : integer label of each input. None measures the
+                         accuracy as agreement with the deep network.
+       maxAccuracyLoss : fraction of the calibration set the cascade may
+                         classify worse than the deep network
+       batchSize       : number of inputs classified at once
+       return          : (threshold, dictionary of the 'deferralRate',
+                          'shallowAccuracy', 'deepAccuracy',
+                          'cascadeAccuracy', 'accuracyLoss' and the
+                          estimated 'speedup' over the deep network)
+    '''
+    shallowClass, shallowConf, shallowTime = _inferAll(shallow, data,
+                                                       batchSize)
+    deepClass, _, deepTime = _inferAll(deep, data, batchSize)
+    if labels is None :
+        labels = deepClass
+    labels = np.asarray(labels).reshape(-1)
+    numInputs = float(len(labels))
+
+    # accept the most confident inputs first -- accepting the first k
+    # inputs changes the number correct by the cumulative difference
+    order = np.argsort(-shallowConf, kind='mergesort')
+    conf = shallowConf[order]
+    shallowCorrect = shallowClass[order] == labels[order]
+    deepCorrect = deepClass[order] == labels[order]
+    change = np.concatenate(([0], np.cumsum(shallowCorrect.astype('int64') -
+                                            deepCorrect.astype('int64'))))
+
+    # a threshold can only separate inputs of different confidence
+    numAccepted = np.arange(len(conf) + 1)
+    separable = np.concatenate(([True], conf[:-1] > conf[1:], [True]))
+    valid = separable & (-change / numInputs <= maxAccuracyLoss)
+    best = numAccepted[valid][-1]
+    threshold = conf[best - 1] if best > 0 else np.inf
+
+    deepAccuracy = np.sum(deepCorrect) / numInputs
+    deferralRate = 1. - best / numInputs
+    return threshold, {
+        'deferralRate' : deferralRate,
+        'shallowAccuracy' : np.sum(shallowCorrect) / numInputs,
+        'deepAccuracy' : deepAccuracy,
+        'cascadeAccuracy' : deepAccuracy + change[best] / numInputs,
+        'accuracyLoss' : -change[best] / numInputs,
+        'speedup' : deepTime / (shallowTime + deferralRate * deepTime)}
+
+
+if __name__ == '__main__' :
+    import argparse
+    from nn.net import ClassifierNetwork
+    from dataset.pickle import readPickleZip
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shallow', dest='shallow', type=str, required=True,
+                        help='Synapse of the shallow screening network.')
+    parser.add_argument('--deep', dest='deep', type=str, required=True,
+                        help='Synapse of the deep network.')
+    parser.add_argument('--loss', dest='loss', type=float, default=.01,
+                        help='Maximum fraction of accuracy the cascade may ' +
+                             'lose against the deep network.')
+    parser.add_argument('--unlabeled', dest='unlabeled', action='store_true',
+                        help='Measure accuracy as agreement with the deep ' +
+                             'network rather than against the labels.')
+    parser.add_argument('data', help='Labeled pkl.gz file. The test set is ' +
+                                     'used for calibration.')
+    options = parser.parse_args()
+
+    # flatten the mini-batches of the labeled pickle
+    _, (testData, testLabels), _ = readPickleZip(options.data)
+    testData = testData.reshape((-1,) + testData.shape[2:])
+    testLabels = testLabels.reshape(-1)
+
+    threshold, report = calibrateThreshold(
+        ClassifierNetwork(options.shallow), ClassifierNetwork(options.deep),
+        testData, None if options.unlabeled else testLabels, options.loss)
+    print('Threshold [' + str(threshold) + '] defers [' +
+          str(report['deferralRate']) + '] of inputs with accuracy [' +
+          str(report['cascadeAccuracy']) + '] against the deep [' +
+          str(report['deepAccuracy']) + '] and shallow [' +
+          str(report['shallowAccuracy']) + '], estimated speedup [' +
+          str(report['speedup']) + 'x]')
@@ -1,26 +1,63 @@
 import numpy as np
-from net import ClassifierNetwork
 
-def createClassMap(network, image) :
-    '''This is an exhaustive search algorithm which checks all available 
-       sub-regions. This creates two matrices of the classifications and 
-       their associated likelihood confidences.
-       This can be thought of as a heat map for the classification and the 
-       confidence in those classifications. Areas of high-confidence and large
-       regions of like classifications are likely to contain an identifiable
-       object.
+def _createWindowView(image, windowShape) :
+    '''Create a read-only strided view of every sub-region of the image. No
+       pixel data is copied -- each entry aliases the original buffer.
+
+       image       : numpy.ndarray formatted (numChannels, rows, cols)
+       windowShape : size of each sub-region (numChannels, rows, cols)
+       return      : numpy.ndarray view formatted
+                     (featureRows, featureCols, numChannels, rows, cols)
+    '''
+    from numpy.lib.stride_tricks import as_strided
+    chanStride, rowStride, colStride = image.strides
+    windows = as_strided(image,
+                         shape=(image.shape[1] - windowShape[1] + 1,
+                                image.shape[2] - windowShape[2] + 1,
+                                windowShape[0], windowShape[1], windowShape[2]),
+                         strides=(rowStride, colStride,
+                                  chanStride, rowStride, colStride))
+    windows.flags.writeable = False
+    return windows
 
-       network : Pre-trained ClassifierNetwork to classify the image
-       image   : image to classify. The size is assumed to be greater than
-                 or equal to the network's input size. 
-                 (numChannels, numRows, numCols)
+def _classifyWindows(network, windows, indices, classifications, confidence,
+                     batchSize) :
+    '''Run the selected sub-regions through the network in batches and
+       scatter the results into the output matrices.
 
-       return  : numpy.ndarray(classification), numpy.ndarray(confidence)
+       network         : Pre-trained ClassifierNetwork to classify the image
+       windows         : strided view created by _createWindowView()
+       indices         : flat indices into the (featureRows, featureCols)
+                         matrices which should be classified
+       classifications : output matrix of classification indices
+       confidence      : output matrix of classification likelihoods
+       batchSize       : maximum number of sub-regions per network call.
+                         The network accepts any batch size, so a partial
+                         final batch is classified as it is.
     '''
+    numCols = windows.shape[1]
+    for start in range(0, len(indices), batchSize) :
+        batchIndices = indices[start:start + batchSize]
 
-    # verify the types and sizing
-    if not isinstance(network, ClassifierNetwork) :
-        raise ValueError('network must be a ClassifierNetwork object')
+        # gather the windows for this batch -- this is the only copy made
+        batch = windows[batchIndices // numCols, batchIndices % numCols]
+        classIndex, softmax = network.infer(batch)
+        classifications.flat[batchIndices] = classIndex
+        confidence.flat[batchIndices] = softmax[np.arange(len(batchIndices)),
+                                                classIndex]
+
+def _checkClassMapInputs(network, image) :
+    '''Verify the network and image are suitable for creating a class map.
+
+       return : the network input shape (numChannels, numRows, numCols)
+    '''
+    # verify the types and sizing --
+    # a CascadeClassifier provides the same inference interface
+    from nn.net import ClassifierNetwork
+    from nn.cascade import CascadeClassifier
+    if not isinstance(network, (ClassifierNetwork, CascadeClassifier)) :
+        raise ValueError('network must be a ClassifierNetwork or ' +
+                         'CascadeClassifier object')
     if not isinstance(image, np.ndarray) :
         raise ValueError('imageRegion must be a numpy.ndarray object')
 
@@ -32,31 +69,438 @@ def createClassMap(network, image) :
     if image.shape[1] < networkInputShape[1] or \
        image.shape[2] < networkInputShape[2] :
         raise Exception('The imageRegion is smaller than the network input.')
+    return networkInputShape
 
-    # create the memory buffers
-    featureShape = (image.shape[1] - networkInputShape[1] + 1,
-                    image.shape[2] - networkInputShape[2] + 1)
+def _createClassMapBuffers(featureShape, mask) :
+    '''Create the classification and confidence matrices. Sub-regions outside
+       the mask are marked with a classification of -1 and zero confidence.
+    '''
     classifications = np.ndarray(featureShape, dtype='int32')
     confidence = np.ndarray(featureShape)
+    if mask is not None :
+        if mask.shape != featureShape :
+            raise ValueError('The mask must be sized ' + str(featureShape) +
+                             ' to match the number of sub-regions.')
+        classifications[~mask] = -1
+        confidence[~mask] = 0.
+    return classifications, confidence
+
+def createValidityMask(image, windowShape, minVariance=1e-6,
+                       nodata=None, maxNodata=0.) :
+    '''Create a mask of the sub-regions which are worth classifying. This
+       rejects flat sub-regions, such as calm water, and sub-regions which
+       are missing data, such as the nodata border of a scene.
+
+       Sliding sums of the pixels and their squares are created once, so the
+       mean and variance of each sub-region are found in constant time. The
+       pixels are centered on their channel mean, and the sums are taken
+       down the rows then across the columns, so each running sum spans a
+       single row or column rather than the whole image. This keeps the
+       variance of flat sub-regions of large, bright scenes well within
+       minVariance.
+
+       image       : image to classify (numChannels, numRows, numCols)
+       windowShape : size of each sub-region. Only (rows, cols) are used.
+       minVariance : sub-regions are flat if the variance in every channel
+                     does not exceed this value
+       nodata      : pixel value used to mark missing data. A pixel is
+                     missing if all channels are equal to this value.
+                     None disables the nodata check
+       maxNodata   : fraction of missing pixels allowed in a sub-region
+
+       return      : numpy.ndarray(bool) of (featureRows, featureCols), where
+                     True marks the sub-regions to classify
+    '''
+    numRows, numCols = windowShape[-2:]
+    area = float(numRows * numCols)
+
+    def windowSum(x) :
+        # pad with a leading zero so every sub-region sum is the difference
+        # of two running sums -- first down the rows, then across the columns
+        rows = np.zeros((x.shape[0], x.shape[1] + 1, x.shape[2]))
+        rows[:, 1:] = x.cumsum(axis=1)
+        rows = rows[:, numRows:] - rows[:, :-numRows]
+        cols = np.zeros((rows.shape[0], rows.shape[1], rows.shape[2] + 1))
+        cols[:, :, 1:] = rows.cumsum(axis=2)
+        return cols[:, :, numCols:] - cols[:, :, :-numCols]
+
+    pixels = np.asarray(image, dtype='float64')
+    pixels = pixels - pixels.mean(axis=(1, 2), keepdims=True)
+    mean = windowSum(pixels) / area
+    variance = windowSum(pixels ** 2) / area - mean ** 2
+    valid = np.any(variance > minVariance, axis=0)
+
+    if nodata is not None :
+        missing = np.all(image == nodata, axis=0)[np.newaxis]
+        valid &= windowSum(missing)[0] <= maxNodata * area
+    return valid
+
+def createClassMap(network, image, batchSize=None, mask=None) :
+    '''This is an exhaustive search algorithm which checks all available 
+       sub-regions. This creates two matrices of the classifications and 
+       their associated likelihood confidences.
+       This can be thought of as a heat map for the classification and the 
+       confidence in those classifications. Areas of high-confidence and large
+       regions of like classifications are likely to contain an identifiable
+       object.
+
+       network   : Pre-trained ClassifierNetwork to classify the image
+       image     : image to classify. The size is assumed to be greater than
+                   or equal to the network's input size. 
+                   (numChannels, numRows, numCols)
+       batchSize : number of sub-regions to classify per network call
+                   None uses the batch size the network was built with
+       mask      : numpy.ndarray(bool) of (featureRows, featureCols) where
+                   False skips the sub-region, which is then marked with a
+                   classification of -1. See createValidityMask().
+                   None classifies all sub-regions
+
+       return    : numpy.ndarray(classification), numpy.ndarray(confidence)
+    '''
+    networkInputShape = _checkClassMapInputs(network, image)
+    if batchSize is None :
+        batchSize = network.getNetworkInputSize()[0]
 
-    # fill out each matrix with the network output
-    # TODO: It's likely faster to slide down the rows, because the reload
-    #       will be aligned with contiguous memory.
-    # TODO: Thread this, it's embarrassingly parallel, but watch out
-    #       because the internal values may cause race conditions.
-    numRows, numCols = networkInputShape[1], networkInputShape[2]
-    for ii in range(featureShape[0]) :
-        for jj in range(featureShape[1]) :
-            classifications[ii][jj], softmax = network.classifyAndSoftmax(
-                np.reshape(image[:,ii:ii+numRows,jj:jj+numCols],
-                           (1,1,numRows,numCols)))
-            confidence[ii][jj] = softmax[0][classifications[ii][jj]]
+    # create the memory buffers
+    featureShape = (image.shape[1] - networkInputShape[1] + 1,
+                    image.shape[2] - networkInputShape[2] + 1)
+    classifications, confidence = _createClassMapBuffers(featureShape, mask)
 
+    # fill out each matrix with the network output --
+    # the windows are gathered in row-major order, so each batch reads
+    # neighboring sub-regions which are mostly contiguous in memory.
+    # NOTE: createClassMapTiled() splits this work across processes.
+    _classifyWindows(network, _createWindowView(image, networkInputShape),
+                     np.arange(classifications.size) if mask is None else
+                     np.flatnonzero(mask), classifications,
+                     confidence, batchSize)
 
     # return the results
     return classifications, confidence
 
-def singleClassify(network, image) :
+def iterClassMap(network, image, bandRows=64, batchSize=None, mask=None) :
+    '''Perform the exhaustive search of createClassMap() one band of rows at
+       a time. Peak memory is bounded by the size of a band rather than the
+       size of the scene, so the image may be a numpy.memmap larger than
+       the available memory.
+
+       network   : Pre-trained ClassifierNetwork to classify the image
+       image     : image to classify. The size is assumed to be greater than
+                   or equal to the network's input size.
+                   (numChannels, numRows, numCols)
+       bandRows  : number of rows of sub-regions in each band
+       batchSize : number of sub-regions to classify per network call
+                   None uses the batch size the network was built with
+       mask      : numpy.ndarray(bool) of sub-regions to classify
+                   None classifies all sub-regions
+
+       return    : generator of (startRow, numpy.ndarray(classification),
+                   numpy.ndarray(confidence)) for each band
+    '''
+    networkInputShape = _checkClassMapInputs(network, image)
+    featureRows = image.shape[1] - networkInputShape[1] + 1
+    for startRow in range(0, featureRows, bandRows) :
+        endRow = min(startRow + bandRows, featureRows)
+        classifications, confidence = createClassMap(
+            network, image[:, startRow : endRow + networkInputShape[1] - 1],
+            batchSize, None if mask is None else mask[startRow:endRow])
+        yield startRow, classifications, confidence
+
+def createClassMapFiles(network, image, outputBase, bandRows=64,
+                        batchSize=None, mask=None, log=None) :
+    '''Perform the exhaustive search of createClassMap() and stream the
+       results into memory-mapped files as each band of rows finishes. This
+       allows class maps of scenes larger than the available memory.
+
+       The classifications are written as uint8, where 255 marks sub-regions
+       skipped by the mask, and the confidences are written as float32. Both
+       are .npy files which can be opened with numpy.load(mmap_mode='r').
+
+       network    : Pre-trained ClassifierNetwork to classify the image
+       image      : image to classify (numChannels, numRows, numCols)
+       outputBase : base path of the output files
+       bandRows   : number of rows of sub-regions in each band
+       batchSize  : number of sub-regions to classify per network call
+                    None uses the batch size the network was built with
+       mask       : numpy.ndarray(bool) of sub-regions to classify
+                    None classifies all sub-regions
+       log        : Logger to use
+
+       return     : (classification filepath, confidence filepath)
+    '''
+    from numpy.lib.format import open_memmap
+    networkInputShape = _checkClassMapInputs(network, image)
+    if network.getNetworkOutputSize()[-1] > 255 :
+        raise ValueError('The network has too many labels to be written ' +
+                         'as uint8 classifications.')
+
+    featureShape = (image.shape[1] - networkInputShape[1] + 1,
+                    image.shape[2] - networkInputShape[2] + 1)
+    classFile = outputBase + '_class.npy'
+    confidenceFile = outputBase + '_confidence.npy'
+    if log is not None :
+        log.info('Streaming the class map to [' + classFile + '] and [' +
+                 confidenceFile + ']')
+    classifications = open_memmap(classFile, mode='w+', dtype='uint8',
+                                  shape=featureShape)
+    confidence = open_memmap(confidenceFile, mode='w+', dtype='float32',
+                             shape=featureShape)
+
+    for startRow, bandClass, bandConf in iterClassMap(
+            network, image, bandRows, batchSize, mask) :
+        endRow = startRow + bandClass.shape[0]
+        classifications[startRow:endRow] = np.where(bandClass < 0, 255,
+                                                    bandClass)
+        confidence[startRow:endRow] = bandConf
+        if log is not None :
+            log.debug('Finished rows [' + str(startRow) + ':' +
+                      str(endRow) + '] of [' + str(featureShape[0]) + ']')
+
+    # flush the results to disk
+    del classifications, confidence
+    return classFile, confidenceFile
+
+def saveConfidenceTiles(confidenceFile, outputBase, tileSize=(1024, 1024),
+                        log=None) :
+    '''Convert a confidence map written by createClassMapFiles() into a set
+       of greyscale image tiles. The map is read through a memory-map, so
+       only a single tile is resident in memory at a time.
+
+       confidenceFile : .npy file containing the confidence map
+       outputBase     : base path of the tiles. Each tile is written as
+                        outputBase_r<startRow>_c<startCol>.png
+       tileSize       : size of each tile (rows, cols)
+       log            : Logger to use
+
+       return         : list of tile filepaths
+    '''
+    import os
+    from PIL import Image
+    confidence = np.load(confidenceFile, mmap_mode='r')
+
+    # use the global range so the tiles share the same scale
+    minimum, maximum = np.inf, -np.inf
+    for row in range(0, confidence.shape[0], tileSize[0]) :
+        band = confidence[row : row + tileSize[0]]
+        minimum = min(minimum, float(np.amin(band)))
+        maximum = max(maximum, float(np.amax(band)))
+    scale = 255. / (maximum - minimum) if maximum > minimum else 0.
+
+    base, ext = os.path.splitext(outputBase)
+    tiles = []
+    for row in range(0, confidence.shape[0], tileSize[0]) :
+        for col in range(0, confidence.shape[1], tileSize[1]) :
+            tile = confidence[row : row + tileSize[0], col : col + tileSize[1]]
+            tilePath = base + '_r' + str(row) + '_c' + str(col) + \
+                       (ext if ext else '.png')
+            Image.fromarray(np.asarray((tile - minimum) * scale,
+                                       dtype='uint8'),
+                            mode='L').save(tilePath)
+            tiles.append(tilePath)
+    if log is not None :
+        log.info('Wrote [' + str(len(tiles)) + '] confidence tiles')
+    return tiles
+
+def _createSharedArray(shape, dtype) :
+    '''Allocate a numpy.ndarray backed by process-shared memory. Worker
+       processes inherit the buffer, so views of it are never copied.
+    '''
+    from multiprocessing.sharedctypes import RawArray
+    dtype = np.dtype(dtype)
+    buffer = RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return buffer, np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+# the per-process state for the tiled classification workers
+_tileState = {}
+
+def _initTileWorker(network, buffers, shapes, dtypes, batchSize) :
+    '''Setup a tiled classification worker. Each worker holds its own copy
+       of the network, and numpy views into the shared image and output maps.
+    '''
+    _tileState['network'] = network
+    _tileState['batchSize'] = batchSize
+    _tileState['mask'] = None
+    for name, buffer, shape, dtype in zip(
+            ('image', 'classifications', 'confidence', 'mask'),
+            buffers, shapes, dtypes) :
+        _tileState[name] = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+def _classifyTile(tile) :
+    '''Classify a single tile of the image and write the results into the
+       shared output maps. Tiles never overlap in the output, so no locking
+       is required and the results are independent of the scheduling.
+
+       tile : output region of the tile (startRow, endRow, startCol, endCol)
+    '''
+    startRow, endRow, startCol, endCol = tile
+    windowShape = _tileState['network'].getNetworkInputSize()[-3:]
+    mask = _tileState['mask']
+
+    # the input tile includes a halo of the network input size, so every
+    # sub-region starting within the tile is available
+    classifications, confidence = createClassMap(
+        _tileState['network'],
+        _tileState['image'][:, startRow : endRow + windowShape[1] - 1,
+                               startCol : endCol + windowShape[2] - 1],
+        _tileState['batchSize'],
+        None if mask is None else mask[startRow:endRow, startCol:endCol])
+    _tileState['classifications'][startRow:endRow, startCol:endCol] = \
+        classifications
+    _tileState['confidence'][startRow:endRow, startCol:endCol] = confidence
+    return tile
+
+def createClassMapTiled(network, image, tileSize=(256, 256), numWorkers=None,
+                        batchSize=None, mask=None, log=None) :
+    '''This performs the same exhaustive search as createClassMap(), but
+       splits the image into tiles which are classified in parallel worker
+       processes. The image and output maps are placed in shared memory, so
+       workers operate on views of the data without copying it.
+
+       network    : Pre-trained ClassifierNetwork to classify the image
+       image      : image to classify. The size is assumed to be greater than
+                    or equal to the network's input size.
+                    (numChannels, numRows, numCols)
+       tileSize   : number of sub-regions in each tile (rows, cols)
+       numWorkers : number of worker processes
+                    None uses the number of cores on the system
+       batchSize  : number of sub-regions to classify per network call
+                    None uses the batch size the network was built with
+       mask       : numpy.ndarray(bool) of sub-regions to classify
+                    None classifies all sub-regions
+       log        : Logger to use
+
+       return     : numpy.ndarray(classification), numpy.ndarray(confidence)
+    '''
+    from multiprocessing import Pool
+    networkInputShape = _checkClassMapInputs(network, image)
+
+    featureShape = (image.shape[1] - networkInputShape[1] + 1,
+                    image.shape[2] - networkInputShape[2] + 1)
+    tiles = [(row, min(row + tileSize[0], featureShape[0]),
+              col, min(col + tileSize[1], featureShape[1]))
+             for row in range(0, featureShape[0], tileSize[0])
+             for col in range(0, featureShape[1], tileSize[1])]
+
+    # place the image and output maps in shared memory
+    if log is not None :
+        log.info('Moving the image into shared memory')
+    shapes = [image.shape, featureShape, featureShape]
+    dtypes = [image.dtype, np.dtype('int32'), np.dtype('float64')]
+    if mask is not None :
+        shapes.append(featureShape)
+        dtypes.append(np.dtype(bool))
+    buffers, arrays = zip(*[_createSharedArray(shape, dtype)
+                            for shape, dtype in zip(shapes, dtypes)])
+    sharedImage, classifications, confidence = arrays[:3]
+    sharedImage[:] = image
+    if mask is not None :
+        arrays[3][:] = mask
+
+    if log is not None :
+        log.info('Classifying [' + str(len(tiles)) + '] tiles')
+    pool = Pool(numWorkers, initializer=_initTileWorker,
+                initargs=(network, buffers, shapes, dtypes, batchSize))
+    try :
+        for tile in pool.imap_unordered(_classifyTile, tiles) :
+            if log is not None :
+                log.debug('Finished tile [' + str(tile) + ']')
+        pool.close()
+    except :
+        pool.terminate()
+        raise
+    finally :
+        pool.join()
+
+    return classifications, confidence
+
+def createCoarseClassMap(network, image, stride=4, threshold=.1,
+                         batchSize=None, mask=None) :
+    '''This is a coarse-to-fine search algorithm which produces the same
+       matrices as createClassMap() without checking every sub-region. The
+       image is first scanned at the specified stride. Each block between
+       the coarse samples is then densely searched only when its sample
+       disagrees with a neighboring sample, either by classification or by
+       a change in confidence beyond the threshold. All other blocks are
+       filled with the classification and confidence of their sample.
+
+       This is most effective on sparse scenes, where large regions of
+       background would otherwise be searched exhaustively.
+
+       network   : Pre-trained ClassifierNetwork to classify the image
+       image     : image to classify. The size is assumed to be greater than
+                   or equal to the network's input size.
+                   (numChannels, numRows, numCols)
+       stride    : number of sub-regions between samples of the coarse scan
+       threshold : change in confidence between neighboring samples which
+                   triggers a dense search of the block
+       batchSize : number of sub-regions to classify per network call
+                   None uses the batch size the network was built with
+       mask      : numpy.ndarray(bool) of sub-regions to classify
+                   None classifies all sub-regions
+
+       return    : numpy.ndarray(classification), numpy.ndarray(confidence),
+                   number of sub-regions skipped
+    '''
+    networkInputShape = _checkClassMapInputs(network, image)
+    if batchSize is None :
+        batchSize = network.getNetworkInputSize()[0]
+
+    # create the memory buffers
+    featureShape = (image.shape[1] - networkInputShape[1] + 1,
+                    image.shape[2] - networkInputShape[2] + 1)
+    classifications, confidence = _createClassMapBuffers(featureShape, mask)
+    windows = _createWindowView(image, networkInputShape)
+    if mask is None :
+        mask = np.ones(featureShape, dtype=bool)
+
+    # perform the coarse scan --
+    # masked samples keep a classification of -1, so the edge of the mask
+    # is refined like any other change in classification
+    sampled = np.zeros(featureShape, dtype=bool)
+    sampled[::stride, ::stride] = True
+    sampled &= mask
+    coarseIndices = np.flatnonzero(sampled)
+    _classifyWindows(network, windows, coarseIndices,
+                     classifications, confidence, batchSize)
+    coarseClass = classifications[::stride, ::stride].copy()
+    coarseConf = confidence[::stride, ::stride].copy()
+
+    # mark both blocks on either side of any change between neighboring
+    # samples -- horizontal, vertical and both diagonals
+    refine = np.zeros(coarseClass.shape, dtype=bool)
+    numRows, numCols = coarseClass.shape
+    for rowShift, colShift in ((0, 1), (1, 0), (1, 1), (1, -1)) :
+        first = (slice(0, numRows - rowShift),
+                 slice(max(0, -colShift), numCols - max(0, colShift)))
+        second = (slice(rowShift, numRows),
+                  slice(max(0, colShift), numCols - max(0, -colShift)))
+        changed = (coarseClass[first] != coarseClass[second]) | \
+                  (np.abs(coarseConf[first] - coarseConf[second]) > threshold)
+        refine[first] |= changed
+        refine[second] |= changed
+
+    # a block whose sample is masked has nothing to fill from, so any valid
+    # sub-regions within it are always searched densely
+    refine |= ~mask[::stride, ::stride]
+
+    # fill each block with its coarse sample
+    def expand(coarse) :
+        return np.repeat(np.repeat(coarse, stride, axis=0),
+                         stride, axis=1)[:featureShape[0], :featureShape[1]]
+    classifications[:] = expand(coarseClass)
+    confidence[:] = expand(coarseConf)
+    classifications[~mask] = -1
+    confidence[~mask] = 0.
+
+    # densely search the blocks marked for refinement
+    fineIndices = np.flatnonzero(expand(refine) & ~sampled & mask)
+    _classifyWindows(network, windows, fineIndices,
+                     classifications, confidence, batchSize)
+
+    numSkipped = classifications.size - len(coarseIndices) - len(fineIndices)
+    return classifications, confidence, numSkipped
+
+def singleClassify(network, image, stride=1, threshold=.1, batchSize=None) :
     '''This is an exhaustive search algorithm which checks all available 
        sub-regions. This assumes the image or subregion contains only one 
        object, and attempts to return the most likely candidate classification
@@ -65,32 +509,300 @@ def singleClassify(network, image) :
        NOTE: The image is assumed to contain only one classification, so
              inputs containing more than one will return undefined behavior.
 
-       network : Pre-trained ClassifierNetwork to classify the image
-       image   : image to classify. The size is assumed to be greater than or
-                 equal to the network's input size. 
-                 (numChannels, numRows, numCols)
+       network   : Pre-trained ClassifierNetwork to classify the image
+       image     : image to classify. The size is assumed to be greater than
+                   or equal to the network's input size. 
+                   (numChannels, numRows, numCols)
+       stride    : stride of the coarse scan. Values greater than one use
+                   the coarse-to-fine search of createCoarseClassMap()
+       threshold : change in confidence which triggers a dense search
+       batchSize : number of sub-regions to classify per network call
+                   None uses the batch size the network was built with
 
-       return  : (classification index, likelihood value)
+       return    : (classification index, likelihood value)
     '''
-    from scipy.stats import mode
-
     # create the classification and confidence matrices
-    classifications, confidence = createClassMap(network, image)
+    if stride > 1 :
+        classifications, confidence, numSkipped = createCoarseClassMap(
+            network, image, stride, threshold, batchSize)
+    else :
+        classifications, confidence = createClassMap(network, image,
+                                                     batchSize)
 
     # the mode will find the most frequently classified value --
     # we use this as the most likely candidate classification
-    mostFreqClass = mode(classifications)
+    mostFreqClass = int(np.bincount(classifications.ravel()).argmax())
 
     # find the average confidence of the correct classifications
     # TODO: we should likely account for incorrect classificaitons in the
     #       likelihood value. More research should be performed.
-    mask = np.ma.masked_equal(classifications, mostFreqClass)
-    return mostFreqClass, np.ma.masked_array(confidence, mask=mask).mean()
+    return mostFreqClass, confidence[classifications == mostFreqClass].mean()
+
+def _createSampleOrder(featureShape, strata, rng) :
+    '''Create a random ordering of the sub-regions. When strata are given the
+       sub-regions are divided into a (rows, cols) grid of blocks and the
+       ordering visits the blocks in round-robin, so every prefix of the
+       ordering covers the image evenly.
+
+       return : numpy.ndarray of flat indices into the feature matrices
+    '''
+    numWindows = featureShape[0] * featureShape[1]
+    perm = rng.permutation(numWindows)
+    if strata is None :
+        return perm
+
+    # assign each sub-region to its block
+    rows, cols = np.unravel_index(perm, featureShape)
+    stratum = (rows * strata[0] // featureShape[0]) * strata[1] + \
+              (cols * strata[1] // featureShape[1])
+
+    # rank each sub-region within its block. Ordering by the rank then takes
+    # one random sub-region from each block in turn.
+    byStratum = np.argsort(stratum, kind='mergesort')
+    counts = np.bincount(stratum)
+    rank = np.empty(numWindows, dtype='int64')
+    rank[byStratum] = np.arange(numWindows) - \
+                      np.repeat(np.cumsum(counts) - counts, counts)
+    return perm[np.argsort(rank, kind='mergesort')]
+
+def sampledSingleClassify(network, image, confidenceLevel=.95,
+                          minConfidence=.5, batchSize=None, maxWindows=None,
+                          minWindows=16, strata=(4, 4), rng=None, mask=None) :
+    '''This is a sampling alternative to singleClassify(). Sub-regions are
+       classified in a random order, one batch at a time, and the search stops
+       as soon as the leading class is statistically established.
+
+       The search stops when, at the given confidence level --
+         1. The lower bound of the leading class's vote share (Wilson score
+            interval) exceeds one half, so it holds a true majority.
+         2. The lower bound of the mean confidence of the leading class's
+            votes exceeds minConfidence.
+
+       NOTE: The image is assumed to contain only one classification, so
+             inputs containing more than one will return undefined behavior.
+
+       network         : Pre-trained ClassifierNetwork to classify the image
+       image           : image to classify. The size is assumed to be greater
+                         than or equal to the network's input size.
+                         (numChannels, numRows, numCols)
+       confidenceLevel : one-sided confidence level of the stopping rule
+       minConfidence   : required lower bound on the mean confidence
+       batchSize       : number of sub-regions to classify per network call
+                         None uses the batch size the network was built with
+       maxWindows      : maximum number of sub-regions to classify
+                         None allows all sub-regions to be classified
+       minWindows      : number of sub-regions classified before the
+                         stopping rule is checked
+       strata          : (rows, cols) grid of blocks used to stratify the
+                         sampling. None samples uniformly at random.
+       rng             : numpy.random.RandomState to draw the ordering
+       mask            : numpy.ndarray(bool) of (featureRows, featureCols)
+                         where False skips the sub-region. See
+                         createValidityMask(). None samples all sub-regions
+
+       return          : (classification index, likelihood value,
+                          number of sub-regions classified). The index is -1
+                          when there are no sub-regions to classify.
+    '''
+    from scipy.stats import norm
+    networkInputShape = _checkClassMapInputs(network, image)
+    if batchSize is None :
+        batchSize = network.getNetworkInputSize()[0]
+    if rng is None :
+        rng = np.random.RandomState()
+    z = norm.ppf(confidenceLevel)
+
+    featureShape = (image.shape[1] - networkInputShape[1] + 1,
+                    image.shape[2] - networkInputShape[2] + 1)
+    classifications, confidence = _createClassMapBuffers(featureShape, None)
+    windows = _createWindowView(image, networkInputShape)
+    order = _createSampleOrder(featureShape, strata, rng)
+    if mask is not None :
+        order = order[mask.flat[order]]
+    if maxWindows is not None :
+        order = order[:maxWindows]
+    if len(order) == 0 :
+        return -1, 0., 0
+
+    # running tallies of the votes, and the sum and squared sum of their
+    # confidence, for each class
+    votes, confSum, confSumSq = np.zeros((3, 0))
+    numEvaluated = 0
+    for start in range(0, len(order), batchSize) :
+        batchIndices = order[start:start + batchSize]
+        _classifyWindows(network, windows, batchIndices,
+                         classifications, confidence, batchSize)
+        numEvaluated += len(batchIndices)
+
+        batchVotes = classifications.flat[batchIndices]
+        batchConf = confidence.flat[batchIndices]
+        numClasses = max(len(votes), int(batchVotes.max()) + 1)
+        def tally(total, weights=None) :
+            return np.pad(total, (0, numClasses - len(total)), 'constant') + \
+                   np.bincount(batchVotes, weights, numClasses)
+        votes = tally(votes)
+        confSum = tally(confSum, batchConf)
+        confSumSq = tally(confSumSq, batchConf ** 2)
+
+        leader = int(votes.argmax())
+        numVotes = int(votes[leader])
+        meanConf = confSum[leader] / numVotes
+        if numEvaluated < minWindows or numVotes < 2 :
+            continue
+
+        # lower bound of the vote share
+        share = float(numVotes) / numEvaluated
+        zSq = z * z / numEvaluated
+        spread = z * np.sqrt(share * (1. - share) / numEvaluated +
+                             zSq / (4. * numEvaluated))
+        shareBound = (share + zSq / 2. - spread) / (1. + zSq)
+
+        # lower bound of the mean confidence
+        stdConf = np.sqrt(max(confSumSq[leader] - numVotes * meanConf ** 2,
+                              0.) / (numVotes - 1))
+        confBound = meanConf - z * stdConf / np.sqrt(numVotes)
+
+        if shareBound > .5 and confBound > minConfidence :
+            break
+
+    return leader, meanConf, numEvaluated
+
+def listImages(inputs, extensions=('.png', '.jpg', '.jpeg', '.tif', '.tiff',
+                                   '.bmp', '.nitf', '.ntf', '.sio', '.npy')) :
+    '''Expand a list of inputs into image paths. Each input may be an image,
+       a directory which is searched recursively for the given extensions, or
+       a .txt file listing one image path per line.
+
+       inputs     : list of paths
+       extensions : lower-case extensions recognized as images in directories
+       return     : list of image paths in a stable order
+    '''
+    import os
+    images = []
+    for path in inputs :
+        if os.path.isdir(path) :
+            for root, dirs, files in os.walk(path) :
+                dirs.sort()
+                images.extend(os.path.join(root, f) for f in sorted(files)
+                              if os.path.splitext(f)[1].lower() in extensions)
+        elif path.lower().endswith('.txt') :
+            with open(path, 'r') as f :
+                images.extend(line.strip() for line in f if line.strip())
+        else :
+            images.append(path)
+    return images
+
+_batchState = {}
+
+def _initBatchWorker(network, stride, threshold, batchSize) :
+    '''Setup a batch classification worker. The network is compiled before
+       the workers are forked, so each inherits the compiled functions.
+    '''
+    _batchState['network'] = network
+    _batchState['stride'] = stride
+    _batchState['threshold'] = threshold
+    _batchState['batchSize'] = batchSize
+
+def _classifyImage(path) :
+    '''Classify a single image file as a single object.
+
+       return : dictionary of the results, which is serializable as JSON
+    '''
+    from timeit import default_timer as timer
+    from dataset.reader import readImage
+    network = _batchState['network']
+    start = timer()
+    try :
+        image = np.load(path, mmap_mode='r') \
+                if path.lower().endswith('.npy') else readImage(path)
+        image = np.asarray(image, dtype=network.getNetworkInput()[0].dtype)
+        loaded = timer()
+        classIndex, likelihood = singleClassify(
+            network, image, _batchState['stride'], _batchState['threshold'],
+            _batchState['batchSize'])
+    except Exception as e :
+        return {'image' : path, 'error' : str(e)}
+    classified = timer()
+    return {'image' : path, 'class' : int(classIndex),
+            'confidence' : float(likelihood),
+            'readTime' : loaded - start, 'classifyTime' : classified - loaded}
+
+def classifyImages(network, images, outputFile, numWorkers=None, stride=1,
+                   threshold=.1, batchSize=None, log=None) :
+    '''Classify many images with a single network. The network is loaded and
+       compiled once, then copy-on-write worker processes are forked to
+       classify the images with singleClassify(). Each result is appended to
+       the JSON Lines output file as it finishes.
+
+       The run is resumable -- images with a successful result already in the
+       output file are skipped, while images which previously failed are
+       retried.
+
+       NOTE: This relies on fork() to share the compiled network, so it is
+             not supported on platforms which spawn worker processes.
+
+       network    : Pre-trained ClassifierNetwork to classify the images
+       images     : list of image paths. See listImages().
+       outputFile : JSON Lines file of results
+       numWorkers : number of worker processes
+                    None uses the number of available processors
+       stride     : stride of the coarse scan. See singleClassify().
+       threshold  : change in confidence which triggers a dense search
+       batchSize  : number of sub-regions to classify per network call
+                    None uses the batch size the network was built with
+       log        : Logger to use
+
+       return     : number of images classified by this call
+    '''
+    import os
+    import json
+    from multiprocessing import Pool
+
+    # find the images which are already finished
+    finished = set()
+    if os.path.exists(outputFile) :
+        with open(outputFile, 'r') as f :
+            for line in f :
+                try :
+                    result = json.loads(line)
+                except ValueError :
+                    # a partially written line from an interrupted run
+                    continue
+                if 'error' not in result :
+                    finished.add(result['image'])
+    remaining = [path for path in images if path not in finished]
+    if log is not None :
+        log.info('Classifying [' + str(len(remaining)) + '] of [' +
+                 str(len(images)) + '] images')
+    if len(remaining) == 0 :
+        return 0
+
+    # compile the network before forking so workers inherit the functions
+    network.infer(np.zeros(network.getNetworkInputSize(),
+                           dtype=network.getNetworkInput()[0].dtype))
+
+    pool = Pool(numWorkers, initializer=_initBatchWorker,
+                initargs=(network, stride, threshold, batchSize))
+    try :
+        with open(outputFile, 'a') as f :
+            for result in pool.imap_unordered(_classifyImage, remaining) :
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                if log is not None and 'error' in result :
+                    log.warning('Failed to classify [' + result['image'] +
+                                ']: ' + result['error'])
+        pool.close()
+    except :
+        pool.terminate()
+        raise
+    finally :
+        pool.join()
+    return len(remaining)
 
 
 if __name__ == "__main__" :
     import argparse
-    from datasetUtils import readImage
+    from dataset.reader import readImage
     from net import ClassifierNetwork as Network
     from dataset.reader import normalize
 
@@ -101,19 +813,155 @@ if __name__ == "__main__" :
                         help='Load from a previously saved network.')
     parser.add_argument('--out', dest='outFile', type=str, default=None,
                         help='Output image with box classifications.')
-    parser.add_argument('image', help='Image to classify')
+    parser.add_argument('--batch', dest='batchSize', type=int, default=None,
+                        help='Number of sub-regions to classify per call.')
+    parser.add_argument('--workers', dest='numWorkers', type=int, default=None,
+                        help='Classify tiles of the image in this many ' +
+                             'worker processes.')
+    parser.add_argument('--tile', dest='tileSize', type=int, nargs=2,
+                        default=[256, 256],
+                        help='Number of sub-regions per tile (rows, cols).')
+    parser.add_argument('--stride', dest='stride', type=int, default=1,
+                        help='Stride of a coarse scan which is refined ' +
+                             'where the classification changes.')
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        default=.1, help='Change in confidence between ' +
+                        'coarse samples which triggers a dense search.')
+    parser.add_argument('--minVariance', dest='minVariance', type=float,
+                        default=None, help='Skip sub-regions where the ' +
+                        'variance of every channel is at most this value.')
+    parser.add_argument('--nodata', dest='nodata', type=float, default=None,
+                        help='Skip sub-regions containing this pixel value.')
+    parser.add_argument('--stream', dest='stream', type=str, default=None,
+                        help='Stream the class map into memory-mapped ' +
+                             'files with this base name. --out then writes ' +
+                             'the confidence as image tiles.')
+    parser.add_argument('--band', dest='bandRows', type=int, default=64,
+                        help='Number of rows of sub-regions per band when ' +
+                             'streaming.')
+    parser.add_argument('--sample', dest='sample', action='store_true',
+                        help='Classify a single object by sampling ' +
+                             'sub-regions until the result is confident.')
+    parser.add_argument('--level', dest='confidenceLevel', type=float,
+                        default=.95, help='Confidence level of the ' +
+                        'stopping rule when sampling.')
+    parser.add_argument('--cache', dest='cache', type=str, default=None,
+                        help='Directory of cached results to reuse.')
+    parser.add_argument('--cacheSize', dest='cacheSize', type=int,
+                        default=1024, help='Size budget of the cache in MB.')
+    parser.add_argument('--dense', dest='dense', action='store_true',
+                        help='Classify all sub-regions in a single pass ' +
+                             'through a fully-convolutional network.')
+    parser.add_argument('--shallow', dest='shallow', type=str, default=None,
+                        help='Screen every sub-region with this shallow ' +
+                             'network and only send uncertain sub-regions ' +
+                             'to the --syn network.')
+    parser.add_argument('--screen', dest='screen', type=float, default=.9,
+                        help='Softmax confidence at which the shallow ' +
+                             'network is trusted. See nn/cascade.py to ' +
+                             'calibrate this value.')
+    parser.add_argument('--jsonl', dest='jsonl', type=str, default=None,
+                        help='Classify every input as a single object and ' +
+                             'append the results to this JSON Lines file. ' +
+                             'Finished images are skipped when resuming.')
+    parser.add_argument('image', nargs='+',
+                        help='Image to classify. With --jsonl this may be ' +
+                             'several images, directories or .txt lists.')
     options = parser.parse_args()
 
-    # load everything into memory
-    image = readImage(options.image)
+    # classify many images with a single network
+    if options.jsonl is not None :
+        classifyImages(Network(options.synapse), listImages(options.image),
+                       options.jsonl, options.numWorkers, options.stride,
+                       options.threshold, options.batchSize)
+        raise SystemExit(0)
+    if len(options.image) > 1 :
+        parser.error('Multiple images require --jsonl.')
+    options.image = options.image[0]
+
+    # load everything into memory -- .npy images are memory-mapped
+    if options.image.lower().endswith('.npy') :
+        image = np.load(options.image, mmap_mode='r')
+    else :
+        image = readImage(options.image)
 
     network = Network(options.synapse)
+    if options.shallow is not None :
+        from nn.cascade import CascadeClassifier
+        network = CascadeClassifier(Network(options.shallow), network,
+                                    options.screen)
+
+    # reject flat and nodata sub-regions before they reach the network
+    mask = None
+    if options.minVariance is not None or options.nodata is not None :
+        mask = createValidityMask(
+            image, network.getNetworkInputSize(),
+            minVariance=-1. if options.minVariance is None else \
+                        options.minVariance,
+            nodata=options.nodata)
+
+    # sample until a single object is confidently classified
+    if options.sample :
+        classification, likelihood, numEvaluated = sampledSingleClassify(
+            network, image, options.confidenceLevel,
+            batchSize=options.batchSize, mask=mask)
+        print('Class [' + str(classification) + '] with likelihood [' +
+              str(likelihood) + '] after [' + str(numEvaluated) +
+              '] sub-regions')
+        raise SystemExit(0)
 
     # perform classification for multiple objects
-    if options.multi :
-        classification, confidence = createClassMap(network, image)
+    if options.multi and options.stream is not None :
+        classFile, confidenceFile = createClassMapFiles(
+            network, image, options.stream, options.bandRows,
+            options.batchSize, mask)
+        if options.outFile is not None :
+            saveConfidenceTiles(confidenceFile, options.outFile,
+                                options.tileSize)
+        raise SystemExit(0)
+
+    # classify the scene in memory
+    def classify() :
+        if options.multi and options.dense :
+            from nn.fullyConvolutional import FullyConvolutionalNetwork
+            classification, confidence = \
+                FullyConvolutionalNetwork(network).createClassMap(image)
+        elif options.multi and options.numWorkers is not None :
+            classification, confidence = createClassMapTiled(
+                network, image, options.tileSize, options.numWorkers,
+                options.batchSize, mask)
+        elif options.multi and options.stride > 1 :
+            classification, confidence, numSkipped = createCoarseClassMap(
+                network, image, options.stride, options.threshold,
+                options.batchSize, mask)
+            print('Skipped [' + str(numSkipped) + '] of [' +
+                  str(classification.size) + '] sub-regions')
+        elif options.multi :
+            classification, confidence = createClassMap(
+                network, image, options.batchSize, mask)
+        else :
+            classification, confidence = singleClassify(
+                network, image, options.stride, options.threshold,
+                options.batchSize)
+        return classification, confidence
+
+    # reuse the results of previous runs over the same scene and synapses
+    if options.cache is not None :
+        from nn.cache import ResultCache
+        cache = ResultCache(options.cache, options.cacheSize * 2**20)
+        # the cascade is keyed by the deep network and both screening inputs
+        keyNetwork, cascade = network, {}
+        if options.shallow is not None :
+            from nn.cache import digestNetwork
+            keyNetwork = network._deep
+            cascade = {'shallow' : digestNetwork(network._shallow),
+                       'screen' : options.screen}
+        classification, confidence = cache.fetch(
+            keyNetwork, image, classify, multi=options.multi,
+            dense=options.dense, stride=options.stride,
+            threshold=options.threshold, mask=mask, **cascade)
     else :
-        classification, confidence = singleClassify(network, image)
+        classification, confidence = classify()
 
     # write a product if it was asked for
     if options.outFile is not None : 
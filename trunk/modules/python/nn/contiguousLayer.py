@@ -50,6 +50,7 @@ class ContiguousLayer(Layer) :
            len(self._inputSize) is not 2 :
             self._inputSize = (1, inputSize)
         self._numNeurons = numNeurons
+        self._activation = activation
 
         # setup initial values for the weights
         if initialWeights is None :
@@ -114,6 +115,11 @@ class ContiguousLayer(Layer) :
     def getOutputSize (self) :
         '''(numInputs, number of neurons)'''
         return (self._inputSize[0], self._numNeurons)
+    def getCost (self) :
+        '''Estimate the cost of the layer for a single input.'''
+        from nn.costModel import contiguousCost
+        return contiguousCost(self._inputSize[1], self._numNeurons,
+                              bytesPerValue=np.dtype(config.floatX).itemsize)
 
     # DEBUG: For Debugging purposes only
     def writeWeights(self, ii, imageShape=None) :
@@ -51,6 +51,7 @@ class ConvolutionalLayer(Layer) :
         self._inputSize = inputSize
         self._kernelSize = kernelSize
         self._downsampleFactor = downsampleFactor
+        self._activation = activation
 
         # setup initial values for the weights -- if necessary
         if initialWeights is None :
@@ -90,8 +91,11 @@ class ConvolutionalLayer(Layer) :
             # the output buffer is now connected to a sequence of operations
             return pooling + thresholds.dimshuffle('x', 0, 'x', 'x')
 
+        # the classification path leaves the batch size unspecified, so the
+        # trained network can classify any number of inputs per call
         outClass = findLogits(self.input[0], self._weights,
-                              self._inputSize, self._kernelSize,
+                              (None,) + tuple(self._inputSize[1:]),
+                              self._kernelSize,
                               self._downsampleFactor, self._thresholds)
         outTrain = findLogits(self.input[1], self._weights,
                               self._inputSize, self._kernelSize,
@@ -133,6 +137,10 @@ class ConvolutionalLayer(Layer) :
         '''The initial kernel size provided at construction. This is sized
            (number of kernels, channels, rows, columns)'''
         return self._kernelSize
+    def getDownsampleFactor (self) :
+        '''The initial downsample factor provided at construction. This is
+           sized (rowFactor, columnFactor)'''
+        return self._downsampleFactor
     def getFeatureSize (self) :
         '''This is the post convolution size of the output.
            (batch size, number of kernels, rows, columns)'''
@@ -147,6 +155,12 @@ class ConvolutionalLayer(Layer) :
         return (fShape[0], fShape[1],
                 int(fShape[2] / self._downsampleFactor[0]),
                 int(fShape[3] / self._downsampleFactor[1]))
+    def getCost (self) :
+        '''Estimate the cost of the layer for a single input.'''
+        from nn.costModel import convolutionalCost
+        return convolutionalCost(
+            self._inputSize, self._kernelSize, self._downsampleFactor,
+            bytesPerValue=np.dtype(config.floatX).itemsize)
 
     # DEBUG: For Debugging purposes only 
     def writeWeights(self, ii) :
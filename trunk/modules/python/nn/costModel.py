@@ -0,0 +1,231 @@
+import numpy as np
+
+# These estimates are computed from the layer sizes alone, so networks can be
+# sized before any theano function is compiled. FLOPs count a multiply-add as
+# two operations, and all costs are for a single input unless noted.
+
+def _createCost(flops, params, activations, bytesPerValue) :
+    return {'flops' : int(flops), 'params' : int(params),
+            'activationBytes' : int(activations * bytesPerValue)}
+
+def convolutionalCost(inputSize, kernelSize, downsampleFactor,
+                      decoder=False, bytesPerValue=4) :
+    '''Estimate the cost of a ConvolutionalLayer.
+
+       inputSize        : (batch size, channels, rows, columns)
+       kernelSize       : (number of kernels, channels, rows, columns)
+       downsampleFactor : (rowFactor, columnFactor)
+       decoder          : include the decoder of a ConvolutionalAutoEncoder
+       bytesPerValue    : size of each activation
+       return           : dictionary of 'flops', 'params' and
+                          'activationBytes' for a single input
+    '''
+    numKernels, channels, kernelRows, kernelCols = kernelSize
+    featureRows = inputSize[2] - kernelRows + 1
+    featureCols = inputSize[3] - kernelCols + 1
+    features = numKernels * featureRows * featureCols
+    outputs = numKernels * (featureRows // downsampleFactor[0]) * \
+              (featureCols // downsampleFactor[1])
+
+    # the convolution, the pooling comparisons, thresholds and activation
+    macs = features * channels * kernelRows * kernelCols
+    flops = 2 * macs + features + 2 * outputs
+    params = numKernels * channels * kernelRows * kernelCols + numKernels
+    activations = features + outputs
+    if decoder :
+        # the full convolution back to the unpooled input
+        inputs = np.prod(inputSize[1:])
+        flops += 2 * macs + 2 * inputs
+        params += channels
+        activations += features + inputs
+    return _createCost(flops, params, activations, bytesPerValue)
+
+def separableCost(inputSize, kernelSize, downsampleFactor, decoder=False,
+                  bytesPerValue=4) :
+    '''Estimate the cost of a SeparableConvolutionalLayer.
+
+       inputSize        : (batch size, channels, rows, columns)
+       kernelSize       : (number of kernels, channels, rows, columns)
+       downsampleFactor : (rowFactor, columnFactor)
+       decoder          : include the decoder of a
+                          SeparableConvolutionalAutoEncoder
+       bytesPerValue    : size of each activation
+       return           : dictionary of 'flops', 'params' and
+                          'activationBytes' for a single input
+    '''
+    numKernels, channels, kernelRows, kernelCols = kernelSize
+    featureRows = inputSize[2] - kernelRows + 1
+    featureCols = inputSize[3] - kernelCols + 1
+    depthwise = channels * featureRows * featureCols
+    features = numKernels * featureRows * featureCols
+    outputs = numKernels * (featureRows // downsampleFactor[0]) * \
+              (featureCols // downsampleFactor[1])
+
+    macs = depthwise * kernelRows * kernelCols + features * channels
+    flops = 2 * macs + features + 2 * outputs
+    params = channels * kernelRows * kernelCols + \
+             numKernels * channels + numKernels
+    activations = depthwise + features + outputs
+    if decoder :
+        inputs = np.prod(inputSize[1:])
+        flops += 2 * macs + 2 * inputs
+        params += channels
+        activations += features + depthwise + inputs
+    return _createCost(flops, params, activations, bytesPerValue)
+
+def contiguousCost(numInputs, numNeurons, decoder=False, bytesPerValue=4) :
+    '''Estimate the cost of a ContiguousLayer.
+
+       numInputs     : length of the flattened input vector
+       numNeurons    : number of neurons in the layer
+       decoder       : include the decoder of a ContractiveAutoEncoder
+       bytesPerValue : size of each activation
+       return        : dictionary of 'flops', 'params' and
+                       'activationBytes' for a single input
+    '''
+    macs = numInputs * numNeurons
+    flops = 2 * macs + 2 * numNeurons
+    params = macs + numNeurons
+    activations = numNeurons
+    if decoder :
+        flops += 2 * macs + 2 * numInputs
+        params += numInputs
+        activations += numInputs
+    return _createCost(flops, params, activations, bytesPerValue)
+
+def createCostReport(layerCosts, batchSize, dominance=.5, bytesPerValue=4) :
+    '''Combine the layer costs into a network report.
+
+       The memory estimates are upper bounds. Inference keeps every
+       activation of the batch, and training also keeps their gradients, as
+       well as a gradient and momentum buffer for every parameter.
+
+       layerCosts    : list of (layerID, cost dictionary) in network order
+       batchSize     : number of inputs per network call
+       dominance     : fraction of the network total at which a layer is
+                       flagged as dominating a cost
+       bytesPerValue : size of each weight
+       return        : dictionary of the per-batch 'flops', 'params',
+                       'weightBytes', 'inferenceBytes', 'trainingBytes' and
+                       the 'layers' list. Each layer entry holds its
+                       per-batch costs, the share of each network total and
+                       the 'dominant' list of costs it dominates.
+    '''
+    totals = {'flops' : sum(c['flops'] for _, c in layerCosts) * batchSize,
+              'params' : sum(c['params'] for _, c in layerCosts),
+              'activationBytes' : sum(c['activationBytes']
+                                      for _, c in layerCosts) * batchSize}
+
+    layers = []
+    for layerID, cost in layerCosts :
+        entry = {'layerID' : layerID,
+                 'flops' : cost['flops'] * batchSize,
+                 'params' : cost['params'],
+                 'activationBytes' : cost['activationBytes'] * batchSize,
+                 'dominant' : []}
+        for key in ('flops', 'params', 'activationBytes') :
+            entry[key + 'Share'] = float(entry[key]) / max(totals[key], 1)
+            if len(layerCosts) > 1 and entry[key + 'Share'] >= dominance :
+                entry['dominant'].append(key)
+        layers.append(entry)
+
+    weightBytes = totals['params'] * bytesPerValue
+    return {'batchSize' : batchSize, 'flops' : totals['flops'],
+            'params' : totals['params'], 'weightBytes' : weightBytes,
+            'inferenceBytes' : weightBytes + totals['activationBytes'],
+            'trainingBytes' : 3 * weightBytes +
+                              2 * totals['activationBytes'],
+            'layers' : layers}
+
+def formatCostReport(report) :
+    '''Format the report of createCostReport() as a table.'''
+    def megs(numBytes) :
+        return '%.2fMB' % (numBytes / float(2**20))
+    lines = ['%-12s %14s %6s %12s %6s %10s %6s  %s' % (
+             'layer', 'MFLOPs/batch', '%', 'params', '%',
+             'activation', '%', 'dominates')]
+    for entry in report['layers'] :
+        lines.append('%-12s %14.2f %6.1f %12d %6.1f %10s %6.1f  %s' % (
+            entry['layerID'], entry['flops'] / 1e6,
+            100. * entry['flopsShare'], entry['params'],
+            100. * entry['paramsShare'], megs(entry['activationBytes']),
+            100. * entry['activationBytesShare'],
+            ', '.join(entry['dominant'])))
+    lines.append('Batch [' + str(report['batchSize']) + '] MFLOPs [' +
+                 '%.2f' % (report['flops'] / 1e6) + '] params [' +
+                 str(report['params']) + '] weights [' +
+                 megs(report['weightBytes']) + '] inference memory [' +
+                 megs(report['inferenceBytes']) + '] training memory [' +
+                 megs(report['trainingBytes']) + ']')
+    return '\n'.join(lines)
+
+def parseLayerSpecs(inputSize, specs) :
+    '''Create the layer costs of a topology described on the command line.
+
+       inputSize : (channels, rows, columns) of the network input
+       specs     : list of layer descriptions --
+                   'conv:kernels,rows,cols,rowFactor,colFactor'
+                   'sep:kernels,rows,cols,rowFactor,colFactor'
+                   'full:neurons'
+       return    : list of (layerID, cost dictionary)
+    '''
+    layerCosts = []
+    size = (1,) + tuple(inputSize)
+    for ii, spec in enumerate(specs) :
+        kind, _, values = spec.partition(':')
+        values = [int(v) for v in values.split(',')]
+        layerID = kind + str(ii)
+        if kind in ('conv', 'sep') :
+            if len(size) != 4 or len(values) != 5 :
+                raise ValueError('Invalid convolutional layer [' + spec + ']')
+            kernelSize = (values[0], size[1], values[1], values[2])
+            cost = convolutionalCost if kind == 'conv' else separableCost
+            layerCosts.append((layerID, cost(size, kernelSize, values[3:])))
+            size = (1, values[0],
+                    (size[2] - values[1] + 1) // values[3],
+                    (size[3] - values[2] + 1) // values[4])
+        elif kind == 'full' :
+            if len(values) != 1 :
+                raise ValueError('Invalid contiguous layer [' + spec + ']')
+            layerCosts.append((layerID, contiguousCost(
+                int(np.prod(size[1:])), values[0])))
+            size = (1, values[0])
+        else :
+            raise ValueError('Unknown layer type [' + spec + ']')
+    return layerCosts
+
+
+if __name__ == '__main__' :
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Predict the compute and memory of a network. Either ' +
+                    'describe the layers, such as -- ' +
+                    'conv:6,5,5,2,2 conv:6,5,5,2,2 full:120 full:10 ' +
+                    '-- or load a saved network with --syn.')
+    parser.add_argument('--input', dest='inputSize', type=int, nargs=3,
+                        default=[1, 28, 28],
+                        help='Network input size (channels, rows, cols).')
+    parser.add_argument('--batch', dest='batchSize', type=int, default=None,
+                        help='Number of inputs per network call. This ' +
+                             'defaults to one, or the batch size of --syn.')
+    parser.add_argument('--dominance', dest='dominance', type=float,
+                        default=.5, help='Fraction of the network total ' +
+                        'at which a layer is flagged.')
+    parser.add_argument('--syn', dest='synapse', type=str, default=None,
+                        help='Report a previously saved network.')
+    parser.add_argument('layers', nargs='*', help='Layer descriptions.')
+    options = parser.parse_args()
+
+    if options.synapse is not None :
+        from nn.net import ClassifierNetwork
+        report = ClassifierNetwork(options.synapse).getCostReport(
+            options.batchSize, options.dominance)
+    else :
+        if len(options.layers) == 0 :
+            parser.error('Specify the layers or --syn.')
+        report = createCostReport(
+            parseLayerSpecs(options.inputSize, options.layers),
+            1 if options.batchSize is None else options.batchSize,
+            options.dominance)
+    print(formatCostReport(report))
@@ -0,0 +1,191 @@
+import numpy as np
+import theano.tensor as t
+from theano import config, function
+from nn.net import ClassifierNetwork
+from nn.convolutionalLayer import ConvolutionalLayer
+from nn.contiguousLayer import ContiguousLayer
+
+class FullyConvolutionalNetwork () :
+    '''The FullyConvolutionalNetwork converts a trained ClassifierNetwork into
+       an equivalent fully-convolutional graph. Instead of classifying each
+       sub-region of an image independently, the entire image is activated in
+       a single pass, so computation shared between overlapping sub-regions
+       is only performed once.
+
+       ConvolutionalLayers are applied to the full image. The max-pooling
+       downsample is handled with shift-and-stitch -- each pooling layer is
+       evaluated for every pixel offset within its pooling window and the
+       offsets are folded into the batch dimension. ContiguousLayers become
+       convolutions, where the first uses a kernel spanning the final
+       convolutional output and all others are 1x1 convolutions. The offset
+       outputs are then interleaved back into a dense map.
+
+       The weights remain shared with the original network, so further
+       training is reflected without rebuilding this object.
+
+       NOTE: Memory grows with the product of the squared downsample factors,
+             so very large scenes should be tiled.
+
+       network : Pre-trained ClassifierNetwork to convert. This must be a
+                 series of ConvolutionalLayers followed by ContiguousLayers.
+       log     : Logger to use
+    '''
+    def __init__ (self, network, log=None) :
+        from theano.tensor.nnet.conv import conv2d
+
+        if not isinstance(network, ClassifierNetwork) :
+            raise ValueError('network must be a ClassifierNetwork object')
+        layers = network._layers
+        if len(layers) == 0 :
+            raise IndexError('Network must have at least one layer ' +
+                             'to create a FullyConvolutionalNetwork.')
+        if not isinstance(layers[0], ConvolutionalLayer) :
+            raise ValueError('The first layer must be a ConvolutionalLayer.')
+
+        if log is not None :
+            log.info('Converting the network to a fully-convolutional graph')
+        self._log = log
+        self._windowShape = network.getNetworkInputSize()[-3:]
+
+        # each batch entry of the output corresponds to one combination of
+        # pooling offsets. Track the pixel offset and the cumulative stride
+        # so the outputs can be stitched back together.
+        self._offsets = [(0, 0)]
+        self._stride = (1, 1)
+
+        image = t.tensor4('image', dtype=config.floatX)
+        out = image
+        convOutputSize = None
+        for layer in layers :
+            if isinstance(layer, ConvolutionalLayer) :
+                if convOutputSize is not None and \
+                   len(convOutputSize) == 2 :
+                    raise ValueError('ConvolutionalLayers must precede all ' +
+                                     'ContiguousLayers.')
+                convolve = conv2d(out, layer.getWeights()[0],
+                                  filter_shape=layer.getKernelSize())
+                out = self._shiftAndPool(convolve,
+                                         layer.getDownsampleFactor())
+                out = out + layer.getWeights()[1].dimshuffle('x', 0, 'x', 'x')
+                convOutputSize = layer.getOutputSize()
+
+            elif isinstance(layer, ContiguousLayer) :
+                weights, thresholds = layer.getWeights()[:2]
+                numNeurons = layer.getOutputSize()[1]
+                if len(convOutputSize) == 4 :
+                    # the first fully-connected layer spans the entire
+                    # convolutional output. conv2d flips the kernel, so the
+                    # reshaped weights are flipped to perform a correlation.
+                    kernelSize = (numNeurons,) + tuple(convOutputSize[1:])
+                    kernel = t.reshape(weights.T, kernelSize)[:, :, ::-1, ::-1]
+                    out = conv2d(out, kernel, filter_shape=kernelSize)
+                else :
+                    # all subsequent layers are 1x1 convolutions
+                    out = t.tensordot(out, weights, axes=[[1], [0]])
+                    out = out.dimshuffle(0, 3, 1, 2)
+                out = out + thresholds.dimshuffle('x', 0, 'x', 'x')
+                convOutputSize = layer.getOutputSize()
+
+            else :
+                raise ValueError('Unsupported layer type [' +
+                                 layer.__class__.__name__ + '] in layer [' +
+                                 str(layer.layerID) + ']')
+
+            # the classification path scales by the dropout retention rate
+            if layer.getDropout() is not None :
+                out = out / layer.getDropout()
+            activation = layer.getActivation()
+            if activation is not None :
+                out = activation(out)
+
+        # softmax across the neuron dimension of the final layer
+        out = out - t.max(out, axis=1, keepdims=True)
+        out = t.exp(out)
+        out = out / t.sum(out, axis=1, keepdims=True)
+        self._classMap = function([image], [t.argmax(out, axis=1),
+                                            t.max(out, axis=1)])
+
+    def _shiftAndPool (self, input, downsampleFactor) :
+        '''Max-pool the input at every offset within the pooling window. The
+           offsets are concatenated along the batch dimension, such that the
+           new batch index is (offsetIndex * oldBatchSize + oldBatchIndex).
+        '''
+        from theano.tensor.signal.downsample import max_pool_2d
+        rowFactor, colFactor = downsampleFactor
+        if rowFactor == 1 and colFactor == 1 :
+            return input
+
+        # pad the input so every offset produces the same number of pooled
+        # elements. The padding only contributes to sub-regions which extend
+        # past the image, and those are discarded when stitching.
+        numRows = (input.shape[2] + rowFactor - 1) // rowFactor
+        numCols = (input.shape[3] + colFactor - 1) // colFactor
+        padded = t.zeros((input.shape[0], input.shape[1],
+                          numRows * rowFactor + rowFactor - 1,
+                          numCols * colFactor + colFactor - 1),
+                         dtype=input.dtype)
+        padded = t.set_subtensor(
+            padded[:, :, :input.shape[2], :input.shape[3]], input)
+
+        shifted = []
+        for rowOffset in range(rowFactor) :
+            for colOffset in range(colFactor) :
+                shifted.append(max_pool_2d(
+                    padded[:, :, rowOffset : rowOffset + numRows * rowFactor,
+                                 colOffset : colOffset + numCols * colFactor],
+                    downsampleFactor, True))
+
+        # record where each offset lands in the original image
+        self._offsets = [(rowOrig + self._stride[0] * rowOffset,
+                          colOrig + self._stride[1] * colOffset)
+                         for rowOffset in range(rowFactor)
+                         for colOffset in range(colFactor)
+                         for rowOrig, colOrig in self._offsets]
+        self._stride = (self._stride[0] * rowFactor,
+                        self._stride[1] * colFactor)
+        return t.concatenate(shifted, axis=0)
+
+    def getStride (self) :
+        '''The total downsample of the network (rowStride, colStride).'''
+        return self._stride
+
+    def createClassMap (self, image) :
+        '''Classify all sub-regions of the image in a single pass. This
+           produces the same matrices as classifierUtils.createClassMap()
+           within floating point tolerance.
+
+           image  : image to classify. The size is assumed to be greater than
+                    or equal to the network's input size.
+                    (numChannels, numRows, numCols)
+
+           return : numpy.ndarray(classification), numpy.ndarray(confidence)
+        '''
+        if not isinstance(image, np.ndarray) :
+            raise ValueError('image must be a numpy.ndarray object')
+        if image.shape[0] != self._windowShape[0] :
+            raise Exception('The image has a different number of channels ' +
+                            'than the network was trained to recognize.')
+        if image.shape[1] < self._windowShape[1] or \
+           image.shape[2] < self._windowShape[2] :
+            raise Exception('The image is smaller than the network input.')
+
+        if self._log is not None :
+            self._log.debug('Activating the fully-convolutional network')
+        classes, likelihood = self._classMap(
+            np.asarray(image[np.newaxis], dtype=config.floatX))
+
+        # stitch the offsets back together --
+        # each offset fills a regular sub-grid of the final maps
+        featureShape = (image.shape[1] - self._windowShape[1] + 1,
+                        image.shape[2] - self._windowShape[2] + 1)
+        classifications = np.ndarray(featureShape, dtype='int32')
+        confidence = np.ndarray(featureShape)
+        rowStride, colStride = self._stride
+        for ii, (rowOffset, colOffset) in enumerate(self._offsets) :
+            numRows = len(range(rowOffset, featureShape[0], rowStride))
+            numCols = len(range(colOffset, featureShape[1], colStride))
+            classifications[rowOffset::rowStride, colOffset::colStride] = \
+                classes[ii, :numRows, :numCols]
+            confidence[rowOffset::rowStride, colOffset::colStride] = \
+                likelihood[ii, :numRows, :numCols]
+        return classifications, confidence
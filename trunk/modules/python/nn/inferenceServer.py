@@ -0,0 +1,424 @@
+import json
+import socket
+import struct
+import threading
+import numpy as np
+from collections import deque
+from timeit import default_timer as timer
+from six.moves import queue, socketserver
+
+# Every message is a 4-byte big-endian header length, a JSON header and an
+# optional raw payload of header['nbytes'] bytes. Arrays are sent as their
+# raw bytes with the dtype and shape in the header, so no pickling occurs.
+_headerLength = struct.Struct('>I')
+
+def _recvAll(sock, numBytes) :
+    '''Read exactly numBytes from the socket. Returns None on disconnect.'''
+    chunks = []
+    while numBytes > 0 :
+        chunk = sock.recv(min(numBytes, 1<<20))
+        if not chunk :
+            return None
+        chunks.append(chunk)
+        numBytes -= len(chunk)
+    return b''.join(chunks)
+
+def sendMessage(sock, header, array=None) :
+    '''Send a header and an optional numpy.ndarray payload.
+
+       sock   : connected socket
+       header : dictionary which is serializable as JSON
+       array  : numpy.ndarray payload or None
+    '''
+    header = dict(header)
+    payload = b''
+    if array is not None :
+        array = np.ascontiguousarray(array)
+        header['dtype'] = str(array.dtype)
+        header['shape'] = list(array.shape)
+        payload = array.tobytes()
+    header['nbytes'] = len(payload)
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(_headerLength.pack(len(encoded)) + encoded + payload)
+
+def recvMessage(sock) :
+    '''Receive a message sent by sendMessage().
+
+       sock   : connected socket
+       return : (header, numpy.ndarray or None), or None on disconnect
+    '''
+    size = _recvAll(sock, _headerLength.size)
+    if size is None :
+        return None
+    encoded = _recvAll(sock, _headerLength.unpack(size)[0])
+    if encoded is None :
+        return None
+    header = json.loads(encoded.decode('utf-8'))
+    array = None
+    if header.get('nbytes', 0) > 0 :
+        payload = _recvAll(sock, header['nbytes'])
+        if payload is None :
+            return None
+        array = np.frombuffer(payload, dtype=header['dtype']).reshape(
+            header['shape'])
+    return header, array
+
+class _Request () :
+    '''A pending classification waiting for the batcher.'''
+    def __init__ (self, inputs) :
+        self.inputs = inputs
+        self.arrival = timer()
+        self.done = threading.Event()
+        self.classIndex = None
+        self.softmax = None
+        self.error = None
+        self.queueTime = None
+        self.inferTime = None
+        self.batchSize = None
+
+class InferenceServer () :
+    '''The InferenceServer loads a synapse once and serves classification
+       requests over a Unix or TCP socket. Concurrent requests are coalesced
+       into micro-batches by a single batcher thread -- a batch is dispatched
+       once it holds maxBatch chips or the oldest request has waited maxWait
+       seconds.
+
+       Requests larger than maxBatch are split across several micro-batches,
+       so no batch exceeds maxBatch chips.
+
+       The network may be swapped for a newer synapse while running. The new
+       network is loaded and compiled on the side, and the batcher picks it
+       up at its next batch, so no requests are dropped. Requests still
+       pending when the server shuts down fail with an error.
+
+       synapse  : path to a trained ClassifierNetwork
+       address  : path of a Unix socket, or a (host, port) tuple for TCP
+       maxBatch : maximum number of chips in a micro-batch
+       maxWait  : maximum time in seconds a request waits for a batch to fill
+       log      : Logger to use
+    '''
+    def __init__ (self, synapse, address, maxBatch=64, maxWait=.005,
+                  log=None) :
+        self._maxBatch = maxBatch
+        self._maxWait = maxWait
+        self._log = log
+        self._requests = queue.Queue()
+        self._carried = None
+        self._running = False
+        self._submitLock = threading.Lock()
+        self._swapLock = threading.Lock()
+        self._statsLock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self._numRequests = 0
+        self._numChips = 0
+        self._numBatches = 0
+        self._network, self._synapse = self._loadNetwork(synapse), synapse
+
+        server = self
+        class Handler (socketserver.BaseRequestHandler) :
+            def handle (self) :
+                server._handleConnection(self.request)
+
+        if isinstance(address, tuple) :
+            class Server (socketserver.ThreadingMixIn,
+                          socketserver.TCPServer) :
+                daemon_threads = True
+                allow_reuse_address = True
+        else :
+            class Server (socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer) :
+                daemon_threads = True
+        self._server = Server(address, Handler)
+
+    def _loadNetwork (self, synapse) :
+        '''Load and compile a network so it is ready to serve. The network is
+           warmed up with a batch of the size it was compiled with.
+        '''
+        from nn.net import ClassifierNetwork
+        if self._log is not None :
+            self._log.info('Loading the network [' + synapse + ']')
+        network = ClassifierNetwork(synapse)
+        network.infer(np.zeros(network.getNetworkInputSize(),
+                               dtype=network.getNetworkInput()[0].dtype))
+        return network
+
+    def _nextBatch (self) :
+        '''Block until requests are available and gather a micro-batch. A
+           request which would overflow the batch is carried over to the
+           next one.
+        '''
+        if self._carried is not None :
+            batch, self._carried = [self._carried], None
+        else :
+            while self._running :
+                try :
+                    batch = [self._requests.get(timeout=.1)]
+                    break
+                except queue.Empty :
+                    pass
+            else :
+                return []
+
+        numChips = len(batch[0].inputs)
+        deadline = batch[0].arrival + self._maxWait
+        while numChips < self._maxBatch :
+            remaining = deadline - timer()
+            try :
+                request = self._requests.get(timeout=remaining) \
+                          if remaining > 0 else self._requests.get_nowait()
+            except queue.Empty :
+                break
+            if numChips + len(request.inputs) > self._maxBatch :
+                self._carried = request
+                break
+            batch.append(request)
+            numChips += len(request.inputs)
+        return batch
+
+    def _failPending (self, error) :
+        '''Fail every request which has not been classified.'''
+        pending = [] if self._carried is None else [self._carried]
+        self._carried = None
+        while True :
+            try :
+                pending.append(self._requests.get_nowait())
+            except queue.Empty :
+                break
+        for request in pending :
+            request.error = error
+            request.done.set()
+
+    def _runBatcher (self) :
+        '''Classify micro-batches until the server is stopped.'''
+        while self._running :
+            batch = self._nextBatch()
+            if len(batch) == 0 :
+                continue
+
+            # the network is read once per batch, so a swap takes effect
+            # between batches without interrupting one
+            network = self._network
+            start = timer()
+            try :
+                inputs = np.concatenate([r.inputs for r in batch])
+                classIndex, softmax = network.infer(inputs)
+                # the outputs are theano's buffers -- copy before reuse
+                classIndex, softmax = np.array(classIndex), np.array(softmax)
+            except Exception as e :
+                for request in batch :
+                    request.error = str(e)
+                    request.done.set()
+                continue
+            inferTime = timer() - start
+
+            offset = 0
+            for request in batch :
+                numChips = len(request.inputs)
+                request.classIndex = classIndex[offset:offset + numChips]
+                request.softmax = softmax[offset:offset + numChips]
+                request.queueTime = start - request.arrival
+                request.inferTime = inferTime
+                request.batchSize = len(inputs)
+                offset += numChips
+                request.done.set()
+
+            with self._statsLock :
+                self._numBatches += 1
+                self._numChips += len(inputs)
+                self._numRequests += len(batch)
+
+    def _classify (self, header, inputs) :
+        '''Queue the inputs for the batcher and build the response.'''
+        windowShape = tuple(self._network.getNetworkInputSize()[1:])
+        if inputs is None :
+            return {'error' : 'classify requires an input array'}
+        if inputs.ndim == 3 :
+            inputs = inputs[np.newaxis]
+        if tuple(inputs.shape[1:]) != windowShape :
+            return {'error' : 'inputs must be sized ' + str(windowShape)}
+
+        # split large inputs so every micro-batch stays within maxBatch
+        inputs = np.asarray(
+            inputs, dtype=self._network.getNetworkInput()[0].dtype)
+        requests = [_Request(inputs[start:start + self._maxBatch])
+                    for start in range(0, len(inputs), self._maxBatch)]
+        with self._submitLock :
+            if not self._running :
+                return {'error' : 'The server is not running.'}
+            for request in requests :
+                self._requests.put(request)
+        for request in requests :
+            request.done.wait()
+            if request.error is not None :
+                return {'error' : request.error}
+
+        # report the top-k of the softmax for each chip
+        classIndex = np.concatenate([r.classIndex for r in requests])
+        softmax = np.concatenate([r.softmax for r in requests])
+        topK = min(int(header.get('topK', 1)), softmax.shape[1])
+        ranks = np.argsort(-softmax, axis=1)[:, :topK]
+        totalTime = timer() - requests[0].arrival
+        with self._statsLock :
+            self._latencies.append(totalTime)
+        return {'classIndex' : classIndex.tolist(),
+                'topK' : [[[int(ii), float(s[ii])] for ii in r]
+                          for r, s in zip(ranks, softmax)],
+                'latency' : {'queue' : max(r.queueTime for r in requests),
+                             'inference' : max(r.inferTime
+                                               for r in requests),
+                             'total' : totalTime,
+                             'batchSize' : max(r.batchSize
+                                               for r in requests)}}
+
+    def swap (self, synapse) :
+        '''Replace the served network with a newer synapse. Requests already
+           queued are served by whichever network is current when their batch
+           is dispatched.
+
+           synapse : path to a trained ClassifierNetwork
+        '''
+        with self._swapLock :
+            network = self._loadNetwork(synapse)
+            if tuple(network.getNetworkInputSize()[1:]) != \
+               tuple(self._network.getNetworkInputSize()[1:]) :
+                raise ValueError('The new network has a different input ' +
+                                 'size than the network being served.')
+            self._network, self._synapse = network, synapse
+        if self._log is not None :
+            self._log.info('Now serving [' + synapse + ']')
+
+    def getStats (self) :
+        '''Return the request counts and latency statistics.'''
+        with self._statsLock :
+            latencies = np.array(self._latencies)
+            stats = {'synapse' : self._synapse,
+                     'requests' : self._numRequests,
+                     'chips' : self._numChips,
+                     'batches' : self._numBatches,
+                     'meanBatchSize' : float(self._numChips) /
+                                       max(self._numBatches, 1),
+                     'queued' : self._requests.qsize()}
+        if len(latencies) > 0 :
+            stats['latency'] = {
+                'mean' : float(latencies.mean()),
+                'p50' : float(np.percentile(latencies, 50)),
+                'p99' : float(np.percentile(latencies, 99))}
+        return stats
+
+    def _handleConnection (self, sock) :
+        '''Serve messages from one client until it disconnects.'''
+        while True :
+            message = recvMessage(sock)
+            if message is None :
+                return
+            header, inputs = message
+            command = header.get('command', 'classify')
+            try :
+                if command == 'classify' :
+                    response = self._classify(header, inputs)
+                elif command == 'swap' :
+                    self.swap(header['synapse'])
+                    response = {'synapse' : header['synapse']}
+                elif command == 'stats' :
+                    response = self.getStats()
+                else :
+                    response = {'error' : 'Unknown command [' +
+                                          str(command) + ']'}
+            except Exception as e :
+                response = {'error' : str(e)}
+            sendMessage(sock, response)
+
+    def serveForever (self) :
+        '''Start the batcher and serve requests until shutdown() is called.'''
+        self._running = True
+        batcher = threading.Thread(target=self._runBatcher)
+        batcher.daemon = True
+        batcher.start()
+        if self._log is not None :
+            self._log.info('Serving on [' +
+                           str(self._server.server_address) + ']')
+        try :
+            self._server.serve_forever()
+        finally :
+            # no request may be queued once the batcher stops
+            with self._submitLock :
+                self._running = False
+            batcher.join()
+            self._failPending('The server was shut down.')
+            self._server.server_close()
+
+    def shutdown (self) :
+        '''Stop serving. This must be called from another thread.'''
+        self._server.shutdown()
+
+class InferenceClient () :
+    '''Connect to a running InferenceServer.
+
+       address : path of a Unix socket, or a (host, port) tuple for TCP
+    '''
+    def __init__ (self, address) :
+        family = socket.AF_INET if isinstance(address, tuple) else \
+                 socket.AF_UNIX
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(address)
+
+    def _request (self, header, array=None) :
+        sendMessage(self._sock, header, array)
+        message = recvMessage(self._sock)
+        if message is None :
+            raise IOError('The server closed the connection.')
+        response = message[0]
+        if 'error' in response :
+            raise ValueError(response['error'])
+        return response
+
+    def classify (self, inputs, topK=1) :
+        '''Classify a single chip or a batch of chips.
+
+           inputs : numpy.ndarray formatted (batchSize, numChannels, rows,
+                    cols) or (numChannels, rows, cols)
+           topK   : number of softmax entries to return per chip
+           return : dictionary of 'classIndex', 'topK' and 'latency'
+        '''
+        return self._request({'command' : 'classify', 'topK' : topK}, inputs)
+
+    def swap (self, synapse) :
+        '''Ask the server to serve a newer synapse file.'''
+        return self._request({'command' : 'swap', 'synapse' : synapse})
+
+    def getStats (self) :
+        '''Return the server request counts and latency statistics.'''
+        return self._request({'command' : 'stats'})
+
+    def close (self) :
+        self._sock.close()
+
+
+if __name__ == '__main__' :
+    import argparse
+    from nn.profiler import setupLogging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', dest='logfile', type=str, default=None,
+                        help='Specify log output file.')
+    parser.add_argument('--level', dest='level', default='INFO', type=str,
+                        help='Log Level.')
+    parser.add_argument('--socket', dest='socket', type=str, default=None,
+                        help='Path of the Unix socket to serve on.')
+    parser.add_argument('--host', dest='host', type=str, default='localhost',
+                        help='Host to serve on when using TCP.')
+    parser.add_argument('--port', dest='port', type=int, default=5555,
+                        help='Port to serve on when using TCP.')
+    parser.add_argument('--maxBatch', dest='maxBatch', type=int, default=64,
+                        help='Maximum number of chips per micro-batch.')
+    parser.add_argument('--maxWait', dest='maxWait', type=float, default=5.,
+                        help='Maximum milliseconds to wait for a batch.')
+    parser.add_argument('--syn', dest='synapse', type=str, required=True,
+                        help='Load from a previously saved network.')
+    options = parser.parse_args()
+
+    log = setupLogging('inferenceServer', options.level, options.logfile)
+    address = options.socket if options.socket is not None else \
+              (options.host, options.port)
+    InferenceServer(options.synapse, address, options.maxBatch,
+                    options.maxWait / 1000., log).serveForever()
@@ -1,4 +1,5 @@
 from theano.tensor.shared_randomstreams import RandomStreams
+from theano.tensor import tanh
 from time import time
 
 class Layer () :
@@ -31,6 +32,49 @@ class Layer () :
     def getLearningRate(self) :
         return self._learningRate
 
+    def getDropout(self) :
+        return self._dropout
+
+    def getPruneMask(self) :
+        '''The mask of weights retained by pruning. This is a theano.shared
+           buffer sized as getWeights()[0], or None if the layer is unpruned.
+        '''
+        return self.__dict__.get('_pruneMask', None)
+
+    def setPruneMask(self, mask) :
+        '''Set the mask of weights retained by pruning. The pruned weights are
+           zeroed immediately, and TrainerNetwork re-applies the mask after
+           every update so they remain zero.
+           NOTE: The mask must exist before the TrainerNetwork is finalized
+                 for training to honor it.
+
+           mask : numpy.ndarray sized as getWeights()[0]
+        '''
+        from theano import shared, config
+        import numpy as np
+        mask = np.asarray(mask, dtype=config.floatX)
+        if self.getPruneMask() is None :
+            self._pruneMask = shared(value=mask, borrow=True)
+        else :
+            self.getPruneMask().set_value(mask, borrow=True)
+        weights = self.getWeights()[0]
+        weights.set_value(weights.get_value(borrow=True) * mask, borrow=True)
+
+    def getActivation(self) :
+        '''The activation applied to the layer output. None is linear.
+           NOTE: Layers pickled before this was recorded report the
+                 default activation of tanh.
+        '''
+        return self.__dict__.get('_activation', tanh)
+
+    def getCost (self) :
+        '''Estimate the cost of the layer for a single input from its sizes.
+           See nn/costModel.py.
+
+           return : dictionary of 'flops', 'params' and 'activationBytes'
+        '''
+        raise NotImplementedError('Implement the getCost() method')
+
     def getInputSize (self) :
         raise NotImplementedError('Implement the getInputSize() method')
 
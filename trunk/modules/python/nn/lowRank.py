@@ -0,0 +1,224 @@
+import numpy as np
+from timeit import default_timer as timer
+
+def selectRank(singularValues, rank=None, energy=None) :
+    '''Choose the rank of a factorization. Either the rank is given, or the
+       smallest rank retaining the fraction of energy (sum of the squared
+       singular values) is used.
+
+       singularValues : singular values in descending order
+       rank           : explicit rank
+       energy         : fraction of the energy to retain (0, 1]
+       return         : the selected rank
+    '''
+    if (rank is None) == (energy is None) :
+        raise ValueError('Specify exactly one of rank or energy.')
+    if rank is not None :
+        return int(min(max(rank, 1), len(singularValues)))
+    cumulative = np.cumsum(singularValues ** 2)
+    return int(min(np.searchsorted(cumulative, energy * cumulative[-1]) + 1,
+                   len(singularValues)))
+
+def factorizeWeights(weights, rank=None, energy=None) :
+    '''Factor a weight matrix into two thin matrices with a truncated SVD.
+       The singular values are split evenly between the factors so both
+       have a similar scale for further training.
+
+       weights : numpy.ndarray (numInputs, numNeurons)
+       rank    : explicit rank
+       energy  : fraction of the energy to retain
+       return  : (numpy.ndarray (numInputs, rank),
+                  numpy.ndarray (rank, numNeurons),
+                  fraction of the energy retained)
+    '''
+    u, s, vt = np.linalg.svd(weights, full_matrices=False)
+    rank = selectRank(s, rank, energy)
+    root = np.sqrt(s[:rank])
+    retained = float(np.sum(s[:rank] ** 2) / np.sum(s ** 2))
+    return (np.asarray(u[:, :rank] * root, dtype=weights.dtype),
+            np.asarray(root[:, np.newaxis] * vt[:rank], dtype=weights.dtype),
+            retained)
+
+def timeFactorization(weights, first, second, batchSize=256, repeat=10) :
+    '''Measure the speedup of the factorized matrix multiply over the dense
+       matrix multiply on a batch of random inputs.
+
+       return : dense time / factorized time
+    '''
+    inputs = np.random.RandomState(0).rand(
+        batchSize, weights.shape[0]).astype(weights.dtype)
+    def best(func) :
+        times = []
+        for ii in range(repeat) :
+            start = timer()
+            func()
+            times.append(timer() - start)
+        return min(times)
+    return best(lambda : np.dot(inputs, weights)) / \
+           best(lambda : np.dot(np.dot(inputs, first), second))
+
+def factorizeNetwork(network, factors, train, test, log=None) :
+    '''Replace ContiguousLayers of a trained network with a rank-limited
+       linear layer followed by the original layer's neurons. The product of
+       the two weight matrices approximates the original, while the number of
+       multiplies drops from (inputs * neurons) to (rank * (inputs + neurons)).
+
+       The network is rebuilt layer by layer from the trained weights, so
+       the result can be fine-tuned like any other TrainerNetwork. Pretrained
+       autoencoder layers are rebuilt as plain layers from their encoding
+       weights and hidden thresholds.
+
+       network : trained ClassifierNetwork of ConvolutionalLayers followed
+                 by ContiguousLayers, or their autoencoder subclasses
+       factors : dictionary of layerID to a dictionary of either {'rank' : r}
+                 or {'energy' : e}
+       train   : training set formatted for TrainerNetwork
+       test    : test set formatted for TrainerNetwork
+       log     : Logger to use
+       return  : (TrainerNetwork, dictionary of layerID to the report
+                  of 'rank', 'energy', 'params', 'factorParams', 'speedup')
+    '''
+    import theano.tensor as t
+    from theano import config
+    from nn.net import TrainerNetwork
+    from nn.convolutionalLayer import ConvolutionalLayer
+    from nn.contiguousLayer import ContiguousLayer
+
+    newNetwork = TrainerNetwork(
+        train, test, network.getNetworkLabels(),
+        regType=getattr(network, '_regularization', 'L2'),
+        regScaleFactor=getattr(network, '_regScaleFactor', 0.), log=log)
+
+    report = {}
+    for ii, layer in enumerate(network._layers) :
+        weights, thresholds = [x.get_value() for x in layer.getWeights()[:2]]
+        if ii == 0 :
+            input = t.tensor4('input', dtype=config.floatX) \
+                    if isinstance(layer, ConvolutionalLayer) else \
+                    t.matrix('input', dtype=config.floatX)
+            inputSize = layer.getInputSize()
+        else :
+            input = newNetwork.getNetworkOutput()
+            inputSize = newNetwork.getNetworkOutputSize()
+
+        if isinstance(layer, ConvolutionalLayer) :
+            newNetwork.addLayer(ConvolutionalLayer(
+                layerID=layer.layerID, input=input, inputSize=inputSize,
+                kernelSize=layer.getKernelSize(),
+                downsampleFactor=layer.getDownsampleFactor(),
+                learningRate=layer.getLearningRate(),
+                momentumRate=layer.getMomentumRate(),
+                dropout=layer.getDropout(), initialWeights=weights,
+                initialThresholds=thresholds,
+                activation=layer.getActivation()))
+            continue
+        if not isinstance(layer, ContiguousLayer) :
+            raise ValueError('Unsupported layer type [' +
+                             layer.__class__.__name__ + '] in layer [' +
+                             str(layer.layerID) + ']')
+
+        # the contiguous layer flattens its input
+        numInputs = weights.shape[0]
+        if layer.layerID in factors :
+            first, second, energy = factorizeWeights(
+                weights, **factors[layer.layerID])
+            rank = first.shape[1]
+            report[layer.layerID] = {
+                'rank' : rank, 'energy' : energy,
+                'params' : weights.size,
+                'factorParams' : first.size + second.size,
+                'speedup' : timeFactorization(weights, first, second)}
+            weights = second
+            if log is not None :
+                log.info('Factorized [' + str(layer.layerID) + '] to rank [' +
+                         str(rank) + '] retaining [' + str(energy) +
+                         '] of the energy')
+
+            # the linear projection has no thresholds, dropout or activation
+            newNetwork.addLayer(ContiguousLayer(
+                layerID=str(layer.layerID) + '_lowRank', input=input,
+                inputSize=(inputSize[0], numInputs), numNeurons=rank,
+                learningRate=layer.getLearningRate(),
+                momentumRate=layer.getMomentumRate(),
+                initialWeights=first,
+                initialThresholds=np.zeros((rank,), dtype=first.dtype),
+                activation=None))
+            input = newNetwork.getNetworkOutput()
+            inputSize = newNetwork.getNetworkOutputSize()
+            numInputs = rank
+
+        newNetwork.addLayer(ContiguousLayer(
+            layerID=layer.layerID, input=input,
+            inputSize=(inputSize[0], numInputs),
+            numNeurons=weights.shape[1],
+            learningRate=layer.getLearningRate(),
+            momentumRate=layer.getMomentumRate(),
+            dropout=layer.getDropout(), initialWeights=weights,
+            initialThresholds=thresholds, activation=layer.getActivation()))
+
+    return newNetwork, report
+
+
+if __name__ == '__main__' :
+    import argparse
+    from nn.net import TrainerNetwork
+    from dataset.ingest.labeled import ingestImagery
+    from dataset.shared import splitToShared
+    from nn.profiler import setupLogging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', dest='logfile', type=str, default=None,
+                        help='Specify log output file.')
+    parser.add_argument('--level', dest='level', default='INFO', type=str,
+                        help='Log Level.')
+    parser.add_argument('--layer', dest='layers', type=str, nargs='+',
+                        required=True, help='layerIDs to factorize.')
+    parser.add_argument('--rank', dest='rank', type=int, default=None,
+                        help='Rank of each factorization.')
+    parser.add_argument('--energy', dest='energy', type=float, default=None,
+                        help='Fraction of the energy each factorization ' +
+                             'retains. This selects the rank per layer.')
+    parser.add_argument('--epoch', dest='numEpochs', type=int, default=2,
+                        help='Number of epochs to fine-tune.')
+    parser.add_argument('--syn', dest='synapse', type=str, required=True,
+                        help='Load from a previously saved network.')
+    parser.add_argument('--out', dest='outFile', type=str, required=True,
+                        help='Path of the factorized network (pkl.gz).')
+    parser.add_argument('data', help='Directory or pkl.gz file for the ' +
+                                     'training and test sets')
+    options = parser.parse_args()
+
+    log = setupLogging('lowRank: ' + options.data, options.level,
+                       options.logfile)
+    train, test, labels = ingestImagery(filepath=options.data, shared=False,
+                                        log=log)
+    test = splitToShared(test, borrow=True)
+
+    original = TrainerNetwork(train, test, labels, filepath=options.synapse,
+                              log=log)
+    originalAccuracy = original.checkAccuracy()
+
+    # factorize each layer alone to find its individual accuracy change
+    factor = {'rank' : options.rank} if options.rank is not None else \
+             {'energy' : options.energy}
+    for layerID in options.layers :
+        network, report = factorizeNetwork(original, {layerID : factor},
+                                           train, test)
+        r = report[layerID]
+        log.info('Layer [' + layerID + '] rank [' + str(r['rank']) +
+                 '] energy [' + str(r['energy']) + '] params [' +
+                 str(r['params']) + ' -> ' + str(r['factorParams']) +
+                 '] speedup [' + str(r['speedup']) + 'x] accuracy change [' +
+                 str(network.checkAccuracy() - originalAccuracy) + '%]')
+
+    # factorize all layers together and fine-tune
+    network, report = factorizeNetwork(
+        original, dict((layerID, factor) for layerID in options.layers),
+        train, test, log)
+    factorizedAccuracy = network.checkAccuracy()
+    network.trainEpoch(0, options.numEpochs)
+    fineTunedAccuracy = network.checkAccuracy()
+    network.save(options.outFile)
+    log.info('Accuracy original [' + str(originalAccuracy) +
+             '%] factorized [' + str(factorizedAccuracy) +
+             '%] fine-tuned [' + str(fineTunedAccuracy) + '%]')
@@ -0,0 +1,325 @@
+import json
+import os
+import numpy as np
+from timeit import default_timer as timer
+
+def exactSearch(vectors, queries, k, batchSize=1024) :
+    '''Find the exact top k vectors by dot product.
+
+       vectors   : numpy.ndarray(float32) (numVectors, dimension)
+       queries   : numpy.ndarray(float32) (numQueries, dimension)
+       k         : number of neighbors
+       batchSize : number of queries scored per matrix multiply
+       return    : numpy.ndarray of the neighbor ids (numQueries, k) in
+                   descending score
+    '''
+    k = min(k, len(vectors))
+    out = np.empty((len(queries), k), dtype='int64')
+    for start in range(0, len(queries), batchSize) :
+        scores = np.dot(queries[start:start + batchSize], vectors.T)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(top))[:, np.newaxis]
+        out[start:start + len(top)] = \
+            top[rows, np.argsort(-scores[rows, top], axis=1)]
+    return out
+
+class LSHIndex () :
+    '''The LSHIndex finds approximate nearest neighbors of embedding vectors,
+       such as the encodings of a StackedAENetwork or the softmax of a
+       ClassifierNetwork, with multi-table random-projection locality
+       sensitive hashing.
+
+       Each table hashes a vector to the signs of its projection onto
+       numBits random directions, so vectors at a small angle share a bucket
+       with high probability. The codes of every table are sorted, so a
+       bucket is found by binary search. Inserted codes are appended and the
+       tables are sorted once before the next query, so incremental inserts
+       stay cheap. A query also probes the buckets
+       reached by flipping its least certain bits, then the candidates from
+       all tables are ranked exactly by dot product.
+
+       Embeddings such as softmax outputs lie in a narrow cone, so the
+       vectors are centered on the mean of the first inserted batch before
+       hashing. This spreads them across the buckets.
+
+       dimension : length of the embedding vectors
+       numTables : number of hash tables. More tables increase recall and
+                   memory.
+       numBits   : bits per hash code (at most 64). More bits shrink the
+                   buckets, which increases speed and reduces recall.
+       seed      : seed of the random projections
+    '''
+    def __init__ (self, dimension, numTables=8, numBits=16, seed=0) :
+        if not 0 < numBits <= 64 :
+            raise ValueError('numBits must be within [1, 64]')
+        self._dimension = dimension
+        self._numTables = numTables
+        self._numBits = numBits
+        self._projections = np.random.RandomState(seed).randn(
+            dimension, numTables * numBits).astype('float32')
+        self._center = None
+        self._vectors = np.empty((0, dimension), dtype='float32')
+        self._size = 0
+        self._codes = [np.empty(0, dtype='uint64')
+                       for ii in range(numTables)]
+        self._order = [np.empty(0, dtype='int64')
+                       for ii in range(numTables)]
+        self._pendingCodes = []
+        self._pendingIDs = []
+
+    def __len__ (self) :
+        return self._size
+
+    def getVectors (self) :
+        '''The indexed vectors. The row is the id of each vector.'''
+        return self._vectors[:self._size]
+
+    def _project (self, vectors) :
+        '''Project onto the hyperplanes of every table.
+           return : numpy.ndarray (numVectors, numTables, numBits)
+        '''
+        return np.dot(vectors - self._center, self._projections).reshape(
+            len(vectors), self._numTables, self._numBits)
+
+    def _hash (self, projected) :
+        '''Pack the signs of the projections into a code for each table.'''
+        weights = np.left_shift(np.uint64(1),
+                                np.arange(self._numBits, dtype='uint64'))
+        return np.bitwise_or.reduce((projected > 0) * weights, axis=-1)
+
+    def _reserve (self, numVectors) :
+        '''Grow the vector storage geometrically. Memory-mapped vectors are
+           copied into memory on the first insert.
+        '''
+        required = self._size + numVectors
+        if required > len(self._vectors) or \
+           isinstance(self._vectors, np.memmap) :
+            capacity = max(required, 2 * len(self._vectors), 1024)
+            vectors = np.empty((capacity, self._dimension), dtype='float32')
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+
+    def add (self, vectors, batchSize=65536) :
+        '''Insert vectors into the index. The new codes are appended, and
+           merged into the sorted codes of each table before the next query,
+           so inserts may be incremental.
+
+           vectors   : numpy.ndarray (numVectors, dimension)
+           batchSize : number of vectors hashed at once
+           return    : numpy.ndarray of the ids assigned to the vectors
+        '''
+        vectors = np.asarray(vectors, dtype='float32')
+        if vectors.ndim != 2 or vectors.shape[1] != self._dimension :
+            raise ValueError('vectors must be sized (numVectors, ' +
+                             str(self._dimension) + ')')
+        if self._center is None :
+            self._center = vectors.mean(axis=0)
+        ids = np.arange(self._size, self._size + len(vectors), dtype='int64')
+        self._reserve(len(vectors))
+        self._vectors[self._size:self._size + len(vectors)] = vectors
+
+        codes = np.empty((len(vectors), self._numTables), dtype='uint64')
+        for start in range(0, len(vectors), batchSize) :
+            codes[start:start + batchSize] = self._hash(
+                self._project(vectors[start:start + batchSize]))
+
+        self._pendingCodes.append(codes)
+        self._pendingIDs.append(ids)
+        self._size += len(vectors)
+        return ids
+
+    def _sortTables (self) :
+        '''Merge the codes appended since the last query into the sorted
+           codes of each table with a single sort.
+        '''
+        if len(self._pendingCodes) == 0 :
+            return
+        codes = np.concatenate(self._pendingCodes)
+        ids = np.concatenate(self._pendingIDs)
+        for table in range(self._numTables) :
+            allCodes = np.concatenate((self._codes[table], codes[:, table]))
+            order = np.argsort(allCodes, kind='mergesort')
+            self._codes[table] = allCodes[order]
+            self._order[table] = np.concatenate(
+                (self._order[table], ids))[order]
+        self._pendingCodes, self._pendingIDs = [], []
+
+    def _candidates (self, projected, numProbes) :
+        '''Collect the ids in the probed buckets of every table.'''
+        self._sortTables()
+        candidates = []
+        for table in range(self._numTables) :
+            margins = projected[table]
+            code = self._hash(margins)
+            # flip the bits closest to their hyperplane
+            flips = np.argsort(np.abs(margins))[:numProbes]
+            probes = np.concatenate((
+                [code], code ^ np.left_shift(np.uint64(1),
+                                             flips.astype('uint64'))))
+            lo = np.searchsorted(self._codes[table], probes, side='left')
+            hi = np.searchsorted(self._codes[table], probes, side='right')
+            candidates.extend(self._order[table][l:h]
+                              for l, h in zip(lo, hi) if h > l)
+        if len(candidates) == 0 :
+            return np.empty(0, dtype='int64')
+        return np.unique(np.concatenate(candidates))
+
+    def query (self, queries, k=10, numProbes=0) :
+        '''Find the approximate top k vectors by dot product.
+
+           queries   : numpy.ndarray (numQueries, dimension) or a single
+                       vector
+           k         : number of neighbors
+           numProbes : number of extra buckets probed in each table
+           return    : (list of numpy.ndarray ids, list of numpy.ndarray
+                        scores) for each query in descending score. Fewer
+                        than k neighbors are returned when the probed buckets
+                        hold fewer vectors, and none when the index is empty.
+        '''
+        queries = np.asarray(queries, dtype='float32')
+        if queries.ndim == 1 :
+            queries = queries[np.newaxis]
+        if self._size == 0 :
+            return [np.empty(0, dtype='int64') for query in queries], \
+                   [np.empty(0, dtype='float32') for query in queries]
+        projected = self._project(queries)
+        vectors = self.getVectors()
+
+        ids, scores = [], []
+        for query, margins in zip(queries, projected) :
+            candidates = self._candidates(margins, numProbes)
+            candidateScores = np.dot(vectors[candidates], query)
+            top = min(k, len(candidates))
+            if top < len(candidates) :
+                best = np.argpartition(-candidateScores, top - 1)[:top]
+            else :
+                best = np.arange(top)
+            best = best[np.argsort(-candidateScores[best])]
+            ids.append(candidates[best])
+            scores.append(candidateScores[best])
+        return ids, scores
+
+    def save (self, directory) :
+        '''Write the index to a directory of .npy files so it can be loaded
+           with memory mapping.
+        '''
+        if not os.path.exists(directory) :
+            os.makedirs(directory)
+        self._sortTables()
+        np.save(os.path.join(directory, 'vectors.npy'), self.getVectors())
+        np.save(os.path.join(directory, 'projections.npy'), self._projections)
+        np.save(os.path.join(directory, 'center.npy'), self._center)
+        for table in range(self._numTables) :
+            np.save(os.path.join(directory, 'codes' + str(table) + '.npy'),
+                    self._codes[table])
+            np.save(os.path.join(directory, 'order' + str(table) + '.npy'),
+                    self._order[table])
+        with open(os.path.join(directory, 'index.json'), 'w') as f :
+            json.dump({'dimension' : self._dimension,
+                       'numTables' : self._numTables,
+                       'numBits' : self._numBits,
+                       'size' : self._size}, f)
+
+    @staticmethod
+    def load (directory, mmap=True) :
+        '''Load an index written by save().
+
+           directory : directory of the index
+           mmap      : memory-map the arrays rather than reading them. The
+                       vectors are copied into memory on the next insert.
+           return    : LSHIndex
+        '''
+        mode = 'r' if mmap else None
+        with open(os.path.join(directory, 'index.json'), 'r') as f :
+            meta = json.load(f)
+        index = LSHIndex.__new__(LSHIndex)
+        index._dimension = meta['dimension']
+        index._numTables = meta['numTables']
+        index._numBits = meta['numBits']
+        index._size = meta['size']
+        index._projections = np.load(
+            os.path.join(directory, 'projections.npy'))
+        index._center = np.load(os.path.join(directory, 'center.npy'))
+        index._vectors = np.load(os.path.join(directory, 'vectors.npy'),
+                                 mmap_mode=mode)
+        index._codes = [np.load(os.path.join(directory, 'codes' +
+                                             str(table) + '.npy'),
+                                mmap_mode=mode)
+                        for table in range(index._numTables)]
+        index._order = [np.load(os.path.join(directory, 'order' +
+                                             str(table) + '.npy'),
+                                mmap_mode=mode)
+                        for table in range(index._numTables)]
+        index._pendingCodes = []
+        index._pendingIDs = []
+        return index
+
+def benchmark(index, queries, k=10, probes=(0, 1, 2, 4, 8)) :
+    '''Measure the recall and latency of the index against exact search.
+
+       index   : LSHIndex to measure
+       queries : numpy.ndarray (numQueries, dimension)
+       k       : number of neighbors
+       probes  : numbers of extra buckets per table to measure
+       return  : list of dictionaries of 'numProbes', 'recall', 'latency' in
+                 seconds per query and the average number of 'candidates'
+                 ranked, followed by the 'exact' search latency
+    '''
+    queries = np.asarray(queries, dtype='float32')
+    start = timer()
+    exact = exactSearch(index.getVectors(), queries, k, batchSize=1)
+    exactLatency = (timer() - start) / len(queries)
+
+    report = []
+    for numProbes in probes :
+        start = timer()
+        ids, _ = index.query(queries, k, numProbes)
+        latency = (timer() - start) / len(queries)
+        found = sum(len(np.intersect1d(approx, truth))
+                    for approx, truth in zip(ids, exact))
+        candidates = np.mean([len(index._candidates(margins, numProbes))
+                              for margins in index._project(queries)])
+        report.append({'numProbes' : numProbes,
+                       'recall' : float(found) / exact.size,
+                       'latency' : latency, 'candidates' : candidates})
+    report.append({'exact' : exactLatency})
+    return report
+
+
+if __name__ == '__main__' :
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tables', dest='numTables', type=int, default=8,
+                        help='Number of hash tables.')
+    parser.add_argument('--bits', dest='numBits', type=int, default=16,
+                        help='Bits per hash code.')
+    parser.add_argument('--k', dest='k', type=int, default=10,
+                        help='Number of neighbors per query.')
+    parser.add_argument('--queries', dest='numQueries', type=int,
+                        default=200, help='Number of indexed vectors used ' +
+                        'as queries in the benchmark.')
+    parser.add_argument('--out', dest='outDir', type=str, default=None,
+                        help='Save the index to this directory.')
+    parser.add_argument('embeddings', help='.npy file of the embedding ' +
+                                           'vectors (numVectors, dimension).')
+    options = parser.parse_args()
+
+    vectors = np.load(options.embeddings, mmap_mode='r')
+    index = LSHIndex(vectors.shape[1], options.numTables, options.numBits)
+    start = timer()
+    index.add(vectors)
+    print('Indexed [' + str(len(index)) + '] vectors in [' +
+          str(timer() - start) + 's]')
+    if options.outDir is not None :
+        index.save(options.outDir)
+
+    queries = vectors[np.random.RandomState(0).choice(
+        len(vectors), min(options.numQueries, len(vectors)), replace=False)]
+    report = benchmark(index, queries, options.k)
+    for entry in report[:-1] :
+        print('Probes [' + str(entry['numProbes']) + '] recall@' +
+              str(options.k) + ' [' + str(entry['recall']) + '] latency [' +
+              str(entry['latency'] * 1000.) + 'ms] candidates [' +
+              str(entry['candidates']) + ']')
+    print('Exact latency [' + str(report[-1]['exact'] * 1000.) + 'ms]')
@@ -16,14 +16,57 @@ class Network () :
         dict = self.__dict__.copy()
         # remove the profiler as it is not robust to distributed processing
         dict['_profiler'] = None
+        # remove the functions -- they will be rebuilt JIT
+        if '_embedFunctions' in dict : del dict['_embedFunctions']
         return dict
     def __setstate__(self, dict) :
         '''Load network pickle'''
+        # force the embedding functions to be rebuilt with the new buffers
+        if hasattr(self, '_embedFunctions') :
+            delattr(self, '_embedFunctions')
         # use the current constructor-supplied profiler --
         # this ensures the profiler is setup for the current system
         tmp = self._profiler
         self.__dict__.update(dict)
         self._profiler = tmp
+        self._rebuildClassification()
+    def _rebuildClassification(self) :
+        '''Networks pickled before the classification path left the batch
+           size unspecified have their training batch size compiled into
+           each convolution, so they can only classify that many inputs per
+           call. Rebuild these convolutions from the stored weights, and
+           clone the remainder of each layer's classification path onto them,
+           so any batch size is accepted.
+        '''
+        from theano.gof.graph import io_toposort
+        from theano.tensor.nnet.conv import ConvOp, conv2d
+        if len(self._layers) == 0 :
+            return
+
+        # the convolutional layers are found by the weights they convolve
+        convLayers = dict((id(layer.getWeights()[0]), layer)
+                          for layer in self._layers
+                          if hasattr(layer, 'getKernelSize'))
+        replace = {}
+        for node in io_toposort([self.getNetworkInput()[0]],
+                                [self.getNetworkOutput()[0]]) :
+            if not isinstance(node.op, ConvOp) or node.op.bsize is None or \
+               id(node.inputs[1]) not in convLayers :
+                continue
+            layer = convLayers[id(node.inputs[1])]
+
+            # the input may itself depend on a rebuilt convolution
+            input = node.inputs[0] if len(replace) == 0 else \
+                    theano.clone(node.inputs[0], replace=replace)
+            replace[node.outputs[0]] = conv2d(
+                input, node.inputs[1],
+                (None,) + tuple(layer.getInputSize()[1:]),
+                layer.getKernelSize())
+
+        if len(replace) > 0 :
+            for layer in self._layers :
+                layer.output = (theano.clone(layer.output[0], replace=replace),
+                                layer.output[1])
     def _startProfile(self, message, level) :
         if self._profiler is not None :
             self._profiler.startProfile(message, level)
@@ -78,6 +121,77 @@ class Network () :
             raise IndexError('Network must have at least one layer' +
                              'to call getNetworkOutputSize().')
         return self._layers[-1].getOutputSize()
+    def getCostReport(self, batchSize=None, dominance=.5) :
+        '''Estimate the compute and memory of the network from the layer
+           sizes. See nn/costModel.py.
+
+           batchSize : number of inputs per network call
+                       None uses the batch size the network was built with
+           dominance : fraction of the network total at which a layer is
+                       flagged as dominating a cost
+           return    : report dictionary of costModel.createCostReport()
+        '''
+        from nn.costModel import createCostReport
+        if batchSize is None :
+            batchSize = self.getNetworkInputSize()[0]
+        return createCostReport(
+            [(layer.layerID, layer.getCost()) for layer in self._layers],
+            batchSize, dominance, np.dtype(theano.config.floatX).itemsize)
+    def _getEmbedFunction(self, layerIndex) :
+        '''Compile the function returning the flattened classification
+           output of the layer. The functions are cached per layer.
+        '''
+        if not hasattr(self, '_embedFunctions') :
+            self._embedFunctions = {}
+        if layerIndex not in self._embedFunctions :
+            self._embedFunctions[layerIndex] = theano.function(
+                [theano.In(self.getNetworkInput()[0], borrow=True)],
+                theano.Out(self._layers[layerIndex].output[0].flatten(2),
+                           borrow=True))
+        return self._embedFunctions[layerIndex]
+    def extractEmbeddings(self, inputs, layerIndex=-1, batchSize=256,
+                          outputFile=None) :
+        '''Encode the inputs with the output of any layer. No softmax is
+           applied, so any network type, including a StackedAENetwork, can
+           be used directly.
+
+           The inputs are encoded in batches, and the results may be written
+           to a memory-mapped .npy file, so embeddings for millions of chips
+           never need to fit in memory. The inputs may be memory-mapped too.
+
+           inputs     : numpy.ndarray of inputs formatted for the first layer
+                        (numInputs, ...)
+           layerIndex : index of the layer to use. Negative values count
+                        from the last layer.
+           batchSize  : maximum number of inputs encoded per call
+           outputFile : .npy file to write. None returns an in-memory array.
+           return     : numpy.ndarray(float32) (numInputs, embeddingSize)
+        '''
+        if len(self._layers) == 0 :
+            raise IndexError('Network must have at least one layer' +
+                             'to call extractEmbeddings().')
+        layerIndex = range(len(self._layers))[layerIndex]
+        self._startProfile('Extracting embeddings of layer [' +
+                           str(self._layers[layerIndex].layerID) + ']',
+                           'info')
+        embed = self._getEmbedFunction(layerIndex)
+        shape = (len(inputs), int(np.prod(
+            self._layers[layerIndex].getOutputSize()[1:])))
+        if outputFile is not None :
+            out = np.lib.format.open_memmap(outputFile, mode='w+',
+                                            dtype='float32', shape=shape)
+        else :
+            out = np.empty(shape, dtype='float32')
+
+        dtype = self.getNetworkInput()[0].dtype
+        for start in range(0, len(inputs), batchSize) :
+            out[start:start + batchSize] = embed(
+                np.asarray(inputs[start:start + batchSize], dtype=dtype))
+
+        if outputFile is not None :
+            out.flush()
+        self._endProfile()
+        return out
 
 class ClassifierNetwork (Network) :
     '''The ClassifierNetwork object allows the user to build multi-layer neural
@@ -104,6 +218,7 @@ class ClassifierNetwork (Network) :
         if '_outClassMax' in dict : del dict['_outClassMax']
         if '_classify' in dict : del dict['_classify']
         if '_classifyAndSoftmax' in dict : del dict['_classifyAndSoftmax']
+        if '_infer' in dict : del dict['_infer']
         return dict
     def __setstate__(self, dict) :
         '''Load network pickle'''
@@ -119,6 +234,8 @@ class ClassifierNetwork (Network) :
             delattr(self, '_classify')
         if hasattr(self, '_classifyAndSoftmax') : 
             delattr(self, '_classifyAndSoftmax')
+        if hasattr(self, '_infer') :
+            delattr(self, '_infer')
         Network.__setstate__(self, dict)
 
     def getNetworkLabels(self) :
@@ -205,6 +322,39 @@ class ClassifierNetwork (Network) :
         self._endProfile()
         return classIndex, softmax
 
+    def _finalizeInference (self) :
+        '''Compile the low-latency inference function. The input is borrowed
+           rather than copied, and the outputs are returned in the buffers
+           theano allocated on the previous call rather than new arrays.
+        '''
+        if len(self._layers) == 0 :
+            raise IndexError('Network must have at least one layer' +
+                             'to call infer().')
+        softmax = t.nnet.softmax(self.getNetworkOutput()[0])
+        self._infer = theano.function(
+            [theano.In(self.getNetworkInput()[0], borrow=True)],
+            [theano.Out(t.argmax(softmax, axis=1), borrow=True),
+             theano.Out(softmax, borrow=True)])
+
+    def infer (self, inputs) :
+        '''Classify the given inputs on the low-latency path. Unlike
+           classifyAndSoftmax() this accepts any batch size, including a
+           single chip formatted (numChannels, rows, cols), and performs no
+           profiling.
+
+           NOTE: The returned buffers are reused by the next call. Copy the
+                 results if they must outlive it.
+
+           inputs : numpy.ndarray formatted (batchSize, numChannels, rows,
+                    cols) or (numChannels, rows, cols)
+           return : (classification index, softmax vector)
+        '''
+        if not hasattr(self, '_infer') :
+            self._finalizeInference()
+        if inputs.ndim == 3 :
+            inputs = inputs[np.newaxis]
+        return self._infer(inputs)
+
 class TrainerNetwork (ClassifierNetwork) :
     '''This network allows for training data on a theano.shared wrapped
        dataset for optimal execution. Because the dataset will be accessed 
@@ -403,6 +553,7 @@ class TrainerNetwork (ClassifierNetwork) :
                                disconnected_inputs='warn')
 
             # add the weight update
+            pruneMask = layer.getPruneMask()
             for w, g in zip(layerWeights, gradients) :
 
                 if layerMomentumRate > 0. :
@@ -413,12 +564,17 @@ class TrainerNetwork (ClassifierNetwork) :
 
                     # add two updates --
                     # perform weight update and save the previous update
-                    updates.append((w, w + previousWeightUpdate))
+                    newWeight = w + previousWeightUpdate
                     updates.append((previousWeightUpdate,
                                     previousWeightUpdate * layerMomentumRate -
                                     layerLearningRate * g))
                 else :
-                    updates.append((w, w - layerLearningRate * g))
+                    newWeight = w - layerLearningRate * g
+
+                # pruned weights are masked after each update to remain zero
+                if pruneMask is not None and w is layerWeights[0] :
+                    newWeight = newWeight * pruneMask
+                updates.append((w, newWeight))
 
 
         # NOTE: the 'input' variable name was create elsewhere and provided as
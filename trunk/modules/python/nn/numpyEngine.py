@@ -0,0 +1,313 @@
+import json
+import numpy as np
+
+# This module must remain importable without theano, so it can be deployed
+# to machines which only classify. Only exportNetwork() requires theano.
+
+def _sigmoid(x) :
+    return 1. / (1. + np.exp(-x))
+
+_activations = {'tanh' : np.tanh, 'sigmoid' : _sigmoid, 'linear' : None}
+
+def _getActivationName(activation) :
+    '''Find the name of a theano activation function for export.'''
+    from theano.tensor import tanh
+    from theano.tensor.nnet import sigmoid
+    if activation is None :
+        return 'linear'
+    if activation == tanh :
+        return 'tanh'
+    if activation == sigmoid :
+        return 'sigmoid'
+    raise ValueError('Unsupported activation [' + str(activation) + ']')
+
+def _toCSR(matrix) :
+    '''Compress a dense matrix into the (data, indices, indptr) arrays of the
+       compressed sparse row format.
+    '''
+    rows, cols = np.nonzero(matrix)
+    indptr = np.zeros(matrix.shape[0] + 1, dtype='int32')
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=matrix.shape[0]))
+    return matrix[rows, cols], cols.astype('int32'), indptr
+
+def _fromCSR(data, indices, indptr, shape) :
+    '''Create the matrix for a sparse GEMM from the compressed sparse row
+       arrays. scipy is optional -- without it the matrix is expanded to a
+       dense numpy.ndarray.
+    '''
+    try :
+        from scipy.sparse import csr_matrix
+        return csr_matrix((data, indices, indptr), shape=shape)
+    except ImportError :
+        dense = np.zeros(shape, dtype=data.dtype)
+        dense[np.repeat(np.arange(shape[0]), np.diff(indptr)), indices] = data
+        return dense
+
+def exportNetwork(network, filepath, sparseThreshold=.5, log=None) :
+    '''Export a trained network to a weights file for the NumpyNetwork. The
+       file is a .npz archive of float32 weights and a JSON description of
+       the layers.
+
+       Theano performs a true convolution, so the kernels are flipped here
+       and the engine performs a correlation.
+
+       SeparableConvolutionalLayers store their depthwise kernels alongside
+       the pointwise weights. Both theano and the engine correlate with
+       these kernels, so they are not flipped.
+
+       ContiguousLayers with enough zero weights, such as those pruned with
+       nn.prune.MagnitudePruner, are stored in compressed sparse row form.
+
+       network         : trained ClassifierNetwork of ConvolutionalLayers
+                         followed by ContiguousLayers
+       filepath        : output file -- this should use the .npz extension
+       sparseThreshold : fraction of zero weights at which a ContiguousLayer
+                         is stored as a sparse matrix. None stores all
+                         layers densely.
+       log             : Logger to use
+    '''
+    from nn.convolutionalLayer import ConvolutionalLayer
+    from nn.separableLayer import SeparableConvolutionalLayer
+    from nn.contiguousLayer import ContiguousLayer
+    if log is not None :
+        log.info('Exporting the network to [' + filepath + ']')
+
+    spec = {'inputSize' : list(network.getNetworkInputSize()[1:]),
+            'labels' : [str(label) for label in
+                        getattr(network, '_networkLabels', [])],
+            'layers' : []}
+    weights = {}
+    for ii, layer in enumerate(network._layers) :
+        w, b = [np.asarray(x.get_value(borrow=True), dtype='float32')
+                for x in layer.getWeights()[:2]]
+        layerSpec = {'layerID' : str(layer.layerID),
+                     'dropout' : layer.getDropout(),
+                     'activation' : _getActivationName(layer.getActivation())}
+        if isinstance(layer, ConvolutionalLayer) :
+            layerSpec['type'] = 'convolutional'
+            layerSpec['kernelSize'] = list(layer.getKernelSize())
+            layerSpec['downsampleFactor'] = \
+                list(layer.getDownsampleFactor())
+            w = w[:, :, ::-1, ::-1]
+        elif isinstance(layer, SeparableConvolutionalLayer) :
+            layerSpec['type'] = 'separable'
+            layerSpec['kernelSize'] = list(layer.getKernelSize())
+            layerSpec['downsampleFactor'] = \
+                list(layer.getDownsampleFactor())
+            weights['depthWeights' + str(ii)] = np.asarray(
+                layer.getDepthWeights().get_value(borrow=True),
+                dtype='float32')
+        elif isinstance(layer, ContiguousLayer) :
+            layerSpec['type'] = 'contiguous'
+        else :
+            raise ValueError('Unsupported layer type [' +
+                             layer.__class__.__name__ + '] in layer [' +
+                             str(layer.layerID) + ']')
+
+        # the sparse layers store the transpose, so each row is a neuron
+        if layerSpec['type'] == 'contiguous' and \
+           sparseThreshold is not None and \
+           1. - float(np.count_nonzero(w)) / w.size >= sparseThreshold :
+            layerSpec['sparse'] = True
+            layerSpec['shape'] = [w.shape[1], w.shape[0]]
+            weights['data' + str(ii)], weights['indices' + str(ii)], \
+                weights['indptr' + str(ii)] = _toCSR(w.T)
+        else :
+            weights['weights' + str(ii)] = np.ascontiguousarray(w)
+        weights['thresholds' + str(ii)] = b
+        spec['layers'].append(layerSpec)
+
+    np.savez(filepath, spec=np.array(json.dumps(spec)), **weights)
+
+def im2col(inputs, kernelShape) :
+    '''Unroll every (channels, rows, cols) window of the inputs into a row.
+
+       inputs      : numpy.ndarray (batchSize, channels, rows, cols)
+       kernelShape : (rows, cols) of each window
+       return      : numpy.ndarray (batchSize, outRows, outCols,
+                                    channels * kernelRows * kernelCols)
+    '''
+    from numpy.lib.stride_tricks import as_strided
+    batchSize, channels, rows, cols = inputs.shape
+    outRows = rows - kernelShape[0] + 1
+    outCols = cols - kernelShape[1] + 1
+    s = inputs.strides
+    windows = as_strided(inputs,
+                         shape=(batchSize, outRows, outCols,
+                                channels, kernelShape[0], kernelShape[1]),
+                         strides=(s[0], s[2], s[3], s[1], s[2], s[3]))
+    return windows.reshape(batchSize, outRows, outCols, -1)
+
+def convolve(inputs, kernel) :
+    '''Correlate the inputs with the kernel as a single GEMM.
+
+       inputs : numpy.ndarray (batchSize, channels, rows, cols)
+       kernel : numpy.ndarray (numKernels, channels, kernelRows, kernelCols)
+       return : numpy.ndarray (batchSize, numKernels, outRows, outCols)
+    '''
+    cols = im2col(inputs, kernel.shape[2:])
+    out = np.dot(cols, kernel.reshape(kernel.shape[0], -1).T)
+    return out.transpose(0, 3, 1, 2)
+
+def depthwiseCorrelate(inputs, kernel) :
+    '''Correlate each channel of the inputs with its own kernel.
+
+       inputs : numpy.ndarray (batchSize, channels, rows, cols)
+       kernel : numpy.ndarray (channels, kernelRows, kernelCols)
+       return : numpy.ndarray (batchSize, channels, outRows, outCols)
+    '''
+    kernelRows, kernelCols = kernel.shape[1:]
+    outRows = inputs.shape[2] - kernelRows + 1
+    outCols = inputs.shape[3] - kernelCols + 1
+    out = np.zeros(inputs.shape[:2] + (outRows, outCols), dtype=inputs.dtype)
+    for u in range(kernelRows) :
+        for v in range(kernelCols) :
+            out += inputs[:, :, u:u + outRows, v:v + outCols] * \
+                   kernel[np.newaxis, :, u, v, np.newaxis, np.newaxis]
+    return out
+
+def pointwiseCombine(inputs, weights) :
+    '''Combine the channels at each pixel as a single GEMM.
+
+       inputs  : numpy.ndarray (batchSize, channels, rows, cols)
+       weights : numpy.ndarray (numKernels, channels)
+       return  : numpy.ndarray (batchSize, numKernels, rows, cols)
+    '''
+    return np.tensordot(inputs, weights, axes=([1], [1])).transpose(0, 3, 1, 2)
+
+def maxPool(inputs, downsampleFactor) :
+    '''Non-overlapping max pooling which ignores the border.
+
+       inputs           : numpy.ndarray (batchSize, channels, rows, cols)
+       downsampleFactor : (rowFactor, colFactor)
+       return           : numpy.ndarray (batchSize, channels,
+                                         rows // rowFactor, cols // colFactor)
+    '''
+    rowFactor, colFactor = downsampleFactor
+    if rowFactor == 1 and colFactor == 1 :
+        return inputs
+    batchSize, channels, rows, cols = inputs.shape
+    rows, cols = rows // rowFactor, cols // colFactor
+    cropped = inputs[:, :, :rows * rowFactor, :cols * colFactor]
+    return cropped.reshape(batchSize, channels, rows, rowFactor,
+                           cols, colFactor).max(axis=(3, 5))
+
+def softmax(x) :
+    '''Row-wise softmax of a (batchSize, numNeurons) matrix.'''
+    e = np.exp(x - x.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+class NumpyNetwork () :
+    '''The NumpyNetwork classifies with the weights of a trained network
+       without theano. Convolutions are performed as im2col followed by a
+       single GEMM, so the engine relies on the BLAS numpy is linked against.
+
+       Sparse ContiguousLayers use a sparse GEMM when scipy is available.
+
+       The results match ClassifierNetwork.classifyAndSoftmax() within
+       float32 tolerance, and any batch size may be used.
+
+       filepath : weights file created by exportNetwork()
+    '''
+    def __init__ (self, filepath) :
+        with np.load(filepath) as archive :
+            self._spec = json.loads(str(archive['spec']))
+            self._weights = []
+            self._depthWeights = {}
+            for ii, layerSpec in enumerate(self._spec['layers']) :
+                if layerSpec.get('sparse', False) :
+                    weights = _fromCSR(archive['data' + str(ii)],
+                                       archive['indices' + str(ii)],
+                                       archive['indptr' + str(ii)],
+                                       tuple(layerSpec['shape']))
+                    # without scipy the dense transpose is used instead
+                    if isinstance(weights, np.ndarray) :
+                        weights = weights.T
+                else :
+                    weights = archive['weights' + str(ii)]
+                if layerSpec['type'] == 'separable' :
+                    self._depthWeights[ii] = archive['depthWeights' + str(ii)]
+                self._weights.append((weights,
+                                      archive['thresholds' + str(ii)]))
+
+    def getNetworkInputSize (self) :
+        '''Return the input size. The batch size is reported as one, though
+           any batch size is accepted. (1, channels, rows, cols)
+        '''
+        return (1,) + tuple(self._spec['inputSize'])
+
+    def getNetworkOutputSize (self) :
+        return (1, len(self._weights[-1][1]))
+
+    def getNetworkLabels (self) :
+        return self._spec['labels']
+
+    def _activateLayer (self, ii, inputs) :
+        '''Activate a single layer on the outputs of the previous layer.'''
+        layerSpec = self._spec['layers'][ii]
+        weights, thresholds = self._weights[ii]
+        if layerSpec['type'] == 'convolutional' :
+            out = maxPool(convolve(inputs, weights),
+                          layerSpec['downsampleFactor'])
+            out = out + thresholds[np.newaxis, :, np.newaxis, np.newaxis]
+        elif layerSpec['type'] == 'separable' :
+            out = pointwiseCombine(
+                depthwiseCorrelate(inputs, self._depthWeights[ii]), weights)
+            out = maxPool(out, layerSpec['downsampleFactor'])
+            out = out + thresholds[np.newaxis, :, np.newaxis, np.newaxis]
+        elif not isinstance(weights, np.ndarray) :
+            # sparse neurons (numNeurons, numInputs) applied to the inputs
+            out = np.asarray(weights.dot(
+                inputs.reshape(inputs.shape[0], -1).T).T) + thresholds
+        else :
+            out = np.dot(inputs.reshape(inputs.shape[0], -1), weights)
+            out += thresholds
+
+        # the classification path scales by the dropout retention rate
+        if layerSpec['dropout'] is not None :
+            out /= layerSpec['dropout']
+        activation = _activations[layerSpec['activation']]
+        return out if activation is None else activation(out)
+
+    def activate (self, inputs) :
+        '''Activate all layers and return the final layer output.
+
+           inputs : numpy.ndarray formatted (batchSize, numChannels, rows,
+                    cols) or (numChannels, rows, cols)
+        '''
+        out = np.asarray(inputs, dtype='float32')
+        if out.ndim == 3 :
+            out = out[np.newaxis]
+        for ii in range(len(self._weights)) :
+            out = self._activateLayer(ii, out)
+        return out
+
+    def classifyAndSoftmax (self, inputs) :
+        '''Classify the given inputs.
+
+           return : (classification index, softmax vector)
+        '''
+        softmaxOut = softmax(self.activate(inputs))
+        return np.argmax(softmaxOut, axis=1), softmaxOut
+
+    def classify (self, inputs) :
+        '''Classify the given inputs. The output is the index of the softmax
+           classification.
+        '''
+        return self.classifyAndSoftmax(inputs)[0]
+
+    # the engine has no compilation step, so both paths are the same
+    infer = classifyAndSoftmax
+
+
+if __name__ == '__main__' :
+    import argparse
+    from nn.net import ClassifierNetwork
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--syn', dest='synapse', type=str, required=True,
+                        help='Load from a previously saved network.')
+    parser.add_argument('outFile', help='Weights file to write (.npz).')
+    options = parser.parse_args()
+
+    exportNetwork(ClassifierNetwork(options.synapse), options.outFile)
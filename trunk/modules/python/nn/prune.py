@@ -0,0 +1,85 @@
+import numpy as np
+
+class MagnitudePruner () :
+    '''The MagnitudePruner performs iterative magnitude pruning on a set of
+       layers during training. At each pruning step the smallest weights are
+       masked until the layer reaches the scheduled sparsity. The sparsity
+       follows a cubic ramp from zero to the final sparsity, which prunes
+       quickly while the network is redundant and slowly as it approaches
+       the target --
+
+           s(t) = sFinal * (1 - (1 - (t - tStart) / (tEnd - tStart)) ** 3)
+
+       The masks are created immediately so TrainerNetwork compiles them into
+       its updates, and pruned weights remain zero between pruning steps.
+
+       network       : TrainerNetwork being trained
+       layerIDs      : list of layerIDs to prune
+       finalSparsity : fraction of weights removed at the end of the ramp
+       startEpoch    : epoch where pruning begins
+       endEpoch      : epoch where the final sparsity is reached
+       log           : Logger to use
+    '''
+    def __init__ (self, network, layerIDs, finalSparsity=.9, startEpoch=0,
+                  endEpoch=20, log=None) :
+        if not 0. <= finalSparsity < 1. :
+            raise ValueError('finalSparsity must be within [0, 1)')
+        if endEpoch <= startEpoch :
+            raise ValueError('endEpoch must be after startEpoch')
+        self._layers = [layer for layer in network._layers
+                        if layer.layerID in layerIDs]
+        if len(self._layers) != len(layerIDs) :
+            raise ValueError('Unable to find all layers in ' + str(layerIDs))
+        self._finalSparsity = finalSparsity
+        self._startEpoch = startEpoch
+        self._endEpoch = endEpoch
+        self._log = log
+
+        # create the masks before training is compiled. If the network was
+        # already finalized, remove the training functions so they are
+        # rebuilt with the masks.
+        for layer in self._layers :
+            if layer.getPruneMask() is None :
+                layer.setPruneMask(np.ones_like(
+                    layer.getWeights()[0].get_value(borrow=True)))
+        for name in ('_trainNetwork', '_trainNetworkNP') :
+            if hasattr(network, name) :
+                delattr(network, name)
+
+    def getTargetSparsity (self, epoch) :
+        '''The scheduled sparsity at the given epoch.'''
+        if epoch <= self._startEpoch :
+            return 0.
+        progress = min(float(epoch - self._startEpoch) /
+                       (self._endEpoch - self._startEpoch), 1.)
+        return self._finalSparsity * (1. - (1. - progress) ** 3)
+
+    def isComplete (self, epoch) :
+        '''Check if the final sparsity is reached at the given epoch.'''
+        return epoch >= self._endEpoch
+
+    def prune (self, epoch) :
+        '''Mask the smallest weights of each layer to reach the scheduled
+           sparsity. Previously pruned weights are zero, so they are always
+           among the smallest and remain pruned.
+
+           epoch  : current training epoch
+           return : the scheduled sparsity
+        '''
+        sparsity = self.getTargetSparsity(epoch)
+        for layer in self._layers :
+            weights = layer.getWeights()[0].get_value(borrow=True)
+            numPruned = int(sparsity * weights.size)
+            mask = np.ones(weights.size, dtype=weights.dtype)
+            if numPruned > 0 :
+                mask[np.argpartition(np.abs(weights).ravel(),
+                                     numPruned - 1)[:numPruned]] = 0.
+            layer.setPruneMask(mask.reshape(weights.shape))
+        if self._log is not None :
+            self._log.info('Pruned to [' + str(sparsity) + '] sparsity')
+        return sparsity
+
+def getSparsity(layer) :
+    '''The fraction of zero weights in the layer.'''
+    weights = layer.getWeights()[0].get_value(borrow=True)
+    return 1. - float(np.count_nonzero(weights)) / weights.size
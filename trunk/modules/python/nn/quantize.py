@@ -0,0 +1,248 @@
+import json
+import numpy as np
+from nn.numpyEngine import NumpyNetwork, im2col, maxPool, _activations
+
+def quantizeWeights(weights, channelAxis, perChannel=True) :
+    '''Symmetrically quantize weights to int8.
+
+       weights     : numpy.ndarray of float weights
+       channelAxis : axis of the output channels -- zero for convolutional
+                     kernels and one for contiguous weight matrices
+       perChannel  : use a scale for each output channel rather than a single
+                     scale for the layer
+       return      : (numpy.ndarray(int8) weights,
+                      numpy.ndarray(float32) scale per output channel)
+    '''
+    if perChannel :
+        axes = tuple(ii for ii in range(weights.ndim) if ii != channelAxis)
+        maximum = np.abs(weights).max(axis=axes)
+    else :
+        maximum = np.repeat(np.abs(weights).max(),
+                            weights.shape[channelAxis])
+    scale = np.where(maximum > 0., maximum / 127., 1.).astype('float32')
+    shape = [1] * weights.ndim
+    shape[channelAxis] = -1
+    quantized = np.clip(np.round(weights / scale.reshape(shape)), -127, 127)
+    return quantized.astype('int8'), scale
+
+def quantizeActivations(x, scale) :
+    '''Symmetrically quantize activations to int8 with the given scale.'''
+    return np.clip(np.round(x / scale), -127, 127).astype('int8')
+
+def gemmType(depth) :
+    '''The type gemmInt8() multiplies in for products of the given depth.
+
+       NOTE: NumPy has no int8 GEMM. When every dot product is exactly
+             representable in float32, (depth * 127 * 127 < 2**24), the
+             float32 BLAS computes the exact integer result. Deeper products
+             fall back to NumPy's int32 matrix multiply.
+    '''
+    return 'float32' if depth * 127 * 127 < 2**24 else 'int32'
+
+def gemmInt8(a, b, blockSize=1024) :
+    '''Multiply int8 matrices with int32 accumulation. Both operands stay
+       int8 in memory. Each product is computed in blocks of at most
+       blockSize rows and columns, and only the operands of the current
+       block are widened to gemmType(), so the wide copies never exceed
+       2 * blockSize * depth elements. Widening costs a fraction of
+       1 / blockSize of the multiply.
+
+       a         : numpy.ndarray(int8) (..., depth)
+       b         : numpy.ndarray(int8) (depth, numOutputs)
+       blockSize : rows of a and columns of b widened at once
+       return    : numpy.ndarray(int32) (..., numOutputs)
+    '''
+    dtype = gemmType(a.shape[-1])
+    rows = a.reshape(-1, a.shape[-1])
+    out = np.empty((len(rows), b.shape[1]), dtype='int32')
+    for row in range(0, len(rows), blockSize) :
+        block = rows[row:row + blockSize].astype(dtype)
+        for col in range(0, b.shape[1], blockSize) :
+            out[row:row + blockSize, col:col + blockSize] = np.dot(
+                block, b[:, col:col + blockSize].astype(dtype))
+    return out.reshape(a.shape[:-1] + (b.shape[1],))
+
+def calibrate(network, calibration, batchSize=64) :
+    '''Find the largest input magnitude of every layer over the calibration
+       set, using the float network.
+
+       network     : NumpyNetwork to calibrate
+       calibration : numpy.ndarray of inputs (numInputs, channels, rows, cols)
+       batchSize   : number of inputs activated at once
+       return      : list of the activation scale for each layer input
+    '''
+    numLayers = len(network._spec['layers'])
+    maximum = np.zeros(numLayers)
+    for start in range(0, len(calibration), batchSize) :
+        out = np.asarray(calibration[start:start + batchSize],
+                         dtype='float32')
+        for ii in range(numLayers) :
+            maximum[ii] = max(maximum[ii], float(np.abs(out).max()))
+            out = network._activateLayer(ii, out)
+    return [m / 127. if m > 0. else 1. for m in maximum]
+
+def quantizeNetwork(network, calibration, filepath, perChannel=True,
+                    log=None) :
+    '''Post-training quantization of an exported network. The weights are
+       quantized to int8 with per-channel or per-layer scales, and the input
+       scale of each layer is calibrated on a sample of representative
+       inputs. The result is written for the QuantizedNetwork.
+
+       network     : NumpyNetwork to quantize
+       calibration : numpy.ndarray of inputs (numInputs, channels, rows, cols)
+       filepath    : output file -- this should use the .npz extension
+       perChannel  : use a weight scale per output channel
+       log         : Logger to use
+    '''
+    if log is not None :
+        log.info('Calibrating on [' + str(len(calibration)) + '] inputs')
+    inputScales = calibrate(network, calibration)
+
+    spec = json.loads(json.dumps(network._spec))
+    arrays = {}
+    for ii, (layerSpec, (weights, thresholds)) in enumerate(
+            zip(spec['layers'], network._weights)) :
+        if layerSpec['type'] == 'separable' :
+            raise ValueError('Separable layers are not supported in layer [' +
+                             layerSpec['layerID'] + ']')
+        channelAxis = 0 if layerSpec['type'] == 'convolutional' else 1
+        # sparse layers are quantized densely
+        if not isinstance(weights, np.ndarray) :
+            weights = weights.toarray().T
+        layerSpec.pop('sparse', None)
+        quantized, scale = quantizeWeights(weights, channelAxis, perChannel)
+        layerSpec['inputScale'] = inputScales[ii]
+        arrays['weights' + str(ii)] = quantized
+        arrays['weightScales' + str(ii)] = scale
+        arrays['thresholds' + str(ii)] = thresholds
+    spec['perChannel'] = perChannel
+
+    if log is not None :
+        log.info('Writing the quantized network to [' + filepath + ']')
+    np.savez(filepath, spec=np.array(json.dumps(spec)), **arrays)
+
+class QuantizedNetwork (NumpyNetwork) :
+    '''The QuantizedNetwork classifies with int8 weights and activations.
+       Each layer quantizes its input with the calibrated scale, performs the
+       convolution or matrix multiply in int8 with int32 accumulation, and
+       rescales to float before the thresholds, dropout scaling and
+       activation are applied.
+
+       Max-pooling is performed on the int32 accumulators, as the rescale is
+       positive and does not change the maximum.
+
+       The weights, and the unrolled windows of each layer input, are kept
+       as int8, a quarter of the memory of the NumpyNetwork.
+
+       NOTE: NumPy has no int8 GEMM, so gemmInt8() widens block by block and
+             multiplies with the float32 (or int32) BLAS. The resident
+             memory is reduced, but the arithmetic runs at float32 speed.
+
+       filepath : weights file created by quantizeNetwork()
+    '''
+    def __init__ (self, filepath) :
+        NumpyNetwork.__init__(self, filepath)
+        with np.load(filepath) as archive :
+            self._weightScales = [archive['weightScales' + str(ii)]
+                                  for ii in range(len(self._weights))]
+
+        # the int8 weights as the right-hand operand of gemmInt8()
+        self._gemmWeights = []
+        for layerSpec, (weights, _) in zip(self._spec['layers'],
+                                           self._weights) :
+            if layerSpec['type'] == 'convolutional' :
+                weights = weights.reshape(weights.shape[0], -1).T
+            self._gemmWeights.append(np.ascontiguousarray(weights))
+
+    def _activateLayer (self, ii, inputs) :
+        '''Activate a single layer on the outputs of the previous layer.'''
+        layerSpec = self._spec['layers'][ii]
+        weights, thresholds = self._weights[ii]
+        gemmWeights = self._gemmWeights[ii]
+        inputScale = layerSpec['inputScale']
+        quantized = quantizeActivations(inputs, inputScale)
+        if layerSpec['type'] == 'convolutional' :
+            cols = im2col(quantized, weights.shape[2:])
+            acc = gemmInt8(cols, gemmWeights)
+            acc = maxPool(acc.transpose(0, 3, 1, 2),
+                          layerSpec['downsampleFactor'])
+            scale = inputScale * self._weightScales[ii]
+            out = acc * scale[np.newaxis, :, np.newaxis, np.newaxis] + \
+                  thresholds[np.newaxis, :, np.newaxis, np.newaxis]
+        else :
+            acc = gemmInt8(quantized.reshape(quantized.shape[0], -1),
+                           gemmWeights)
+            out = acc * (inputScale * self._weightScales[ii]) + thresholds
+        out = out.astype('float32')
+
+        # the classification path scales by the dropout retention rate
+        if layerSpec['dropout'] is not None :
+            out /= layerSpec['dropout']
+        activation = _activations[layerSpec['activation']]
+        return out if activation is None else activation(out)
+
+def compareAccuracy(reference, quantized, data, labels, batchSize=64) :
+    '''Measure the accuracy of a quantized network against its float
+       reference on a labeled set.
+
+       reference : NumpyNetwork of the float weights
+       quantized : QuantizedNetwork of the same weights
+       data      : numpy.ndarray of inputs (numInputs, channels, rows, cols)
+       labels    : numpy.ndarray of the integer label of each input
+       batchSize : number of inputs classified at once
+       return    : dictionary of 'float' and 'int8' accuracy, the accuracy
+                   'delta' and the 'agreement' between the two networks
+    '''
+    floatCorrect, intCorrect, agree = 0, 0, 0
+    for start in range(0, len(data), batchSize) :
+        batch = data[start:start + batchSize]
+        expected = labels[start:start + batchSize]
+        floatClass = reference.classify(batch)
+        intClass = quantized.classify(batch)
+        floatCorrect += int(np.sum(floatClass == expected))
+        intCorrect += int(np.sum(intClass == expected))
+        agree += int(np.sum(floatClass == intClass))
+    numInputs = float(len(data))
+    return {'float' : floatCorrect / numInputs,
+            'int8' : intCorrect / numInputs,
+            'delta' : (intCorrect - floatCorrect) / numInputs,
+            'agreement' : agree / numInputs}
+
+
+if __name__ == '__main__' :
+    import argparse
+    from dataset.pickle import readPickleZip
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calibrate', dest='numCalibrate', type=int,
+                        default=500, help='Number of training inputs ' +
+                        'used to calibrate the activation scales.')
+    parser.add_argument('--perLayer', dest='perLayer', action='store_true',
+                        help='Use one weight scale per layer rather than ' +
+                             'per output channel.')
+    parser.add_argument('--out', dest='outFile', type=str, required=True,
+                        help='Quantized weights file to write (.npz).')
+    parser.add_argument('weights', help='Weights file from ' +
+                                        'numpyEngine.exportNetwork().')
+    parser.add_argument('data', help='Labeled pkl.gz file of the training ' +
+                                     'and test sets.')
+    options = parser.parse_args()
+
+    # flatten the mini-batches of the labeled pickle
+    (trainData, trainLabels), (testData, testLabels), labels = \
+        readPickleZip(options.data)
+    trainData = trainData.reshape((-1,) + trainData.shape[2:])
+    testData = testData.reshape((-1,) + testData.shape[2:])
+    testLabels = testLabels.reshape(-1)
+
+    reference = NumpyNetwork(options.weights)
+    sample = np.random.RandomState(0).permutation(
+        len(trainData))[:options.numCalibrate]
+    quantizeNetwork(reference, trainData[np.sort(sample)], options.outFile,
+                    perChannel=not options.perLayer)
+
+    report = compareAccuracy(reference, QuantizedNetwork(options.outFile),
+                             testData, testLabels)
+    print('Float accuracy [' + str(report['float']) + '], int8 accuracy [' +
+          str(report['int8']) + '], delta [' + str(report['delta']) +
+          '], agreement [' + str(report['agreement']) + ']')
@@ -0,0 +1,192 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+def _estimateBytes(network) :
+    '''Estimate the resident size of a network from its weight buffers and
+       the activation buffers its compiled function holds at the compiled
+       batch size, including the feature maps of convolutions before they
+       are pooled. Any scratch workspace theano allocates internally is not
+       counted, so the true footprint may be somewhat larger.
+    '''
+    itemSize = np.dtype(network.getNetworkInput()[0].dtype).itemsize
+    weights = sum(weight.get_value(borrow=True).nbytes
+                  for layer in network._layers
+                  for weight in layer.getWeights())
+    activations = 0
+    for layer in network._layers :
+        activations += int(np.prod(layer.getOutputSize()))
+        if hasattr(layer, 'getFeatureSize') :
+            activations += int(np.prod(layer.getFeatureSize()))
+    return weights + activations * itemSize
+
+class ModelRegistry () :
+    '''The ModelRegistry keeps compiled ClassifierNetworks resident so an
+       inference host serving many synapses only pays the load and compile
+       cost once per model. When the resident networks exceed the memory
+       budget the least recently used network is evicted.
+
+       Request counts are kept for every synapse, including evicted ones, so
+       prefetch() can bring back the most frequently requested models while
+       there is room in the budget.
+
+       maxBytes : memory budget of the resident networks
+       log      : Logger to use
+    '''
+    def __init__ (self, maxBytes=1<<30, log=None) :
+        self._maxBytes = maxBytes
+        self._log = log
+        self._lock = threading.Lock()
+        self._resident = OrderedDict()
+        self._loading = {}
+        self._stats = {}
+
+    def _getStats (self, synapse) :
+        if synapse not in self._stats :
+            self._stats[synapse] = {'requests' : 0, 'hits' : 0, 'loads' : 0,
+                                    'loadTime' : None, 'compileTime' : None,
+                                    'bytes' : None}
+        return self._stats[synapse]
+
+    def _load (self, synapse) :
+        '''Load and compile the network, recording the time of each. The
+           network is warmed up with a batch of the size it was compiled with.
+        '''
+        from nn.net import ClassifierNetwork
+        start = timer()
+        network = ClassifierNetwork(synapse)
+        loaded = timer()
+        network.infer(np.zeros(network.getNetworkInputSize(),
+                               dtype=network.getNetworkInput()[0].dtype))
+        compiled = timer()
+
+        numBytes = _estimateBytes(network)
+        with self._lock :
+            stats = self._getStats(synapse)
+            stats['loads'] += 1
+            stats['loadTime'] = loaded - start
+            stats['compileTime'] = compiled - loaded
+            stats['bytes'] = numBytes
+        if self._log is not None :
+            self._log.info('Loaded [' + synapse + '] in [' +
+                           str(loaded - start) + 's] and compiled in [' +
+                           str(compiled - loaded) + 's]')
+        return network, numBytes
+
+    def _getResidentBytes (self) :
+        return sum(numBytes for _, numBytes in self._resident.values())
+
+    def _evict (self, keep) :
+        '''Remove the least recently used networks until within budget.
+           NOTE: The lock must be held by the caller.
+        '''
+        while self._getResidentBytes() > self._maxBytes :
+            victim = next(iter(self._resident))
+            if victim == keep :
+                # the requested network alone exceeds the budget
+                break
+            del self._resident[victim]
+            if self._log is not None :
+                self._log.info('Evicted [' + victim + ']')
+
+    def _fetch (self, synapse, countRequest) :
+        '''Return the resident network, loading it if necessary. Concurrent
+           requests for the same synapse share a single load.
+        '''
+        while True :
+            with self._lock :
+                if countRequest :
+                    self._getStats(synapse)['requests'] += 1
+                    countRequest = False
+                if synapse in self._resident :
+                    # reinsert to mark the network as most recently used
+                    entry = self._resident.pop(synapse)
+                    self._resident[synapse] = entry
+                    return entry[0], True
+                loading = self._loading.get(synapse)
+                if loading is None :
+                    loading = self._loading[synapse] = threading.Event()
+                    break
+            # another thread is loading this network
+            loading.wait()
+
+        try :
+            network, numBytes = self._load(synapse)
+            with self._lock :
+                self._resident[synapse] = (network, numBytes)
+                self._evict(synapse)
+        finally :
+            with self._lock :
+                del self._loading[synapse]
+            loading.set()
+        return network, False
+
+    def get (self, synapse) :
+        '''Return the compiled network for the synapse file.
+
+           synapse : path to a trained ClassifierNetwork
+           return  : ClassifierNetwork ready to infer()
+        '''
+        network, hit = self._fetch(synapse, True)
+        if hit :
+            with self._lock :
+                self._getStats(synapse)['hits'] += 1
+        return network
+
+    def prefetch (self, minRequests=2) :
+        '''Load the most frequently requested networks which are not resident.
+           Prefetching never evicts a resident network -- networks are only
+           loaded while their last known size fits in the unused budget.
+
+           minRequests : minimum number of requests to consider a network
+           return      : list of synapse files which were loaded
+        '''
+        with self._lock :
+            candidates = sorted(
+                [(stats['requests'], synapse)
+                 for synapse, stats in self._stats.items()
+                 if stats['requests'] >= minRequests and
+                    synapse not in self._resident and
+                    synapse not in self._loading],
+                reverse=True)
+            freeBytes = self._maxBytes - self._getResidentBytes()
+
+        loaded = []
+        for _, synapse in candidates :
+            numBytes = self._stats[synapse]['bytes']
+            if numBytes is not None and numBytes > freeBytes :
+                continue
+            if self._log is not None :
+                self._log.debug('Prefetching [' + synapse + ']')
+            self._fetch(synapse, False)
+            loaded.append(synapse)
+            with self._lock :
+                freeBytes = self._maxBytes - self._getResidentBytes()
+        return loaded
+
+    def prefetchAsync (self, minRequests=2) :
+        '''Run prefetch() in a background thread.
+
+           return : the started threading.Thread
+        '''
+        thread = threading.Thread(target=self.prefetch, args=(minRequests,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def isResident (self, synapse) :
+        with self._lock :
+            return synapse in self._resident
+
+    def getStats (self) :
+        '''Return the per-model statistics. Each entry contains the request
+           and hit counts, the number of loads, the most recent load and
+           compile time in seconds, the estimated size and residency.
+        '''
+        with self._lock :
+            stats = {}
+            for synapse, entry in self._stats.items() :
+                stats[synapse] = dict(entry)
+                stats[synapse]['resident'] = synapse in self._resident
+            return stats
@@ -0,0 +1,203 @@
+from nn.layer import Layer
+import numpy as np
+import theano.tensor as t
+from theano.tensor import tanh, switch
+from theano import shared, config, function
+
+def depthwiseCorrelate(input, weights, kernelShape, outputShape) :
+    '''Correlate each input channel with its own kernel. This is computed
+       as a sum of shifted views of the input, so the graph grows with the
+       kernel area rather than the number of channels.
+
+       input       : theano.tensor (batch size, channels, rows, columns)
+       weights     : theano.tensor (channels, kernelRows, kernelColumns)
+       kernelShape : (kernelRows, kernelColumns)
+       outputShape : (rows, columns) of the correlation
+       return      : theano.tensor (batch size, channels, rows, columns)
+    '''
+    out = 0.
+    for u in range(kernelShape[0]) :
+        for v in range(kernelShape[1]) :
+            out += input[:, :, u:u + outputShape[0], v:v + outputShape[1]] * \
+                   weights[:, u, v].dimshuffle('x', 0, 'x', 'x')
+    return out
+
+def pointwiseCombine(input, weights) :
+    '''Combine the channels at each pixel -- a 1x1 convolution.
+
+       input   : theano.tensor (batch size, channels, rows, columns)
+       weights : theano.tensor (number of kernels, channels)
+       return  : theano.tensor (batch size, number of kernels, rows, columns)
+    '''
+    return t.tensordot(input, weights, axes=[[1], [1]]).dimshuffle(0, 3, 1, 2)
+
+class SeparableConvolutionalLayer(Layer) :
+    '''This class describes a Depthwise Separable Convolutional Layer. Each
+       input channel is first correlated with its own spatial kernel
+       (depthwise), then the channels are combined at every pixel by a 1x1
+       convolution (pointwise). The result is max-pooled as in the
+       ConvolutionalLayer.
+
+       This factors a (kernels, channels, rows, columns) convolution into
+       (channels * rows * columns) + (kernels * channels) weights, which
+       reduces the multiplies by a factor of roughly --
+
+           1 / (1 / kernels + 1 / (rows * columns))
+
+       NOTE: Unlike the ConvolutionalLayer, the depthwise kernels are
+             correlated with the input rather than convolved.
+
+       layerID             : unique name identifier for this layer
+       input               : the input buffer for this layer
+       inputSize           : (batch size, channels, rows, columns)
+       kernelSize          : (number of kernels, channels, rows, columns)
+       downsampleFactor    : (rowFactor, columnFactor)
+       learningRate        : learning rate for all neurons
+       momentumRate        : rate of momentum for all neurons
+                             NOTE: momentum allows for higher learning rates
+       dropout             : rate of retention in a given neuron during
+                             training
+                             NOTE: input layers should be around .8 or .9
+                                   hidden layers should be around .5 or .6
+                                   output layers should always be 1.
+       initialWeights      : pointwise weights to initialize the network
+                             (number of kernels, channels)
+                             None generates random weights for the layer
+       initialThresholds   : thresholds to initialize the network
+                             None generates random thresholds for the layer
+       initialDepthWeights : depthwise kernels to initialize the network
+                             (channels, rows, columns)
+                             None generates random weights for the layer
+       activation          : the sigmoid function to use for activation
+                             this must be a function with a derivative form
+       randomNumGen        : generator for the initial weight values -
+                             type is numpy.random.RandomState
+    '''
+    def __init__ (self, layerID, input, inputSize, kernelSize,
+                  downsampleFactor, learningRate=0.001, momentumRate=0.9,
+                  dropout=None, initialWeights=None, initialThresholds=None,
+                  initialDepthWeights=None, activation=tanh,
+                  randomNumGen=None) :
+        Layer.__init__(self, layerID, learningRate, momentumRate, dropout)
+
+        if inputSize[2] < kernelSize[2] or inputSize[3] < kernelSize[3] :
+            raise ValueError('SeparableConvolutionalLayer Error: ' +
+                             'kernelSize cannot exceed inputSize')
+        if inputSize[1] != kernelSize[1] :
+            raise ValueError('SeparableConvolutionalLayer Error: ' +
+                             'Number of Channels must match in ' +
+                             'inputSize and kernelSize')
+        from theano.tensor.signal.downsample import max_pool_2d
+
+        # theano variables don't actually preserve buffer sizing
+        self.input = input if isinstance(input, tuple) else (input, input)
+
+        self._inputSize = inputSize
+        self._kernelSize = kernelSize
+        self._downsampleFactor = downsampleFactor
+        self._activation = activation
+
+        if initialWeights is None or initialDepthWeights is None :
+            # create a rng if its needed
+            if randomNumGen is None :
+                from numpy.random import RandomState
+                from time import time
+                randomNumGen = RandomState(int(time()))
+
+        # the two stages are initialized separately, as each has its own
+        # fan-in and fan-out. Each depthwise kernel connects one input
+        # channel to one output channel over the kernel area, while each
+        # pointwise weight connects a channel to a kernel at a single pixel.
+        if initialDepthWeights is None :
+            fanIn = fanOut = np.prod(self._kernelSize[2:])
+            scaleFactor = np.sqrt(6. / (fanIn + fanOut))
+            initialDepthWeights = np.asarray(randomNumGen.uniform(
+                low=-scaleFactor, high=scaleFactor,
+                size=(self._kernelSize[1],) + tuple(self._kernelSize[2:])),
+                dtype=config.floatX)
+        self._depthWeights = shared(value=initialDepthWeights, borrow=True)
+
+        if initialWeights is None :
+            downRate = np.prod(self._downsampleFactor)
+            fanIn = self._kernelSize[1]
+            fanOut = self._kernelSize[0] / downRate
+            scaleFactor = np.sqrt(6. / (fanIn + fanOut))
+            initialWeights = np.asarray(randomNumGen.uniform(
+                low=-scaleFactor, high=scaleFactor,
+                size=tuple(self._kernelSize[:2])), dtype=config.floatX)
+        self._weights = shared(value=initialWeights, borrow=True)
+
+        # setup initial values for the thresholds -- if necessary
+        if initialThresholds is None :
+            initialThresholds = np.zeros((self._kernelSize[0],),
+                                         dtype=config.floatX)
+        self._thresholds = shared(value=initialThresholds, borrow=True)
+
+        featureShape = self.getFeatureSize()[2:]
+        def findLogits(input) :
+            depthwise = depthwiseCorrelate(input, self._depthWeights,
+                                           self._kernelSize[2:], featureShape)
+            pointwise = pointwiseCombine(depthwise, self._weights)
+            pooling = max_pool_2d(pointwise, self._downsampleFactor, True)
+            return pooling + self._thresholds.dimshuffle('x', 0, 'x', 'x')
+
+        # both paths are independent of the batch size
+        outClass = findLogits(self.input[0])
+        outTrain = findLogits(self.input[1])
+
+        # determine dropout if requested -- see ConvolutionalLayer
+        if self._dropout is not None :
+            outClass = outClass / self._dropout
+            outTrain = switch(self._randStream.binomial(
+                size=self.getOutputSize()[1:], p=self._dropout), outTrain, 0)
+
+        # activate the layer --
+        # output is a tuple to represent two possible paths through the
+        # computation graph.
+        self.output = (outClass, outTrain) if activation is None else \
+                      (activation(outClass), activation(outTrain))
+
+        # we can call this method to activate the layer
+        self.activate = function([self.input[0]], self.output[0])
+
+    def getWeights(self) :
+        '''This allows the network backprop all layers efficiently.
+           NOTE: The pointwise weights are first, so regularization and
+                 pruning apply to them.
+        '''
+        return [self._weights, self._thresholds, self._depthWeights]
+    def getDepthWeights (self) :
+        '''The depthwise kernels sized (channels, rows, columns)'''
+        return self._depthWeights
+    def getInputSize (self) :
+        '''The initial input size provided at construction. This is sized
+           (batch size, channels, rows, columns)'''
+        return self._inputSize
+    def getKernelSize (self) :
+        '''The initial kernel size provided at construction. This is sized
+           (number of kernels, channels, rows, columns)'''
+        return self._kernelSize
+    def getDownsampleFactor (self) :
+        '''The initial downsample factor provided at construction. This is
+           sized (rowFactor, columnFactor)'''
+        return self._downsampleFactor
+    def getFeatureSize (self) :
+        '''This is the post convolution size of the output.
+           (batch size, number of kernels, rows, columns)'''
+        return (self._inputSize[0],
+                self._kernelSize[0],
+                self._inputSize[2] - self._kernelSize[2] + 1,
+                self._inputSize[3] - self._kernelSize[3] + 1)
+    def getOutputSize (self) :
+        '''This is the post downsample size of the output.
+           (batch size, number of kernels, rows, columns)'''
+        fShape = self.getFeatureSize()
+        return (fShape[0], fShape[1],
+                int(fShape[2] / self._downsampleFactor[0]),
+                int(fShape[3] / self._downsampleFactor[1]))
+    def getCost (self) :
+        '''Estimate the cost of the layer for a single input.'''
+        from nn.costModel import separableCost
+        return separableCost(
+            self._inputSize, self._kernelSize, self._downsampleFactor,
+            bytesPerValue=np.dtype(config.floatX).itemsize)
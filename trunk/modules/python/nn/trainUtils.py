@@ -52,10 +52,13 @@ def trainUnsupervised(network, appName, dataPath, numEpochs=5, stop=30,
 def trainSupervised (network, appName, dataPath, numEpochs=5, stop=30, 
                      synapse=None, base=None, dropout=None, 
                      learnC=None, learnF=None, momentum=None, 
-                     kernel=None, neuron=None, log=None) :
+                     kernel=None, neuron=None, pruner=None, log=None) :
     '''This trains a Neural Network with early stoppage.
        
        network : StackedAENetwork to used for training
+       pruner  : MagnitudePruner applied after each round of epochs. Until
+                 the final sparsity is reached the latest network is always
+                 kept, and early stoppage only begins afterward.
        return  : Path to the trained network. This will be used as a 
                  pre-trainer for the Neural Network
     '''
@@ -69,6 +72,10 @@ def trainSupervised (network, appName, dataPath, numEpochs=5, stop=30,
 
         # run the specified number of epochs
         globalCount = network.trainEpoch(globalCount, numEpochs)
+        if pruner is not None :
+            pruner.prune(globalCount)
+            if not pruner.isComplete(globalCount) :
+                runningAccuracy = 0.0
         # calculate the accuracy against the test set
         curAcc = network.checkAccuracy()
         log.info('Checking Accuracy - {0}s ' \
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported relative to modules/python, eg. 'nn.prune'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
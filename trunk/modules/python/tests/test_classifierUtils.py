@@ -0,0 +1,25 @@
+import numpy as np
+from nn.classifierUtils import _createWindowView
+
+def testWindowViewMatchesSlicing() :
+    image = np.arange(3 * 7 * 9, dtype=np.float32).reshape(3, 7, 9)
+    windows = _createWindowView(image, (3, 4, 5))
+    assert windows.shape == (4, 5, 3, 4, 5)
+    for row in range(windows.shape[0]) :
+        for col in range(windows.shape[1]) :
+            np.testing.assert_array_equal(windows[row, col],
+                                          image[:, row:row + 4, col:col + 5])
+
+def testWindowViewAliasesImage() :
+    image = np.zeros((1, 5, 5), dtype=np.float32)
+    windows = _createWindowView(image, (1, 3, 3))
+    assert not windows.flags.writeable
+    image[0, 2, 2] = 1.
+    assert windows[0, 0, 0, 2, 2] == 1.
+    assert windows[2, 2, 0, 0, 0] == 1.
+
+def testWindowViewWholeImage() :
+    image = np.random.RandomState(0).rand(2, 4, 6).astype(np.float32)
+    windows = _createWindowView(image, image.shape)
+    assert windows.shape == (1, 1) + image.shape
+    np.testing.assert_array_equal(windows[0, 0], image)
@@ -0,0 +1,64 @@
+import numpy as np
+from nn.numpyEngine import convolve, maxPool
+
+def _loopConvolve(inputs, kernel) :
+    numKernels, channels, kernelRows, kernelCols = kernel.shape
+    outRows = inputs.shape[2] - kernelRows + 1
+    outCols = inputs.shape[3] - kernelCols + 1
+    out = np.zeros((inputs.shape[0], numKernels, outRows, outCols))
+    for b in range(inputs.shape[0]) :
+        for k in range(numKernels) :
+            for r in range(outRows) :
+                for c in range(outCols) :
+                    out[b, k, r, c] = np.sum(
+                        inputs[b, :, r:r + kernelRows, c:c + kernelCols] *
+                        kernel[k])
+    return out
+
+def _loopMaxPool(inputs, downsampleFactor) :
+    rowFactor, colFactor = downsampleFactor
+    batchSize, channels, rows, cols = inputs.shape
+    out = np.zeros((batchSize, channels,
+                    rows // rowFactor, cols // colFactor), inputs.dtype)
+    for r in range(out.shape[2]) :
+        for c in range(out.shape[3]) :
+            out[:, :, r, c] = inputs[:, :, r * rowFactor:(r + 1) * rowFactor,
+                                     c * colFactor:(c + 1) * colFactor].max(
+                                     axis=(2, 3))
+    return out
+
+def testConvolveMatchesLoop() :
+    rng = np.random.RandomState(0)
+    inputs = rng.randn(2, 3, 9, 8).astype(np.float32)
+    kernel = rng.randn(4, 3, 3, 2).astype(np.float32)
+    out = convolve(inputs, kernel)
+    assert out.shape == (2, 4, 7, 7)
+    np.testing.assert_allclose(out, _loopConvolve(inputs, kernel),
+                               rtol=1e-4, atol=1e-4)
+
+def testConvolveIsCorrelation() :
+    # an unflipped kernel picks the pixel at its hot spot
+    inputs = np.arange(16, dtype=np.float32).reshape(1, 1, 4, 4)
+    kernel = np.zeros((1, 1, 2, 2), dtype=np.float32)
+    kernel[0, 0, 0, 1] = 1.
+    np.testing.assert_array_equal(convolve(inputs, kernel)[0, 0],
+                                  inputs[0, 0, :3, 1:])
+
+def testMaxPoolMatchesLoop() :
+    rng = np.random.RandomState(1)
+    inputs = rng.randn(2, 3, 8, 6).astype(np.float32)
+    for factor in [(2, 2), (2, 3), (4, 1)] :
+        np.testing.assert_array_equal(maxPool(inputs, factor),
+                                      _loopMaxPool(inputs, factor))
+
+def testMaxPoolIgnoresBorder() :
+    inputs = np.zeros((1, 1, 5, 7), dtype=np.float32)
+    inputs[0, 0, 4, :] = 100.
+    inputs[0, 0, :, 6] = 100.
+    out = maxPool(inputs, (2, 3))
+    assert out.shape == (1, 1, 2, 2)
+    assert np.all(out == 0.)
+
+def testMaxPoolIdentity() :
+    inputs = np.ones((1, 2, 3, 3), dtype=np.float32)
+    assert maxPool(inputs, (1, 1)) is inputs
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from nn.prune import MagnitudePruner, getSparsity
+
+class _Shared () :
+    '''Numpy stand-in for a theano shared variable.'''
+    def __init__ (self, value) :
+        self._value = value
+    def get_value (self, borrow=False) :
+        return self._value if borrow else self._value.copy()
+    def set_value (self, value, borrow=False) :
+        self._value = value if borrow else value.copy()
+
+class _Layer () :
+    '''Numpy stand-in for a layer which supports pruning masks.'''
+    def __init__ (self, layerID, weights) :
+        self.layerID = layerID
+        self._weights = _Shared(weights)
+        self._pruneMask = None
+    def getWeights (self) :
+        return (self._weights, None)
+    def getPruneMask (self) :
+        return self._pruneMask
+    def setPruneMask (self, mask) :
+        self._pruneMask = _Shared(np.asarray(mask, dtype=np.float32))
+        self._weights.set_value(self._weights.get_value() * mask)
+
+class _Network () :
+    def __init__ (self, layers) :
+        self._layers = layers
+        self._trainNetwork = None
+
+def _createPruner(finalSparsity=.8, startEpoch=2, endEpoch=12) :
+    rng = np.random.RandomState(0)
+    layers = [_Layer('conv', rng.randn(8, 3, 5, 5).astype(np.float32)),
+              _Layer('fc', rng.randn(100, 10).astype(np.float32))]
+    network = _Network(layers)
+    return network, MagnitudePruner(network, ['conv', 'fc'], finalSparsity,
+                                    startEpoch, endEpoch)
+
+def testSchedule() :
+    network, pruner = _createPruner()
+    for epoch in range(3) :
+        assert pruner.getTargetSparsity(epoch) == 0.
+    assert pruner.getTargetSparsity(7) == pytest.approx(.8 * (1. - .5 ** 3))
+    assert pruner.getTargetSparsity(12) == pytest.approx(.8)
+    assert pruner.getTargetSparsity(50) == pytest.approx(.8)
+    schedule = [pruner.getTargetSparsity(epoch) for epoch in range(15)]
+    steps = np.diff(schedule[2:13])
+    assert np.all(steps > 0.) and np.all(np.diff(steps) < 0.)
+    assert not pruner.isComplete(11) and pruner.isComplete(12)
+
+def testConstructorPreparesNetwork() :
+    network, pruner = _createPruner()
+    assert not hasattr(network, '_trainNetwork')
+    for layer in network._layers :
+        assert np.all(layer.getPruneMask().get_value() == 1.)
+        assert getSparsity(layer) == 0.
+
+def testPruneReachesSchedule() :
+    network, pruner = _createPruner()
+    rng = np.random.RandomState(1)
+    previous = [np.ones(layer.getWeights()[0].get_value().shape, bool)
+                for layer in network._layers]
+    for epoch in range(15) :
+        sparsity = pruner.prune(epoch)
+        for ii, layer in enumerate(network._layers) :
+            weights = layer.getWeights()[0].get_value()
+            assert getSparsity(layer) == \
+                   pytest.approx(int(sparsity * weights.size) /
+                                 float(weights.size))
+            # pruned weights are never revived
+            kept = layer.getPruneMask().get_value() != 0.
+            assert not np.any(kept & ~previous[ii])
+            previous[ii] = kept
+
+            # emulate a training update which honors the mask
+            weights += .01 * rng.randn(*weights.shape).astype(np.float32)
+            layer.getWeights()[0].set_value(
+                weights * layer.getPruneMask().get_value())
+    assert getSparsity(network._layers[1]) == pytest.approx(.8)
+
+def testInvalidArguments() :
+    network = _Network([_Layer('fc', np.ones((2, 2), np.float32))])
+    with pytest.raises(ValueError) :
+        MagnitudePruner(network, ['fc'], finalSparsity=1.)
+    with pytest.raises(ValueError) :
+        MagnitudePruner(network, ['fc'], startEpoch=5, endEpoch=5)
+    with pytest.raises(ValueError) :
+        MagnitudePruner(network, ['fc', 'missing'])
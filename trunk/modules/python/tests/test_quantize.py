@@ -0,0 +1,49 @@
+import numpy as np
+from nn.quantize import quantizeWeights, gemmInt8
+
+def _roundTripError(weights, channelAxis, perChannel) :
+    quantized, scale = quantizeWeights(weights, channelAxis, perChannel)
+    shape = [1] * weights.ndim
+    shape[channelAxis] = -1
+    restored = quantized.astype(np.float32) * scale.reshape(shape)
+    return quantized, scale, np.abs(restored - weights), shape
+
+def testPerChannelRoundTrip() :
+    rng = np.random.RandomState(0)
+    weights = rng.randn(8, 3, 5, 5).astype(np.float32)
+    weights[2] *= 100.
+    quantized, scale, error, shape = _roundTripError(weights, 0, True)
+    assert quantized.dtype == np.int8 and scale.shape == (8,)
+    assert np.all(np.abs(quantized) <= 127)
+    np.testing.assert_allclose(scale, np.abs(weights).max(axis=(1, 2, 3)) /
+                               127., rtol=1e-6)
+    # rounding is the only error -- at most half a step per channel
+    assert np.all(error <= scale.reshape(shape) / 2. * (1. + 1e-5))
+    # the largest weight of each channel is represented at full scale
+    assert np.all(np.abs(quantized).max(axis=(1, 2, 3)) == 127)
+
+def testPerLayerRoundTrip() :
+    rng = np.random.RandomState(1)
+    weights = rng.randn(20, 6).astype(np.float32)
+    quantized, scale, error, shape = _roundTripError(weights, 1, False)
+    assert scale.shape == (6,) and np.all(scale == scale[0])
+    np.testing.assert_allclose(scale[0], np.abs(weights).max() / 127.,
+                               rtol=1e-6)
+    assert np.all(error <= scale[0] / 2. * (1. + 1e-5))
+
+def testZeroChannel() :
+    weights = np.zeros((4, 3), dtype=np.float32)
+    weights[:, 0] = 1.
+    quantized, scale = quantizeWeights(weights, 1)
+    assert np.all(np.isfinite(scale))
+    assert np.all(quantized[:, 1:] == 0)
+
+def testGemmInt8IsExact() :
+    rng = np.random.RandomState(2)
+    for depth in [64, 2000] :
+        a = rng.randint(-127, 128, (2, 5, depth)).astype(np.int8)
+        b = rng.randint(-127, 128, (depth, 7)).astype(np.int8)
+        out = gemmInt8(a, b, blockSize=3)
+        assert out.dtype == np.int32 and out.shape == (2, 5, 7)
+        np.testing.assert_array_equal(
+            out, np.dot(a.astype(np.int64), b.astype(np.int64)))
@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import numpy as np
+from timeit import default_timer as timer
+
+from nn.profiler import setupLogging
+
+'''This application searches for student networks to train with the dark
+   knowledge of the distillery. Student topologies are sampled at random,
+   candidates slower than the latency budget are discarded, and the rest are
+   trained briefly. The Pareto frontier of accuracy against per-chip latency
+   is reported, so the best student for any latency can be chosen and
+   trained fully with distillery.py.
+
+   NOTE: Candidates are timed while other candidates train in parallel, so
+         the frontier networks are timed again serially once the search ends.
+         Limit the BLAS threads of each worker (e.g. OMP_NUM_THREADS=1) for
+         stable measurements.
+'''
+
+def sampleTopology(rng, inputSize, maxConv=2, maxFull=2,
+                   kernels=(8, 16, 32, 64), kernelSizes=(3, 5),
+                   neurons=(32, 64, 128, 256)) :
+    '''Sample a student topology which fits the input. Every convolution
+       must be smaller than its input, as ConvolutionalLayer requires.
+
+       rng         : numpy.random.RandomState
+       inputSize   : (channels, rows, cols) of the network input
+       maxConv     : maximum number of convolutional layers
+       maxFull     : maximum number of hidden fully-connected layers
+       kernels     : choices for the number of kernels in each layer
+       kernelSizes : choices for the square kernel size
+       neurons     : choices for the number of neurons in each layer
+       return      : dictionary of 'conv' -- a list of [kernels, kernelSize,
+                     downsample] -- and 'full' -- a list of neurons
+    '''
+    while True :
+        rows, cols = inputSize[1:]
+        conv = []
+        fits = True
+        for ii in range(rng.randint(0, maxConv + 1)) :
+            kernelSize = int(rng.choice(kernelSizes))
+            downsample = int(rng.choice((1, 2)))
+            fits = fits and rows > kernelSize and cols > kernelSize
+            rows = (rows - kernelSize + 1) // downsample
+            cols = (cols - kernelSize + 1) // downsample
+            conv.append([int(rng.choice(kernels)), kernelSize, downsample])
+        full = [int(rng.choice(neurons))
+                for ii in range(rng.randint(1, maxFull + 1))]
+        if fits and rows > 0 and cols > 0 :
+            return {'conv' : conv, 'full' : full}
+
+def createStudent(train, test, labels, topology, rng=None) :
+    '''Create a TrainerNetwork for the topology. The learning rates follow
+       shallowNet.createNetwork().
+
+       train    : theano.shared dark knowledge training set
+       test     : theano.shared test set
+       labels   : list of the label names
+       topology : dictionary created by sampleTopology()
+       return   : TrainerNetwork
+    '''
+    import theano.tensor as t
+    from theano import config
+    from nn.net import TrainerNetwork
+    from nn.contiguousLayer import ContiguousLayer
+    from nn.convolutionalLayer import ConvolutionalLayer
+
+    network = TrainerNetwork(train, test, labels)
+    inputSize = train[0].get_value(borrow=True).shape[1:]
+    input = t.tensor4('input', dtype=config.floatX)
+    for ii, (numKernels, kernelSize, downsample) in \
+            enumerate(topology['conv']) :
+        network.addLayer(ConvolutionalLayer(
+            layerID='c' + str(ii + 1), input=input, inputSize=inputSize,
+            kernelSize=(numKernels, inputSize[1], kernelSize, kernelSize),
+            downsampleFactor=(downsample, downsample), randomNumGen=rng,
+            learningRate=.08, momentumRate=.1))
+        input = network.getNetworkOutput()
+        inputSize = network.getNetworkOutputSize()
+
+    # the hidden layers are followed by the linear output layer
+    numHidden = len(topology['full'])
+    for ii, numNeurons in enumerate(topology['full'] + [len(labels)]) :
+        output = ii == numHidden
+        network.addLayer(ContiguousLayer(
+            layerID='f' + str(len(network._layers) + 1), input=input,
+            inputSize=(inputSize[0], int(np.prod(inputSize[1:]))),
+            numNeurons=numNeurons, randomNumGen=rng,
+            learningRate=.015 if output else .025,
+            momentumRate=.3 if output else .2,
+            activation=None if output else t.tanh))
+        input = network.getNetworkOutput()
+        inputSize = network.getNetworkOutputSize()
+    return network
+
+def measureLatency(network, chips, repeat=10) :
+    '''Measure the per-chip latency of the network. Each call classifies a
+       single chip, so the latency is not amortized over a batch.
+
+       network : ClassifierNetwork to time
+       chips   : numpy.ndarray batch of inputs
+       repeat  : number of timed calls -- the median is used
+       return  : seconds per chip
+    '''
+    network.infer(chips[:1])
+    times = []
+    for ii in range(repeat) :
+        chip = chips[ii % len(chips)][np.newaxis]
+        start = timer()
+        network.infer(chip)
+        times.append(timer() - start)
+    return float(np.median(times))
+
+def paretoFrontier(results) :
+    '''Find the candidates which no other candidate beats in both accuracy
+       and latency.
+
+       results : list of dictionaries with 'accuracy' and 'latency'
+       return  : the frontier in order of increasing latency
+    '''
+    frontier = []
+    for result in sorted(results, key=lambda r : (r['latency'],
+                                                  -r['accuracy'])) :
+        if len(frontier) == 0 or \
+           result['accuracy'] > frontier[-1]['accuracy'] :
+            frontier.append(result)
+    return frontier
+
+# state of each worker process -- see _initSearchWorker()
+_searchState = {}
+
+def _initSearchWorker(dark, latencyBudget, numEpochs, base) :
+    '''Share the dark knowledge, read once by the parent, with the worker.'''
+    from dataset.shared import splitToShared
+    train, test, labels = dark
+    _searchState.update(
+        chips=np.asarray(train[0][0]),
+        train=splitToShared(train, castLabelInt=False),
+        test=splitToShared(test), labels=labels,
+        latencyBudget=latencyBudget, numEpochs=numEpochs, base=base)
+
+def _evaluateStudent(candidate) :
+    '''Build, time and briefly train a single candidate.
+
+       candidate : (candidate id, topology)
+       return    : dictionary of the 'id', 'topology', 'latency' and
+                   'accuracy', with the 'synapse' saved for candidates within
+                   the latency budget. Failures return an 'error' and are
+                   rejected like candidates over the budget.
+    '''
+    candidateID, topology = candidate
+    result = {'id' : candidateID, 'topology' : topology}
+    try :
+        network = createStudent(_searchState['train'], _searchState['test'],
+                                _searchState['labels'], topology,
+                                np.random.RandomState(candidateID))
+        result['latency'] = measureLatency(network, _searchState['chips'])
+        if result['latency'] > _searchState['latencyBudget'] :
+            result['accuracy'] = None
+            return result
+
+        start = timer()
+        network.trainEpoch(0, _searchState['numEpochs'])
+        result['accuracy'] = network.checkAccuracy()
+        result['trainTime'] = timer() - start
+        result['synapse'] = _searchState['base'] + '_student' + \
+                            str(candidateID) + '.pkl.gz'
+        network.save(result['synapse'])
+    except Exception as ex :
+        result['accuracy'] = None
+        result['error'] = str(ex)
+    return result
+
+def _readResults(outputFile) :
+    '''Read the results of a previous search.'''
+    results = {}
+    if os.path.exists(outputFile) :
+        with open(outputFile, 'r') as f :
+            for line in f :
+                if line.strip() :
+                    result = json.loads(line)
+                    results[result['id']] = result
+    return results
+
+def searchStudents(dark, outputFile, numCandidates, latencyBudget,
+                   numEpochs=2, numWorkers=None, base='./student', seed=0,
+                   log=None, **sampling) :
+    '''Sample and evaluate student topologies in parallel processes. Each
+       result is appended to the JSON Lines output file as it completes, so
+       an interrupted search resumes with the remaining candidates.
+
+       The dark knowledge is read once, before the worker processes start.
+
+       dark          : pkl.gz file created by the distillery, or the
+                       (train, test, labels) already read from it
+       outputFile    : JSON Lines file of the candidate results
+       numCandidates : number of topologies to sample
+       latencyBudget : maximum seconds per chip. Slower candidates are not
+                       trained.
+       numEpochs     : number of epochs to train each candidate
+       numWorkers    : number of processes. None uses the number of CPUs.
+       base          : base name of the candidate synapses
+       seed          : seed of the topology sampling
+       log           : Logger to use
+       sampling      : additional arguments to sampleTopology()
+       return        : list of all results
+    '''
+    import multiprocessing
+    from six import string_types
+    from dataset.pickle import readPickleZip
+
+    if isinstance(dark, string_types) :
+        dark = readPickleZip(dark)
+
+    # sample every candidate up front, so resuming evaluates the same ones
+    inputSize = dark[0][0].shape[2:]
+    rng = np.random.RandomState(seed)
+    candidates = [(ii, sampleTopology(rng, inputSize, **sampling))
+                  for ii in range(numCandidates)]
+    results = _readResults(outputFile)
+    remaining = [c for c in candidates if c[0] not in results]
+    if log is not None :
+        log.info('Evaluating [' + str(len(remaining)) + '] of [' +
+                 str(numCandidates) + '] candidates')
+
+    pool = multiprocessing.Pool(numWorkers, _initSearchWorker,
+                                (dark, latencyBudget, numEpochs, base))
+    try :
+        with open(outputFile, 'a') as f :
+            for result in pool.imap_unordered(_evaluateStudent, remaining) :
+                f.write(json.dumps(result) + '\n')
+                f.flush()
+                results[result['id']] = result
+                if log is not None :
+                    log.info('Candidate [' + str(result['id']) + '] ' +
+                             json.dumps(result['topology']) + ' latency [' +
+                             str(result.get('latency')) + 's] accuracy [' +
+                             str(result.get('accuracy')) + '%]' +
+                             (' error [' + result['error'] + ']'
+                              if 'error' in result else ''))
+        pool.close()
+    except :
+        pool.terminate()
+        raise
+    finally :
+        pool.join()
+    return [results[c[0]] for c in candidates if c[0] in results]
+
+def retimeFrontier(results, chips, log=None) :
+    '''Time the frontier candidates serially and recompute the frontier.
+
+       results : list of candidate results
+       chips   : numpy.ndarray batch of inputs for timing
+       return  : the frontier with the serial latencies
+    '''
+    from nn.net import ClassifierNetwork
+    frontier = paretoFrontier([r for r in results
+                               if r.get('accuracy') is not None])
+    for result in frontier :
+        result['latency'] = measureLatency(
+            ClassifierNetwork(result['synapse'], log=log), chips)
+    return paretoFrontier(frontier)
+
+
+if __name__ == '__main__' :
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', dest='logfile', type=str, default=None,
+                        help='Specify log output file.')
+    parser.add_argument('--level', dest='level', default='INFO', type=str,
+                        help='Log Level.')
+    parser.add_argument('--candidates', dest='numCandidates', type=int,
+                        default=32, help='Number of topologies to sample.')
+    parser.add_argument('--budget', dest='budget', type=float, required=True,
+                        help='Latency budget in milliseconds per chip.')
+    parser.add_argument('--epoch', dest='numEpochs', type=int, default=2,
+                        help='Number of epochs to train each candidate.')
+    parser.add_argument('--workers', dest='numWorkers', type=int,
+                        default=None, help='Number of worker processes.')
+    parser.add_argument('--maxConv', dest='maxConv', type=int, default=2,
+                        help='Maximum number of convolutional layers.')
+    parser.add_argument('--maxFull', dest='maxFull', type=int, default=2,
+                        help='Maximum number of hidden fully-connected ' +
+                             'layers.')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='Seed of the topology sampling.')
+    parser.add_argument('--base', dest='base', type=str, default='./student',
+                        help='Base name of the results and candidate ' +
+                             'networks.')
+    parser.add_argument('dark', help='pkl.gz file previously created by ' +
+                                     'the distillery.')
+    options = parser.parse_args()
+
+    log = setupLogging('studentSearch: ' + options.dark,
+                       options.level, options.logfile)
+
+    from dataset.pickle import readPickleZip
+    dark = readPickleZip(options.dark)
+    results = searchStudents(dark, options.base + '_search.jsonl',
+                             options.numCandidates, options.budget / 1000.,
+                             options.numEpochs, options.numWorkers,
+                             options.base, options.seed, log,
+                             maxConv=options.maxConv, maxFull=options.maxFull)
+
+    chips = np.asarray(dark[0][0][0])
+    for result in retimeFrontier(results, chips, log) :
+        log.info('Frontier [' + result['synapse'] + '] ' +
+                 json.dumps(result['topology']) + ' latency [' +
+                 str(result['latency'] * 1000.) + 'ms] accuracy [' +
+                 str(result['accuracy']) + '%]')